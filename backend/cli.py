@@ -2,12 +2,13 @@
 # -*- coding: utf-8 -*-
 import asyncio
 from dataclasses import dataclass
-from typing import Annotated
+from typing import Annotated, Literal
 
 import cappa
 import granian
 from cappa.output import error_format
 from rich import get_console
+from rich.markup import escape
 from rich.panel import Panel
 from rich.text import Text
 from watchfiles import PythonFilter
@@ -25,6 +26,34 @@ class CustomReloadFilter(PythonFilter):
         super().__init__(extra_extensions=['.json', '.yaml', '.yml'])
 
 
+def prepare_workers(workers: int) -> None:
+    """在创建工作进程前完成一次性的数据库初始化与迁移，并告知工作进程（开发模式下代码变化后由工作进程自行迁移）"""
+    import os
+
+    from backend.core.db import DATABASE_READY_ENV
+    from backend.core.repository import get_repository
+
+    repository = get_repository()
+    repository.initialize()
+    repository.ensure_file_stats()
+    # 工作进程各自建立连接（连接池），不继承父进程的连接
+    repository.close()
+
+    os.environ[DATABASE_READY_ENV] = '1'
+    # fork 出的工作进程沿用已加载的配置，spawn 出的工作进程从环境变量读取
+    settings.SERVER_WORKERS = workers
+    os.environ['SERVER_WORKERS'] = str(workers)
+
+
+def warn_missing_compression() -> None:
+    """STORAGE_MODE 为 compact 但未安装 zstandard 时提示安装 compact 可选依赖"""
+    from backend.core.storage import COMPACT_INSTALL_HINT, STORAGE_COMPACT, compression_available
+
+    if settings.STORAGE_MODE == STORAGE_COMPACT and not compression_available():
+        console.print(f'[yellow]STORAGE_MODE=compact 但未安装 zstandard，新导入的文件只驻留 system 提示词，'
+                      f'不压缩 response（{escape(COMPACT_INSTALL_HINT)}）[/]')
+
+
 def run(host: str, port: int, reload: bool, workers: int) -> None:
     url = f'http://{host}:{port}'
     docs_url = url + settings.FASTAPI_DOCS_URL
@@ -37,6 +66,9 @@ def run(host: str, port: int, reload: bool, workers: int) -> None:
     panel_content.append(f'📡 OpenAPI JSON: {openapi_url}\n', style='green')
 
     console.print(Panel(panel_content, title='WeBZ服务信息', border_style='purple', padding=(1, 2)))
+    warn_missing_compression()
+    if reload:
+        prepare_workers(workers)
     granian.Granian(
         target='backend.main:app',
         interface='asgi',
@@ -76,10 +108,261 @@ class Run:
         run(host=self.host, port=self.port, reload=self.no_reload, workers=self.workers)
 
 
+def stats(rebuild: bool, filename: str | None) -> None:
+    from backend.core.repository import get_repository
+
+    repository = get_repository()
+    repository.initialize()
+
+    if rebuild:
+        file_id = None
+        if filename:
+            file_info = repository.get_file_info(filename)
+            if not file_info:
+                raise cappa.Exit(f'文件不存在: {filename}', code=1)
+            file_id = file_info['id']
+        count = repository.rebuild_file_stats(file_id)
+        console.print(f'[green]已重建 {count} 个文件的统计计数器[/]')
+        return
+
+    mismatches = repository.check_file_stats()
+    if filename:
+        mismatches = [item for item in mismatches if item['filename'] == filename]
+    if not mismatches:
+        console.print('[green]统计计数器一致[/]')
+        return
+
+    for item in mismatches:
+        console.print(f'[red]{item["filename"]}[/] 计数器: {item["stored"]} 实际: {item["expected"]}')
+    raise cappa.Exit('统计计数器不一致，可使用 `--rebuild` 重建', code=1)
+
+
+@cappa.command(help='检查或重建文件标注统计计数器', default_long=True)
+@dataclass
+class Stats:
+    rebuild: Annotated[
+        bool,
+        cappa.Arg(default=False, help='根据数据记录全量重建统计计数器'),
+    ]
+    filename: Annotated[
+        str | None,
+        cappa.Arg(default=None, help='仅处理指定文件（上传后的文件名），默认处理所有文件'),
+    ]
+
+    def __call__(self):
+        stats(rebuild=self.rebuild, filename=self.filename)
+
+
+def check_plans(rows: int, verbose: bool) -> None:
+    from backend.devtools.plans import check_query_plans
+
+    def report(result: dict) -> None:
+        if result['problems']:
+            console.print(f'[red]✗[/] {result["sql"]}')
+            for step in result['plan']:
+                style = 'red' if step in result['problems'] else 'dim'
+                console.print(f'    [{style}]{step}[/]')
+        elif verbose:
+            console.print(f'[green]✓[/] {result["sql"]}')
+            for step in result['plan']:
+                console.print(f'    [dim]{step}[/]')
+
+    results = check_query_plans(rows, on_statement=report)
+    failed = [result for result in results if result['problems']]
+    if failed:
+        raise cappa.Exit(f'{len(failed)}/{len(results)} 条查询出现全表扫描或临时排序', code=1)
+    console.print(f'[green]{len(results)} 条查询的执行计划均使用索引[/]')
+
+
+@cappa.command(name='check-plans', help='检查各类查询的执行计划，出现全表扫描或临时排序时返回非零退出码',
+               default_long=True)
+@dataclass
+class CheckPlans:
+    rows: Annotated[
+        int,
+        cappa.Arg(default=2000, help='临时数据库中每个样例文件的记录数'),
+    ]
+    verbose: Annotated[
+        bool,
+        cappa.Arg(default=False, help='同时输出通过检查的查询及其执行计划'),
+    ]
+
+    def __call__(self):
+        check_plans(rows=self.rows, verbose=self.verbose)
+
+
+def check_storage(backend: str, dsn: str | None, rows: int) -> None:
+    from backend.devtools.conformance import check_storage as run_checks
+
+    def report(result: dict) -> None:
+        mark = '[green]✓[/]' if result['ok'] else '[red]✗[/]'
+        detail = f'  [dim]{result["detail"]}[/]' if result['ok'] else f'  [red]{result["detail"]}[/]'
+        console.print(f'{mark} {result["name"]:<24} {result["elapsed"] * 1000:>9.1f} ms{detail if result["detail"] else ""}')
+
+    results = run_checks(backend, dsn, rows, on_check=report)
+    failed = [result for result in results if not result['ok']]
+    if failed:
+        raise cappa.Exit(f'{len(failed)}/{len(results)} 项检查未通过', code=1)
+    console.print(f'[green]{backend} 后端通过全部 {len(results)} 项检查，'
+                  f'共耗时 {sum(result["elapsed"] for result in results):.2f} 秒[/]')
+
+
+@cappa.command(name='check-storage', help='在样例数据上检查存储后端的行为一致性并计时，未通过时返回非零退出码',
+               default_long=True)
+@dataclass
+class CheckStorage:
+    backend: Annotated[
+        Literal['sqlite', 'postgres'],
+        cappa.Arg(default='sqlite', help='要检查的存储后端'),
+    ]
+    dsn: Annotated[
+        str | None,
+        cappa.Arg(default=None, help='PostgreSQL 连接串（默认使用 POSTGRES_DSN），请指向专门用于检查的数据库'),
+    ]
+    rows: Annotated[
+        int,
+        cappa.Arg(default=2000, help='每个样例文件的记录数'),
+    ]
+
+    def __call__(self):
+        check_storage(backend=self.backend, dsn=self.dsn, rows=self.rows)
+
+
+async def check_latency(rows: int, max_p99_ms: float) -> None:
+    from backend.devtools.loadcheck import check_annotate_latency
+
+    def report(result: dict) -> None:
+        console.print(f'{result["name"]:<10} {result["requests"]:>6} 次标注  p50 {result["p50_ms"]:>7.1f} ms  '
+                      f'p99 {result["p99_ms"]:>7.1f} ms  max {result["max_ms"]:>7.1f} ms  '
+                      f'失败 {result["errors"]}  [dim]{result["elapsed"]:.1f} 秒[/]')
+
+    results = await check_annotate_latency(rows, on_phase=report)
+    failed = [result for result in results if result['errors'] or result['p99_ms'] > max_p99_ms]
+    if failed:
+        raise cappa.Exit(f'{", ".join(result["name"] for result in failed)} 阶段的标注请求失败或 p99 超过 {max_p99_ms} ms',
+                         code=1)
+    console.print(f'[green]导出和导入期间标注请求的 p99 均不超过 {max_p99_ms} ms[/]')
+
+
+@cappa.command(name='check-latency', help='测量导出和导入期间 /api/annotate 的延迟，p99 超过上限时返回非零退出码',
+               default_long=True)
+@dataclass
+class CheckLatency:
+    rows: Annotated[
+        int,
+        cappa.Arg(default=200000, help='导出和导入的样例文件记录数'),
+    ]
+    max_p99_ms: Annotated[
+        float,
+        cappa.Arg(default=500.0, help='各阶段标注请求 p99 延迟的上限（毫秒）'),
+    ]
+
+    async def __call__(self):
+        await check_latency(rows=self.rows, max_p99_ms=self.max_p99_ms)
+
+
+def bench_workers(workers: list[int], rows: int, duration: float, import_rows: int) -> None:
+    import os
+
+    from backend.devtools.loadcheck import check_worker_scaling
+
+    def report(result: dict) -> None:
+        import_time = f'  导入 {result["import_seconds"]:.1f} 秒' if result['import_seconds'] is not None else ''
+        console.print(f'{result["workers"]:>3} 个进程  标注 {result["annotations_per_second"]:>8.1f} 次/秒  '
+                      f'读取 {result["reads_per_second"]:>8.1f} 次/秒  失败 {result["errors"]}{import_time}')
+
+    console.print(f'[dim]CPU 核数: {os.cpu_count()}[/]')
+    results = check_worker_scaling(workers, rows=rows, duration=duration, import_rows=import_rows, on_round=report)
+    if any(result['errors'] for result in results):
+        raise cappa.Exit('部分标注或读取请求失败（等待写锁超时）', code=1)
+
+
+@cappa.command(name='bench-workers', help='测量不同工作进程数下标注写入和分页读取的吞吐量（SQLite）', default_long=True)
+@dataclass
+class BenchWorkers:
+    workers: Annotated[
+        list[int],
+        cappa.Arg(default=[1, 2, 4], help='依次测量的工作进程数'),
+    ]
+    rows: Annotated[
+        int,
+        cappa.Arg(default=50000, help='样例文件记录数'),
+    ]
+    duration: Annotated[
+        float,
+        cappa.Arg(default=5.0, help='每轮测量的时长（秒）'),
+    ]
+    import_rows: Annotated[
+        int,
+        cappa.Arg(default=100000, help='每轮同时在另一个进程中导入的记录数，0 表示不导入'),
+    ]
+
+    def __call__(self):
+        bench_workers(workers=self.workers, rows=self.rows, duration=self.duration, import_rows=self.import_rows)
+
+
+def compact(filename: str | None, vacuum: bool) -> None:
+    import os
+
+    from backend.core.crud import compact_file_storage, get_all_files, get_file_info
+    from backend.core.db import DATABASE_FILE, init_database, connect
+    from backend.core.repository import DATABASE_SQLITE
+    from backend.core.storage import COMPACT_INSTALL_HINT, compression_available
+
+    if settings.DATABASE_BACKEND != DATABASE_SQLITE:
+        raise cappa.Exit('压缩存储只适用于 SQLite 后端（PostgreSQL 由 TOAST 自动压缩大字段）', code=1)
+
+    init_database()
+
+    if filename:
+        file_info = get_file_info(filename)
+        if not file_info:
+            raise cappa.Exit(f'文件不存在: {filename}', code=1)
+        files = [file_info]
+    else:
+        files = get_all_files()
+    if not compression_available():
+        console.print(f'[yellow]未安装 zstandard，仅驻留 system 提示词，不压缩 response（{escape(COMPACT_INSTALL_HINT)}）[/]')
+
+    size_before = os.path.getsize(DATABASE_FILE)
+    for file_info in files:
+        result = compact_file_storage(file_info['id'])
+        console.print(f'{file_info["filename"]}: 驻留 system {result["interned_system_count"]} 条，'
+                      f'压缩文本 {result["compressed_text_count"]} 条，'
+                      f'节省 {result["compressed_bytes_saved"] / 1024 / 1024:.1f} MB')
+
+    if vacuum:
+        conn = connect()
+        try:
+            conn.execute('VACUUM')
+        finally:
+            conn.close()
+        size_after = os.path.getsize(DATABASE_FILE)
+        console.print(f'[green]数据库大小: {size_before / 1024 / 1024:.1f} MB -> {size_after / 1024 / 1024:.1f} MB[/]')
+    else:
+        console.print('[green]转换完成，释放的页面会被后续写入复用，使用 `--vacuum` 可立即缩小数据库文件[/]')
+
+
+@cappa.command(help='将已导入的文件转换为压缩存储（驻留重复的 system 提示词、压缩 response）', default_long=True)
+@dataclass
+class Compact:
+    filename: Annotated[
+        str | None,
+        cappa.Arg(default=None, help='仅处理指定文件（上传后的文件名），默认处理所有文件'),
+    ]
+    vacuum: Annotated[
+        bool,
+        cappa.Arg(default=False, help='转换后执行 VACUUM 缩小数据库文件（期间阻塞所有读写）'),
+    ]
+
+    def __call__(self):
+        compact(filename=self.filename, vacuum=self.vacuum)
+
+
 @cappa.command(help='webz命令行界面', default_long=True)
 @dataclass
 class WeMCPCli:
-    subcmd: cappa.Subcommands[Run | None] = None
+    subcmd: cappa.Subcommands[Run | Stats | CheckPlans | CheckStorage | CheckLatency | BenchWorkers | Compact | None] = None
 
 
 def main() -> None:
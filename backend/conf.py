@@ -30,6 +30,80 @@ class Settings(BaseSettings):
     FASTAPI_OPENAPI_URL: str | None = '/openapi'
     FASTAPI_STATIC_FILES: bool = True
 
+    # 上传与导入
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024  # 上传文件分块写盘大小（字节）
+    INGEST_BATCH_SIZE: int = 1000  # 每批写入 data_records 的记录数
+    INGEST_COMMIT_BATCHES: int = 1  # 上传时直接导入每写入多少批提交一次（两次提交之间其他连接可以写入）
+    INGEST_MAX_REPORTED_ERRORS: int = 100  # 上传结果中最多返回的解析错误数
+    INGEST_CONCURRENCY: int = 2  # 同时执行的上传导入数（不经过写队列）
+
+    # 去重
+    INGEST_DEDUP_MODE: Literal['off', 'skip', 'link'] = 'off'  # 完全重复记录的默认处理方式：不处理、跳过或关联
+    DEDUP_PROPAGATE_LABELS: bool = True  # 标注关联的重复记录之一时，同步标注其余尚未标注的记录
+    NEAR_DUP_NUM_PERM: int = 64  # MinHash 签名长度
+    NEAR_DUP_BANDS: int = 16  # LSH 分段数（签名长度必须是其整数倍）
+    NEAR_DUP_THRESHOLD: float = 0.8  # 估计 Jaccard 相似度不低于该值视为近似重复
+    NEAR_DUP_SHINGLE_SIZE: int = 5  # 字符 shingle 长度
+
+    # 压缩存储（compact 模式：重复的 system 提示词驻留在 system_prompts 表，较长的 response 用 zstd 压缩）
+    STORAGE_MODE: Literal['plain', 'compact'] = 'plain'  # 新导入文件的存储方式（压缩需要安装 compact 可选依赖）
+    STORAGE_INTERN_MIN_LENGTH: int = 32  # system 提示词达到该长度才驻留
+    COMPRESS_MIN_LENGTH: int = 256  # response 达到该长度才压缩
+    COMPRESS_LEVEL: int = 3  # zstd 压缩级别
+    COMPRESS_DICT_SIZE: int = 64 * 1024  # 每个文件训练的压缩字典大小
+    COMPRESS_DICT_SAMPLES: int = 2000  # 训练字典使用的样本数
+
+    # 存储后端（postgres 需要安装 psycopg 和 psycopg_pool，多个节点可共用同一个数据库）
+    DATABASE_BACKEND: Literal['sqlite', 'postgres'] = 'sqlite'
+    POSTGRES_DSN: str = 'postgresql://postgres@localhost:5432/webz'
+    POSTGRES_POOL_MIN_SIZE: int = 2  # 连接池保持的最少连接数
+    POSTGRES_POOL_MAX_SIZE: int = 16  # 连接池最多连接数（不少于读线程数 + 写线程 + 后台任务线程）
+    POSTGRES_POOL_TIMEOUT: float = 30.0  # 等待空闲连接的超时时间（秒）
+
+    # SQLite
+    SQLITE_BUSY_TIMEOUT: int = 5000  # 等待写锁的超时时间（毫秒）
+    SQLITE_BUSY_RETRIES: int = 3  # 等待写锁超时（SQLITE_BUSY）后写操作的重试次数
+    SQLITE_BUSY_RETRY_DELAY: float = 0.1  # 首次重试前的等待时间（秒），之后每次翻倍
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024  # 内存映射读取的大小（字节）
+    SQLITE_CACHED_STATEMENTS: int = 256  # 每个连接缓存的预编译语句数
+    DB_READ_CONCURRENCY: int = 8  # 读操作线程池大小（并发读上限）
+    DB_WRITE_QUEUE_SIZE: int = 1000  # 写队列中允许排队的最大写操作数
+
+    # 文件信息缓存（按文件名缓存 files 表的记录；多进程或多节点部署时其他进程的修改最迟在 TTL 后可见）
+    FILE_INFO_CACHE_SIZE: int = 1024  # 最多缓存的文件数，0 表示不缓存
+    FILE_INFO_CACHE_TTL: float = 10.0  # 缓存有效期（秒），0 表示不缓存
+
+    # 列表页与统计接口的响应缓存（键包含文件版本号，数据变化后旧条目不再命中）
+    PAGE_CACHE_SIZE: int = 512  # 最多缓存的序列化响应数，0 表示不缓存
+    PAGE_CACHE_TTL: float = 300.0  # 缓存有效期（秒），0 表示不缓存
+
+    # 标注任务队列
+    WORK_QUEUE_LEASE_SECONDS: float = 300.0  # 领取的记录在此时间内未标注则重新进入队列（每次领取时续期）
+    WORK_QUEUE_MAX_BATCH: int = 100  # 每批最多领取的条数
+
+    # 标注合并提交
+    ANNOTATION_COMMIT_MAX_DELAY: float = 0.005  # 收集标注写入的最长等待时间（秒），0 表示不等待
+    ANNOTATION_COMMIT_MAX_BATCH: int = 256  # 每次提交的最大标注条数
+
+    # 实时推送
+    FILE_EVENT_INTERVAL: float = 0.2  # 统计信息变化后合并推送的间隔（秒）
+    FILE_EVENT_QUEUE_SIZE: int = 1000  # 每个订阅连接最多缓存的未发送事件数
+    FILE_EVENT_KEEPALIVE: float = 15.0  # 没有事件时发送心跳注释的间隔（秒）
+    FILE_EVENT_RETENTION: float = 60.0  # 多进程部署时经数据库转发的事件保留时长（秒）
+
+    # 多进程部署
+    SERVER_WORKERS: int = 1  # 服务工作进程数（由 `webz run --workers` 设置），大于 1 时实时事件在进程间转发
+
+    # 导出
+    EXPORT_FETCH_SIZE: int = 5000  # 导出时每次从游标读取的记录数
+    EXPORT_BUFFER_SIZE: int = 1024 * 1024  # 导出文件写缓冲区大小（字节）
+
+    # 后台任务
+    JOB_WORKERS: int = 2  # 同时执行的后台任务数
+    JOB_COMMIT_BATCHES: int = 10  # 导入任务每写入多少批提交一次并记录断点
+    JOB_STALE_SECONDS: int = 60  # 执行中任务超过该时间没有心跳即视为中断，可被重新认领
+    JOB_EVENT_INTERVAL: float = 1.0  # SSE 推送任务进度的间隔（秒）
+
     @model_validator(mode='before')
     @classmethod
     def check_env(cls, values: Any) -> Any:
@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Generic, Hashable, Optional, TypeVar
+
+V = TypeVar('V')
+
+
+class TTLCache(Generic[V]):
+    """进程内的 LRU 缓存，条目超过 ttl 秒后失效
+
+    可在多个线程中并发使用。max_size 或 ttl 为 0 时不缓存。
+    每次失效（invalidate）都会递增 generation：读取数据库前记下 generation 并在写入缓存时传入，
+    读取期间发生了失效的结果不会写入缓存，避免并发的修改被旧值覆盖。
+    on_invalidate 不为空时在每次失效后调用（多进程部署时据此通知其他进程失效同一条目）。
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple] = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.on_invalidate: Optional[Callable[[Optional[Hashable]], None]] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.ttl > 0
+
+    def get(self, key: Hashable) -> Optional[V]:
+        """返回未过期的缓存值并计入命中，否则返回 None 并计入未命中"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: V, generation: Optional[int] = None):
+        """写入缓存；传入的 generation 已过时（期间发生过失效）时不写入"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Optional[Hashable] = None, notify: bool = True):
+        """删除指定条目，不指定时清空缓存；notify 为 False 时不调用 on_invalidate（处理其他进程的失效通知时）"""
+        with self._lock:
+            self.generation += 1
+            self.invalidations += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+        if notify and self.on_invalidate is not None:
+            self.on_invalidate(key)
+
+    @property
+    def metrics(self) -> Dict:
+        """命中率与淘汰统计"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations
+        }
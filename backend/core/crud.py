@@ -1,36 +1,57 @@
 import json
 import os
 import sqlite3
-from datetime import datetime
-from typing import List, Dict, Optional
+import time
+import uuid
+from typing import List, Dict, Optional, Iterator, Iterable, Tuple
+
+from backend.conf import BASE_PATH, settings
+from backend.core.dedup import DEDUP_OFF, DEDUP_SKIP, DEDUP_LINK, DEDUP_MODES, content_hash, find_near_duplicates
+from backend.core.mapping import FieldMapping
+from backend.core.storage import STORAGE_COMPACT, STORAGE_MODES, RecordCompactor, system_text, response_text, \
+    raw_text
+from backend.core.db import create_data_record_indexes, drop_data_record_indexes, get_connection, connect, \
+    fts_enabled, create_fts_triggers, retry_on_busy, FTS_TABLE, FTS_DEFERRED_FUNCTION, FTS_UPDATE_TRIGGER, parse_score
+from backend.core.records import RecordKey, RecordErrorHandler, EDITABLE_FIELDS, SCORE_THRESHOLD, \
+    FTS_MIN_SEARCH_LENGTH, SYSTEM_COLUMN, RESPONSE_COLUMN, RAW_COLUMN, CONTENT_HASH_COLUMN, data_record_rows, \
+    record_key_column, like_pattern, decode_cursor, records_page, \
+    record_row, file_stats, tally_annotation_results, annotation_deltas, stats_mismatch, \
+    stats_result, export_chunk, leased_records, file_row, job_row
 
-import aiofiles
-
-from backend.conf import BASE_PATH
-
-DATABASE_FILE = os.path.join(BASE_PATH, "files.db")
 OUTPUT_FOLDER = os.path.join(BASE_PATH, "output")
 
 
 def save_file_info(filename: str, original_filename: str, file_size: int, total_records: int,
                    annotation_type: str = "qa"):
     """保存文件信息到数据库"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
+    conn = get_connection()
+    with conn:
+        cursor = conn.cursor()
 
-    cursor.execute('''
-        INSERT OR REPLACE INTO files 
-        (filename, original_filename, file_size, total_records, annotation_type, last_modified)
-        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-    ''', (filename, original_filename, file_size, total_records, annotation_type))
+        cursor.execute('''
+            INSERT OR REPLACE INTO files 
+            (filename, original_filename, file_size, total_records, annotation_type, last_modified)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (filename, original_filename, file_size, total_records, annotation_type))
+
+
+def update_file_total_records(file_id: int, total_records: int):
+    """更新文件的记录总数"""
+    conn = get_connection()
+    with conn:
+        cursor = conn.cursor()
 
-    conn.commit()
-    conn.close()
+        cursor.execute('''
+                       UPDATE files
+                       SET total_records = ?,
+                           last_modified = CURRENT_TIMESTAMP
+                       WHERE id = ?
+                       ''', (total_records, file_id))
 
 
 def get_file_info(filename: str) -> Optional[Dict]:
     """获取指定文件的信息"""
-    conn = sqlite3.connect(DATABASE_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
 
     cursor.execute('''
@@ -48,26 +69,12 @@ def get_file_info(filename: str) -> Optional[Dict]:
                    ''', (filename,))
 
     row = cursor.fetchone()
-    conn.close()
-
-    if row:
-        return {
-            'id': row[0],
-            'filename': row[1],
-            'original_filename': row[2],
-            'file_size': row[3],
-            'total_records': row[4],
-            'annotation_type': row[5],
-            'upload_time': row[6],
-            'last_modified': row[7],
-            'status': row[8]
-        }
-    return None
+    return file_row(row) if row else None
 
 
 def get_all_files() -> List[Dict]:
     """获取所有文件信息"""
-    conn = sqlite3.connect(DATABASE_FILE)
+    conn = get_connection()
     cursor = conn.cursor()
 
     cursor.execute('''
@@ -85,237 +92,992 @@ def get_all_files() -> List[Dict]:
                    ORDER BY upload_time DESC
                    ''')
 
-    rows = cursor.fetchall()
-    conn.close()
-
-    files = []
-    for row in rows:
-        files.append({
-            'id': row[0],
-            'filename': row[1],
-            'original_filename': row[2],
-            'file_size': row[3],
-            'total_records': row[4],
-            'annotation_type': row[5],
-            'upload_time': row[6],
-            'last_modified': row[7],
-            'status': row[8]
-        })
-
-    return files
+    return [file_row(row) for row in cursor.fetchall()]
 
 
 def delete_file_info(filename: str):
     """删除文件信息（软删除）"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
+    conn = get_connection()
+    with conn:
+        cursor = conn.cursor()
+
+        # 获取文件ID
+        cursor.execute('SELECT id FROM files WHERE filename = ?', (filename,))
+        file_record = cursor.fetchone()
+
+        if file_record:
+            file_id = file_record[0]
+            # 软删除文件记录
+            cursor.execute('UPDATE files SET status = ? WHERE filename = ?', ('deleted', filename))
+            # 软删除相关的数据记录
+            cursor.execute('UPDATE data_records SET status = ? WHERE file_id = ?', ('deleted', file_id))
+            # 清除统计计数器
+            cursor.execute('DELETE FROM file_stats WHERE file_id = ?', (file_id,))
+            cursor.execute('DELETE FROM file_score_histogram WHERE file_id = ?', (file_id,))
+            cursor.execute('DELETE FROM record_leases WHERE file_id = ?', (file_id,))
+            _bump_file_version(cursor, file_id)
+
+
+def _bump_file_version(cursor: sqlite3.Cursor, file_id: int):
+    """文件的数据记录或统计发生变化后递增版本号（与修改在同一事务中），列表页和统计接口据此生成 ETag"""
+    cursor.execute('UPDATE files SET version = version + 1 WHERE id = ?', (file_id,))
+
 
-    # 获取文件ID
-    cursor.execute('SELECT id FROM files WHERE filename = ?', (filename,))
-    file_row = cursor.fetchone()
+def get_file_version(file_id: int) -> int:
+    """获取文件的当前版本号（不经过文件信息缓存）"""
+    conn = get_connection()
+    row = conn.execute('SELECT version FROM files WHERE id = ?', (file_id,)).fetchone()
+    return row[0] if row else 0
 
-    if file_row:
-        file_id = file_row[0]
-        # 软删除文件记录
-        cursor.execute('UPDATE files SET status = ? WHERE filename = ?', ('deleted', filename))
-        # 软删除相关的数据记录
-        cursor.execute('UPDATE data_records SET status = ? WHERE file_id = ?', ('deleted', file_id))
 
-    conn.commit()
-    conn.close()
+INSERT_DATA_RECORD_SQL = '''
+    INSERT OR REPLACE INTO data_records
+    (file_id, unique_id, line_number, system, system_id, query, response, byte_offset, byte_length, raw,
+     content_hash, duplicate_of, annotation_result, score, created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+'''
 
 
 def save_data_records(file_id: int, data_records: List[Dict]):
     """保存数据记录到数据库"""
-    conn = sqlite3.connect(DATABASE_FILE)
+    conn = get_connection()
+    with conn:
+        cursor = conn.cursor()
+
+        cursor.executemany(INSERT_DATA_RECORD_SQL, data_record_rows(file_id, data_records))
+        _store_file_stats(cursor, file_id, _compute_file_stats(cursor, file_id))
+
+
+class BulkLoader:
+    """批量导入数据记录
+
+    每批记录通过 executemany 写入，全文索引不经插入触发器逐行更新，而是每批写入后统一补充。
+    defer_indexes 为 True 时先删除二级索引，所有批次在同一个事务中写入（期间关闭 synchronous），
+    导入完成后统一重建；重建耗时与整张表的记录数成正比，默认（None）只在 data_records 为空时延迟。
+    不延迟索引时应调用 commit() 分段提交，使其他连接的写入可以在两段之间进行（后台任务同时据此实现断点续传）。
+
+    dedup_mode 为 skip 时不写入与已有记录（任意文件）或本文件前面的记录内容完全相同的记录；
+    为 link 时照常写入，并关联到首条相同内容的记录、继承其标注结果（标注类型相同时）。
+    storage_mode 为 compact 时驻留 system 提示词并压缩较长的 response（见 RecordCompactor）。
+    field_mapping 不为空时按映射取出 system / query / response，并保留原始记录；
+    无法取出这些字段的记录交给 on_error(行号, 异常) 并跳过。
+    """
+
+    def __init__(self, file_id: int, defer_indexes: Optional[bool] = None, dedup_mode: str = DEDUP_OFF,
+                 storage_mode: str = settings.STORAGE_MODE, field_mapping: Optional[FieldMapping] = None,
+                 on_error: Optional[RecordErrorHandler] = None):
+        if dedup_mode not in DEDUP_MODES:
+            raise ValueError(f"dedup_mode 必须是 {', '.join(DEDUP_MODES)} 之一")
+        if storage_mode not in STORAGE_MODES:
+            raise ValueError(f"storage_mode 必须是 {', '.join(STORAGE_MODES)} 之一")
+        self.file_id = file_id
+        self.defer_indexes = defer_indexes
+        self.dedup_mode = dedup_mode
+        self.storage_mode = storage_mode
+        self.field_mapping = field_mapping
+        self.on_error = on_error
+        self.compactor: Optional[RecordCompactor] = None
+        self.annotation_type = 'qa'
+        self.inserted = 0
+        self.duplicates = 0
+        self.labels_carried_over = 0
+        self.conn: Optional[sqlite3.Connection] = None
+        # 已写入全文索引的最大记录ID（不延迟索引时按批补充全文索引）
+        self._fts_indexed_id = 0
+        self._started_at = 0.0
+        self._finished_at: Optional[float] = None
+
+    def __enter__(self) -> 'BulkLoader':
+        self.conn = connect(isolation_level=None)
+        self.conn.create_function(FTS_DEFERRED_FUNCTION, 0, lambda: 1)
+        self.conn.execute('PRAGMA temp_store = MEMORY')
+        self.conn.execute('PRAGMA cache_size = -65536')
+        if self.defer_indexes is None:
+            # 在开启事务前判断（synchronous 不能在事务中修改）；其间有其他导入写入时只是重建索引多花些时间
+            self.defer_indexes = self.conn.execute('SELECT 1 FROM data_records LIMIT 1').fetchone() is None
+        if self.defer_indexes:
+            # 整个导入在一个事务中完成，中途崩溃时全部回滚，无需逐次同步
+            self.conn.execute('PRAGMA synchronous = OFF')
+        retry_on_busy(self.conn.execute, 'BEGIN IMMEDIATE')
+        file_record = self.conn.execute('SELECT annotation_type FROM files WHERE id = ?', (self.file_id,)).fetchone()
+        if file_record:
+            self.annotation_type = file_record[0]
+        if self.storage_mode == STORAGE_COMPACT:
+            self.compactor = RecordCompactor(self.conn, self.file_id)
+        self._fts_indexed_id = self.conn.execute('SELECT COALESCE(MAX(id), 0) FROM data_records').fetchone()[0]
+        if self.defer_indexes:
+            drop_data_record_indexes(self.conn.cursor())
+        self._started_at = time.perf_counter()
+        return self
+
+    def _begin(self):
+        """开启写事务（分段提交后到写入下一批之前不持有写锁，其他连接的写入可在此间隙进行）"""
+        if not self.conn.in_transaction:
+            retry_on_busy(self.conn.execute, 'BEGIN IMMEDIATE')
+
+    def add_batch(self, data_records: List[Dict]):
+        """写入一批记录（不提交）"""
+        self._begin()
+        rows = list(data_record_rows(self.file_id, data_records, self.field_mapping, self.on_error))
+        if self.compactor:
+            self.compactor.prepare([row[RESPONSE_COLUMN] for row in rows])
+        if self.dedup_mode == DEDUP_SKIP:
+            self._insert_skipping_duplicates(rows)
+        elif self.dedup_mode == DEDUP_LINK:
+            self._insert_linking_duplicates(rows)
+        else:
+            self.conn.executemany(INSERT_DATA_RECORD_SQL, map(self._compact, rows))
+            self.inserted += len(rows)
+        if not self.defer_indexes:
+            self._index_batch()
+
+    def _index_batch(self):
+        """将本文件在上次补充之后写入的记录加入全文索引"""
+        if not fts_enabled():
+            return
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
+            INSERT INTO {FTS_TABLE}(rowid, system, query, response)
+            SELECT id, {system_text('data_records')}, query, {response_text('data_records')}
+            FROM data_records
+            WHERE id > ?
+              AND file_id = ?
+              AND status = 'active'
+        ''', (self._fts_indexed_id, self.file_id))
+        self._fts_indexed_id = cursor.execute('SELECT COALESCE(MAX(id), 0) FROM data_records').fetchone()[0]
+
+    def _compact(self, row: Tuple) -> Tuple:
+        """compact 模式下将数据行转换为压缩存储"""
+        if not self.compactor:
+            return row
+        system, system_id, response, raw = self.compactor.compact_values(row[SYSTEM_COLUMN], row[RESPONSE_COLUMN],
+                                                                         row[RAW_COLUMN])
+        return (row[:SYSTEM_COLUMN] + (system, system_id) + row[SYSTEM_COLUMN + 2:RESPONSE_COLUMN]
+                + (response,) + row[RESPONSE_COLUMN + 1:RAW_COLUMN] + (raw,) + row[RAW_COLUMN + 1:])
+
+    def _find_originals(self, hashes: List[str]) -> Dict[str, Tuple[int, Optional[str], Optional[float], str]]:
+        """按内容哈希查找已有的首条记录，返回 {哈希: (记录ID, 标注结果, 分数, 标注类型)}"""
+        originals = {}
+        for i in range(0, len(hashes), 500):
+            chunk = hashes[i:i + 500]
+            rows = self.conn.execute(f'''
+                SELECT r.content_hash, r.id, r.annotation_result, r.score, f.annotation_type
+                FROM data_records r
+                         JOIN files f ON f.id = r.file_id
+                WHERE r.content_hash IN ({', '.join('?' * len(chunk))})
+                  AND r.status = 'active'
+                  AND r.duplicate_of IS NULL
+            ''', chunk).fetchall()
+            for row_hash, record_id, annotation_result, score, annotation_type in rows:
+                if row_hash not in originals or record_id < originals[row_hash][0]:
+                    originals[row_hash] = (record_id, annotation_result, score, annotation_type)
+        return originals
+
+    def _insert_skipping_duplicates(self, rows: Iterable[Tuple]):
+        rows = list(rows)
+        originals = self._find_originals(list({row[CONTENT_HASH_COLUMN] for row in rows}))
+        seen = set(originals)
+        unique_rows = []
+        for row in rows:
+            if row[CONTENT_HASH_COLUMN] in seen:
+                self.duplicates += 1
+                continue
+            seen.add(row[CONTENT_HASH_COLUMN])
+            unique_rows.append(row)
+        self.conn.executemany(INSERT_DATA_RECORD_SQL, map(self._compact, unique_rows))
+        self.inserted += len(unique_rows)
+
+    def _insert_linking_duplicates(self, rows: Iterable[Tuple]):
+        # 逐行写入以便拿到本批次中首条记录的ID，同时保持记录ID与行号同序
+        rows = list(rows)
+        originals = self._find_originals(list({row[CONTENT_HASH_COLUMN] for row in rows}))
+        cursor = self.conn.cursor()
+        for row in rows:
+            row_hash = row[CONTENT_HASH_COLUMN]
+            original = originals.get(row_hash)
+            if original:
+                original_id, annotation_result, score, annotation_type = original
+                if annotation_result is None or annotation_type != self.annotation_type:
+                    annotation_result = score = None
+                else:
+                    self.labels_carried_over += 1
+                row = row[:CONTENT_HASH_COLUMN + 1] + (original_id, annotation_result, score)
+                self.duplicates += 1
+            cursor.execute(INSERT_DATA_RECORD_SQL, self._compact(row))
+            if not original:
+                originals[row_hash] = (cursor.lastrowid, None, None, self.annotation_type)
+        self.inserted += len(rows)
+
+    def commit(self):
+        """提交已写入的批次（分段提交，仅在未延迟索引时可用），下一批写入时再开启新事务"""
+        if self.defer_indexes:
+            raise RuntimeError("defer_indexes 模式下只能在导入结束时提交")
+        self._begin()
+        _bump_file_version(self.conn.cursor(), self.file_id)
+        self.conn.execute('COMMIT')
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self._begin()
+                if self.defer_indexes:
+                    self._rebuild_indexes()
+                cursor = self.conn.cursor()
+                _store_file_stats(cursor, self.file_id, _compute_file_stats(cursor, self.file_id))
+                self.conn.execute('COMMIT')
+                self._finished_at = time.perf_counter()
+            elif self.conn.in_transaction:
+                self.conn.execute('ROLLBACK')
+        finally:
+            self.conn.close()
+            self.conn = None
+
+    def _rebuild_indexes(self):
+        """重建二级索引，并将本次导入的记录一次性写入全文索引"""
+        create_data_record_indexes(self.conn.cursor())
+        self._index_batch()
+
+    @property
+    def stats(self) -> Dict:
+        """导入统计信息"""
+        elapsed = (self._finished_at or time.perf_counter()) - self._started_at
+        return {
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "labels_carried_over": self.labels_carried_over,
+            **(self.compactor.stats if self.compactor else {}),
+            "elapsed": round(elapsed, 3),
+            "rows_per_second": round(self.inserted / elapsed) if elapsed > 0 else 0
+        }
+
+
+def compact_file_storage(file_id: int) -> Dict:
+    """将已导入文件的记录转换为压缩存储（驻留 system 提示词、压缩 response），返回转换统计"""
+    conn = connect(isolation_level=None)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        cursor = conn.cursor()
+        # 记录原文不变，全文索引无需更新；事务内暂时去掉更新触发器，避免逐行重建索引
+        cursor.execute(f'DROP TRIGGER IF EXISTS {FTS_UPDATE_TRIGGER}')
+        compactor = RecordCompactor(conn, file_id)
+        last_line = 0
+        while True:
+            rows = cursor.execute('''
+                                  SELECT id, line_number, system, system_id, response, raw
+                                  FROM data_records
+                                  WHERE file_id = ?
+                                    AND line_number > ?
+                                  ORDER BY line_number
+                                  LIMIT ?
+                                  ''', (file_id, last_line, settings.INGEST_BATCH_SIZE)).fetchall()
+            if not rows:
+                break
+            last_line = rows[-1][1]
+            compactor.prepare([row[4] for row in rows if isinstance(row[4], str)])
+
+            updates = []
+            for record_id, _, system, system_id, response, raw in rows:
+                interned_id = compactor.intern_system(system) if system is not None else None
+                compressed = compactor.compress_text(response) if isinstance(response, str) else response
+                compressed_raw = compactor.compress_text(raw) if isinstance(raw, str) else raw
+                if interned_id or compressed is not response or compressed_raw is not raw:
+                    updates.append((None if interned_id else system, interned_id or system_id, compressed,
+                                    compressed_raw, record_id))
+            cursor.executemany('''
+                               UPDATE data_records
+                               SET system = ?, system_id = ?, response = ?, raw = ?
+                               WHERE id = ?
+                               ''', updates)
+        if fts_enabled():
+            create_fts_triggers(cursor)
+        conn.execute('COMMIT')
+        return compactor.stats
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+
+def _iter_rows(cursor: sqlite3.Cursor, fetch_size: int = settings.EXPORT_FETCH_SIZE) -> Iterator[Tuple]:
+    while rows := cursor.fetchmany(fetch_size):
+        yield from rows
+
+
+def flag_near_duplicates(file_id: int) -> int:
+    """用 MinHash/LSH 标记文件内的近似重复记录（near_duplicate_of 指向此前最相似的记录），返回标记数"""
+    conn = get_connection()
     cursor = conn.cursor()
 
-    for record in data_records:
-        # 生成唯一ID
-        unique_id = f"{file_id}_{record['line_number']}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    cursor.execute(f'''
+                   SELECT id, query, {response_text('data_records')}
+                   FROM data_records
+                   WHERE file_id = ?
+                     AND status = 'active'
+                     AND duplicate_of IS NULL
+                   ORDER BY line_number
+                   ''', (file_id,))
+    records = ((record_id, f"{query or ''}\n{response or ''}") for record_id, query, response in _iter_rows(cursor))
+    pairs = [(original_id, record_id) for record_id, original_id in find_near_duplicates(records)]
 
+    with conn:
+        cursor.execute('UPDATE data_records SET near_duplicate_of = NULL WHERE file_id = ? AND near_duplicate_of IS NOT NULL',
+                       (file_id,))
+        cursor.executemany('UPDATE data_records SET near_duplicate_of = ? WHERE id = ?', pairs)
+        _bump_file_version(cursor, file_id)
+    return len(pairs)
+
+
+def _refresh_content_hash(cursor: sqlite3.Cursor, file_id: int, line_number: int):
+    """记录内容修改后重新计算内容哈希，并解除与原重复记录的关联"""
+    cursor.execute(f'''
+                   SELECT id, {system_text('data_records')}, query, {response_text('data_records')}
+                   FROM data_records
+                   WHERE file_id = ?
+                     AND line_number = ?
+                     AND status = 'active'
+                   ''', (file_id, line_number))
+    record_id, system, query, response = cursor.fetchone()
+    cursor.execute('''
+                   UPDATE data_records
+                   SET content_hash      = ?,
+                       duplicate_of      = NULL,
+                       near_duplicate_of = NULL
+                   WHERE id = ?
+                   ''', (content_hash(system, query, response), record_id))
+
+    # 关联到该记录的重复记录改为关联到其中的第一条
+    cursor.execute('SELECT MIN(id) FROM data_records WHERE duplicate_of = ?', (record_id,))
+    new_original_id = cursor.fetchone()[0]
+    if new_original_id is not None:
         cursor.execute('''
-            INSERT OR REPLACE INTO data_records 
-            (file_id, unique_id, line_number, system, query, response, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-        ''', (
-            file_id,
-            unique_id,
-            record['line_number'],
-            record.get('system', ''),
-            record.get('query', ''),
-            record.get('response', '')
-        ))
-
-    conn.commit()
-    conn.close()
+                       UPDATE data_records
+                       SET duplicate_of = CASE WHEN id = ? THEN NULL ELSE ? END
+                       WHERE duplicate_of = ?
+                       ''', (new_original_id, new_original_id, record_id))
 
 
-def get_data_records_from_db(file_id: int, search: str = "", annotation_status: str = "all",
-                             selected_only: bool = False, page: int = 1, per_page: int = 20) -> Dict:
-    """从数据库获取数据记录"""
-    conn = sqlite3.connect(DATABASE_FILE)
+def apply_data_edit(file_id: int, line_number: int, updates: Dict) -> bool:
+    """修改一条数据记录并追加到编辑日志（不改写源文件）"""
+    conn = get_connection()
+    with conn:
+        cursor = conn.cursor()
+
+        cursor.execute(f'''
+                       SELECT id, {raw_text('data_records')}
+                       FROM data_records
+                       WHERE file_id = ?
+                         AND line_number = ?
+                         AND status = 'active'
+                       ''', (file_id, line_number))
+        row = cursor.fetchone()
+        if not row:
+            return False
+        record_id, raw = row
+
+        columns = [field for field in EDITABLE_FIELDS if field in updates]
+        assignments = [f'{column} = ?' for column in columns]
+        values = [updates[column] for column in columns]
+        if 'system' in columns:
+            # 修改后的 system 以原文存储，不再指向驻留的提示词
+            assignments.append('system_id = NULL')
+        if raw is not None:
+            # 原始记录与写回源文件的结果保持一致：修改的字段合并到记录顶层
+            raw_record = json.loads(raw)
+            raw_record.update(updates)
+            assignments.append('raw = ?')
+            values.append(json.dumps(raw_record, ensure_ascii=False))
+        if assignments:
+            cursor.execute(f'''
+                           UPDATE data_records
+                           SET {', '.join(assignments)},
+                               updated_at = CURRENT_TIMESTAMP
+                           WHERE id = ?
+                           ''', values + [record_id])
+        if columns:
+            _refresh_content_hash(cursor, file_id, line_number)
+
+        cursor.execute('''
+            INSERT INTO data_edits (file_id, line_number, updates, created_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (file_id, line_number, json.dumps(updates, ensure_ascii=False)))
+        _bump_file_version(cursor, file_id)
+
+    return True
+
+
+def get_pending_edits(file_id: int) -> Tuple[int, Dict[int, Dict]]:
+    """获取尚未物化的编辑，按行号合并，返回 (最大编辑ID, {行号: 合并后的修改})"""
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute('''
+                   SELECT id, line_number, updates
+                   FROM data_edits
+                   WHERE file_id = ?
+                     AND materialized = 0
+                   ORDER BY id
+                   ''', (file_id,))
+
+    max_edit_id = 0
+    edits = {}
+    for edit_id, line_number, updates in cursor.fetchall():
+        max_edit_id = edit_id
+        edits.setdefault(line_number, {}).update(json.loads(updates))
+    return max_edit_id, edits
+
+
+def get_line_offsets(file_id: int, line_numbers: List[int]) -> Dict[int, Tuple[Optional[int], Optional[int]]]:
+    """获取指定行在源文件中的字节偏移和长度"""
+    conn = get_connection()
     cursor = conn.cursor()
 
-    # 构建查询条件
-    where_conditions = ["file_id = ?", "status = 'active'"]
+    offsets = {}
+    # 分批查询，避免超过 SQLite 的参数个数限制
+    for i in range(0, len(line_numbers), 500):
+        chunk = line_numbers[i:i + 500]
+        cursor.execute(f'''
+                       SELECT line_number, byte_offset, byte_length
+                       FROM data_records
+                       WHERE file_id = ?
+                         AND line_number IN ({', '.join('?' * len(chunk))})
+                       ''', [file_id] + chunk)
+        for line_number, byte_offset, byte_length in cursor.fetchall():
+            offsets[line_number] = (byte_offset, byte_length)
+    return offsets
+
+
+def save_line_offsets(file_id: int, offsets: Iterator[Tuple[int, int, int]]):
+    """批量写入行偏移索引，offsets 为 (字节偏移, 字节长度, 行号)"""
+    conn = get_connection()
+    with conn:
+        cursor = conn.cursor()
+
+        cursor.executemany('''
+                           UPDATE data_records
+                           SET byte_offset = ?,
+                               byte_length = ?
+                           WHERE file_id = ?
+                             AND line_number = ?
+                           ''', ((offset, length, file_id, line_number) for offset, length, line_number in offsets))
+
+
+def complete_materialization(file_id: int, max_edit_id: int, new_lengths: Dict[int, Tuple[int, int]],
+                             file_size: int):
+    """源文件重写后更新行偏移索引、文件大小并标记编辑已物化
+
+    new_lengths 为 {被修改的行号: (原长度, 新长度)}；调用方在事务提交后再用重写的文件替换源文件。
+    """
+    conn = get_connection()
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+
+        line_numbers = sorted(new_lengths)
+        shift = 0
+        for index, line_number in enumerate(line_numbers):
+            old_length, new_length = new_lengths[line_number]
+            cursor.execute('''
+                           UPDATE data_records
+                           SET byte_length = ?
+                           WHERE file_id = ?
+                             AND line_number = ?
+                           ''', (new_length, file_id, line_number))
+            # 当前行之后、下一被修改行之前（含）的记录整体平移
+            shift += new_length - old_length
+            if shift:
+                next_line = line_numbers[index + 1] if index + 1 < len(line_numbers) else None
+                cursor.execute(f'''
+                               UPDATE data_records
+                               SET byte_offset = byte_offset + ?
+                               WHERE file_id = ?
+                                 AND line_number > ?
+                                 {'AND line_number <= ?' if next_line is not None else ''}
+                               ''', [shift, file_id, line_number] + ([next_line] if next_line is not None else []))
+
+        cursor.execute('''
+                       UPDATE data_edits
+                       SET materialized = 1
+                       WHERE file_id = ?
+                         AND id <= ?
+                       ''', (file_id, max_edit_id))
+        cursor.execute('''
+                       UPDATE files
+                       SET file_size     = ?,
+                           last_modified = CURRENT_TIMESTAMP
+                       WHERE id = ?
+                       ''', (file_size, file_id))
+
+
+def _fts_phrase(search: str) -> str:
+    """将搜索关键词转换为 FTS5 短语查询（trigram 分词下即子串匹配）"""
+    return '"' + search.replace('"', '""') + '"'
+
+
+def _build_record_filter(file_id: int, search: str = "", annotation_status: str = "all",
+                         ordered: bool = False) -> Tuple[str, List[str], List, Optional[str]]:
+    """构建数据记录的筛选条件，返回 (FROM 子句, WHERE 条件列表, 参数, 全文检索查询)，数据表别名为 r
+
+    使用全文索引时默认以全文索引为驱动表（CROSS JOIN 固定连接顺序），只访问命中的记录，用于计数和按条件标注；
+    ordered 为 True 时改为按 (file_id, line_number) 索引顺序读取、用命中的记录ID过滤，结果按行号有序，
+    与不检索时的分页一致（记录ID与行号不一定同序：去重跳过、重新导入和物化之后都会改变）。
+    """
+    from_clause = "data_records r"
+    fts_query = None
+    where_conditions = ["r.file_id = ?", "r.status = 'active'"]
     params = [file_id]
 
     if search:
-        where_conditions.append("(LOWER(system) LIKE ? OR LOWER(query) LIKE ? OR LOWER(response) LIKE ?)")
-        search_param = f"%{search.lower()}%"
-        params.extend([search_param, search_param, search_param])
+        if fts_enabled() and len(search) >= FTS_MIN_SEARCH_LENGTH:
+            fts_query = _fts_phrase(search)
+            if ordered:
+                where_conditions.append(f"r.id IN (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ?)")
+            else:
+                from_clause = f"{FTS_TABLE} CROSS JOIN data_records r ON r.id = {FTS_TABLE}.rowid"
+                where_conditions.append(f"{FTS_TABLE} MATCH ?")
+            params.append(fts_query)
+        else:
+            # 关键词过短（trigram 无法匹配）或不支持 FTS5 时退回 LIKE
+            where_conditions.append(f"(LOWER({system_text('r')}) LIKE ? ESCAPE '\\' OR LOWER(r.query) LIKE ? ESCAPE '\\' "
+                                    f"OR LOWER({response_text('r')}) LIKE ? ESCAPE '\\')")
+            search_param = like_pattern(search.lower())
+            params.extend([search_param, search_param, search_param])
 
     if annotation_status == "annotated":
-        where_conditions.append("annotation_result IS NOT NULL")
+        where_conditions.append("r.annotation_result IS NOT NULL")
     elif annotation_status == "not_annotated":
-        where_conditions.append("annotation_result IS NULL")
+        where_conditions.append("r.annotation_result IS NULL")
 
-    # 获取总数
-    count_query = f"SELECT COUNT(*) FROM data_records WHERE {' AND '.join(where_conditions)}"
-    cursor.execute(count_query, params)
-    total_count = cursor.fetchone()[0]
+    return from_clause, where_conditions, params, fts_query
+
+
+def _search_snippets(cursor: sqlite3.Cursor, fts_query: str, record_ids: List[int]) -> Dict[int, str]:
+    """生成一页记录的高亮片段 {记录ID: 片段}"""
+    cursor.execute(f'''
+        SELECT rowid, snippet({FTS_TABLE}, -1, '<mark>', '</mark>', '...', 32)
+        FROM {FTS_TABLE}
+        WHERE {FTS_TABLE} MATCH ?
+          AND rowid IN ({', '.join('?' * len(record_ids))})
+    ''', [fts_query] + record_ids)
+    return dict(cursor.fetchall())
+
+
+def get_data_records_from_db(file_id: int, search: str = "", annotation_status: str = "all",
+                             selected_only: bool = False, page: int = 1, per_page: int = 20,
+                             cursor: Optional[str] = None, skip_count: bool = False) -> Dict:
+    """从数据库获取数据记录
 
-    # 分页查询
-    offset = (page - 1) * per_page
+    传入 cursor 时按 (file_id, line_number) 游标分页，耗时与页码无关；
+    skip_count 为 True 时不计算总数。
+    """
+    after_line = decode_cursor(cursor, file_id) if cursor else None
+
+    conn = get_connection()
+    db_cursor = conn.cursor()
+
+    # 获取总数
+    total_count = None
+    if not skip_count:
+        from_clause, where_conditions, params, _ = _build_record_filter(file_id, search, annotation_status)
+        count_query = f"SELECT COUNT(*) FROM {from_clause} WHERE {' AND '.join(where_conditions)}"
+        db_cursor.execute(count_query, params)
+        total_count = db_cursor.fetchone()[0]
+
+    # 按行号分页（检索时同样按行号排序，游标分页与不检索时一致）
+    from_clause, where_conditions, params, fts_query = _build_record_filter(file_id, search, annotation_status,
+                                                                            ordered=True)
+
+    # 分页查询：游标分页从上一页最后一行之后开始，否则使用 OFFSET；多取一条用于判断是否还有下一页
+    if after_line is not None:
+        where_conditions.append("r.line_number > ?")
+        params.append(after_line)
+        offset = 0
+    else:
+        offset = (page - 1) * per_page
     query = f'''
-        SELECT id, unique_id, line_number, system, query, response, annotation_result, 
-               created_at, updated_at
-        FROM data_records 
+        SELECT r.id, r.unique_id, r.line_number, {system_text('r')}, r.query, {response_text('r')}, r.annotation_result,
+               r.created_at, r.updated_at, NULL, r.duplicate_of, r.near_duplicate_of
+        FROM {from_clause}
         WHERE {' AND '.join(where_conditions)}
-        ORDER BY line_number
+        ORDER BY r.line_number
         LIMIT ? OFFSET ?
     '''
-    params.extend([per_page, offset])
+    params.extend([per_page + 1, offset])
 
-    cursor.execute(query, params)
-    rows = cursor.fetchall()
-    conn.close()
-
-    # 格式化数据
-    data = []
-    for row in rows:
-        data.append({
-            'id': row[0],
-            'unique_id': row[1],
-            'line_number': row[2],
-            'system': row[3],
-            'query': row[4],
-            'response': row[5],
-            'annotation_result': row[6],
-            'created_at': row[7],
-            'updated_at': row[8],
-            'selected': False
-        })
+    db_cursor.execute(query, params)
+    rows = db_cursor.fetchall()
+    if fts_query and rows:
+        snippets = _search_snippets(db_cursor, fts_query, [row[0] for row in rows])
+        rows = [row[:9] + (snippets.get(row[0]),) + row[10:] for row in rows]
+    return records_page(file_id, rows, total_count, page, per_page)
 
-    return {
-        "data": data,
-        "total_count": total_count,
-        "page": page,
-        "per_page": per_page,
-        "total_pages": (total_count + per_page - 1) // per_page
-    }
 
+def _compute_file_stats(cursor: sqlite3.Cursor, file_id: int) -> Dict:
+    """从 data_records 全量计算文件的统计计数"""
+    cursor.execute('SELECT annotation_type FROM files WHERE id = ?', (file_id,))
+    row = cursor.fetchone()
+    annotation_type = row[0] if row else 'qa'
 
-def update_data_annotation(unique_id: str, annotation_result: str) -> bool:
-    """更新数据记录的标注结果"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
+    if annotation_type == 'scoring':
+        # 评分标注：阈值划分和直方图都基于数值列 score 在 SQL 中完成
+        cursor.execute('''
+                       SELECT COUNT(*),
+                              COALESCE(SUM(score >= ?), 0),
+                              COALESCE(SUM(score < ?), 0)
+                       FROM data_records
+                       WHERE file_id = ?
+                         AND status = 'active'
+                       ''', (SCORE_THRESHOLD, SCORE_THRESHOLD, file_id))
+        total_count, correct_count, incorrect_count = cursor.fetchone()
+
+        cursor.execute('''
+                       SELECT score, COUNT(*)
+                       FROM data_records
+                       WHERE file_id = ?
+                         AND status = 'active'
+                         AND score IS NOT NULL
+                       GROUP BY score
+                       ''', (file_id,))
+        return file_stats(annotation_type, total_count, correct_count, incorrect_count, dict(cursor.fetchall()))
 
     cursor.execute('''
-                   UPDATE data_records
-                   SET annotation_result = ?,
-                       updated_at        = CURRENT_TIMESTAMP
-                   WHERE unique_id = ?
+                   SELECT annotation_result, COUNT(*)
+                   FROM data_records
+                   WHERE file_id = ?
                      AND status = 'active'
-                   ''', (annotation_result, unique_id))
+                   GROUP BY annotation_result
+                   ''', (file_id,))
+    return tally_annotation_results(annotation_type, cursor.fetchall())
 
-    affected_rows = cursor.rowcount
-    conn.commit()
-    conn.close()
 
-    return affected_rows > 0
+def _store_file_stats(cursor: sqlite3.Cursor, file_id: int, stats: Dict):
+    """写入文件的统计计数器（覆盖已有值）"""
+    cursor.execute('''
+        INSERT OR REPLACE INTO file_stats
+        (file_id, total_count, correct_count, incorrect_count, updated_at)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ''', (file_id, stats['total_count'], stats['correct_count'], stats['incorrect_count']))
+    cursor.execute('DELETE FROM file_score_histogram WHERE file_id = ?', (file_id,))
+    cursor.executemany('''
+        INSERT INTO file_score_histogram (file_id, score, count)
+        VALUES (?, ?, ?)
+    ''', [(file_id, score, count) for score, count in stats['score_histogram'].items()])
+    _bump_file_version(cursor, file_id)
+
+
+def _apply_annotation_deltas(cursor: sqlite3.Cursor, file_id: int, annotation_type: str,
+                             changes: Iterable[Tuple[Optional[str], Optional[str]]]):
+    """根据一批记录标注结果的变化 (旧值, 新值) 汇总后增量更新统计计数器"""
+    deltas, histogram_deltas = annotation_deltas(annotation_type, changes)
+    if deltas['correct'] or deltas['incorrect']:
+        cursor.execute('''
+                       UPDATE file_stats
+                       SET correct_count   = correct_count + ?,
+                           incorrect_count = incorrect_count + ?,
+                           updated_at      = CURRENT_TIMESTAMP
+                       WHERE file_id = ?
+                       ''', (deltas['correct'], deltas['incorrect'], file_id))
+
+    cursor.executemany('''
+        INSERT INTO file_score_histogram (file_id, score, count)
+        VALUES (?, ?, ?)
+        ON CONFLICT (file_id, score) DO UPDATE SET count = count + excluded.count
+    ''', [(file_id, score, delta) for score, delta in histogram_deltas.items() if delta])
+    _bump_file_version(cursor, file_id)
+
+
+def _propagate_to_duplicates(cursor: sqlite3.Cursor, record_id: int, annotation_type: str,
+                             annotation_result: str) -> List[int]:
+    """将标注同步到同一组重复记录（关联到同一首条记录）中尚未标注、标注类型相同的记录，返回这些记录的 file_id"""
+    cursor.execute('SELECT COALESCE(duplicate_of, id) FROM data_records WHERE id = ?', (record_id,))
+    original_id = cursor.fetchone()[0]
+    cursor.execute('''
+                   SELECT r.id, r.file_id
+                   FROM data_records r
+                            JOIN files f ON f.id = r.file_id
+                   WHERE (r.id = ? OR r.duplicate_of = ?)
+                     AND r.id <> ?
+                     AND r.status = 'active'
+                     AND r.annotation_result IS NULL
+                     AND f.annotation_type = ?
+                   ''', (original_id, original_id, record_id, annotation_type))
+    members = cursor.fetchall()
+    if members:
+        score = parse_score(annotation_result) if annotation_type == 'scoring' else None
+        cursor.executemany('''
+                           UPDATE data_records
+                           SET annotation_result = ?,
+                               score             = ?,
+                               updated_at        = CURRENT_TIMESTAMP
+                           WHERE id = ?
+                           ''', [(annotation_result, score, member_id) for member_id, _ in members])
+    return [member_file_id for _, member_file_id in members]
+
+
+def _has_linked_duplicates(cursor: sqlite3.Cursor) -> bool:
+    cursor.execute('SELECT 1 FROM data_records WHERE duplicate_of IS NOT NULL LIMIT 1')
+    return cursor.fetchone() is not None
+
+
+def update_data_annotations(annotations: List[Tuple[RecordKey, str]]) -> List[Optional[Dict]]:
+    """在同一事务中依次更新多条记录的标注结果及统计计数器（用于合并提交）
+
+    annotations 为 [(记录ID或unique_id, 标注结果)]，返回每一项更新后的记录摘要，找不到对应记录时为 None。
+    """
+    conn = get_connection()
+    with conn:
+        cursor = conn.cursor()
+        # 先获取写锁，保证读取的旧值与更新在同一事务中
+        cursor.execute('BEGIN IMMEDIATE')
+
+        results = []
+        # {file_id: (标注类型, [(旧值, 新值)])}
+        file_changes = {}
+        propagate = settings.DEDUP_PROPAGATE_LABELS and _has_linked_duplicates(cursor)
+        for record_key, annotation_result in annotations:
+            cursor.execute(f'''
+                SELECT r.id, r.unique_id, r.file_id, r.line_number, r.annotation_result, f.annotation_type
+                FROM data_records r
+                         JOIN files f ON f.id = r.file_id
+                WHERE r.{record_key_column(record_key)} = ?
+                  AND r.status = 'active'
+            ''', (record_key,))
+            row = cursor.fetchone()
+            if not row:
+                results.append(None)
+                continue
+            record_id, unique_id, file_id, line_number, old_result, annotation_type = row
+
+            score = parse_score(annotation_result) if annotation_type == 'scoring' else None
+            cursor.execute('''
+                           UPDATE data_records
+                           SET annotation_result = ?,
+                               score             = ?,
+                               updated_at        = CURRENT_TIMESTAMP
+                           WHERE id = ?
+                           ''', (annotation_result, score, record_id))
+
+            file_changes.setdefault(file_id, (annotation_type, []))[1].append((old_result, annotation_result))
+
+            linked_file_ids = []
+            if propagate:
+                linked_file_ids = _propagate_to_duplicates(cursor, record_id, annotation_type, annotation_result)
+                for linked_file_id in linked_file_ids:
+                    file_changes.setdefault(linked_file_id, (annotation_type, []))[1].append(
+                        (None, annotation_result))
+
+            results.append({
+                'id': record_id,
+                'file_id': file_id,
+                'unique_id': unique_id,
+                'line_number': line_number,
+                'annotation_result': annotation_result,
+                'linked_file_ids': sorted(set(linked_file_ids))
+            })
+
+        for file_id, (annotation_type, changes) in file_changes.items():
+            _apply_annotation_deltas(cursor, file_id, annotation_type, changes)
+
+    return results
+
+
+def update_data_annotation(record_key: RecordKey, annotation_result: str) -> bool:
+    """更新数据记录的标注结果，并在同一事务中更新统计计数器"""
+    return update_data_annotations([(record_key, annotation_result)])[0] is not None
+
+
+def batch_update_annotations(file_id: int, annotations: Optional[List[Tuple[RecordKey, str]]] = None,
+                             annotation_result: Optional[str] = None, search: str = "",
+                             annotation_status: str = "all") -> Dict:
+    """批量更新标注结果，所有修改及统计计数器的更新在同一事务中完成
+
+    annotations 为 [(记录ID或unique_id, 标注结果)]；不传时将符合筛选条件（search / annotation_status）
+    的全部记录标注为 annotation_result。
+    """
+    conn = get_connection()
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+
+        cursor.execute('SELECT annotation_type FROM files WHERE id = ?', (file_id,))
+        file_record = cursor.fetchone()
+        if not file_record:
+            return {"updated_count": 0, "missing": []}
+        annotation_type = file_record[0]
+
+        # 读取旧值：(记录ID, 旧标注结果, 新标注结果)
+        changes = []
+        missing = []
+        if annotations is not None:
+            new_results = dict(annotations)
+            keys_by_column = {}
+            for record_key in new_results:
+                keys_by_column.setdefault(record_key_column(record_key), []).append(record_key)
+            found = set()
+            for column, record_keys in keys_by_column.items():
+                # 分批查询，避免超过 SQLite 的参数个数限制
+                for i in range(0, len(record_keys), 500):
+                    chunk = record_keys[i:i + 500]
+                    cursor.execute(f'''
+                        SELECT id, {column}, annotation_result
+                        FROM data_records
+                        WHERE file_id = ?
+                          AND status = 'active'
+                          AND {column} IN ({', '.join('?' * len(chunk))})
+                    ''', [file_id] + chunk)
+                    for record_id, record_key, old_result in cursor.fetchall():
+                        found.add(record_key)
+                        changes.append((record_id, old_result, new_results[record_key]))
+            missing = [record_key for record_key in new_results if record_key not in found]
+        else:
+            from_clause, where_conditions, params, _ = _build_record_filter(file_id, search, annotation_status)
+            cursor.execute(f'''
+                SELECT r.id, r.annotation_result
+                FROM {from_clause}
+                WHERE {' AND '.join(where_conditions)}
+            ''', params)
+            changes = [(record_id, old_result, annotation_result) for record_id, old_result in cursor.fetchall()]
+
+        cursor.executemany('''
+                           UPDATE data_records
+                           SET annotation_result = ?,
+                               score             = ?,
+                               updated_at        = CURRENT_TIMESTAMP
+                           WHERE id = ?
+                           ''', ((new_result, parse_score(new_result) if annotation_type == 'scoring' else None, record_id)
+                                 for record_id, _, new_result in changes))
+
+        # {file_id: (标注类型, [(旧值, 新值)])}
+        file_changes = {file_id: (annotation_type, [(old_result, new_result) for _, old_result, new_result in changes])}
+        propagated_count = 0
+        linked_file_ids = set()
+        if settings.DEDUP_PROPAGATE_LABELS and _has_linked_duplicates(cursor):
+            for record_id, _, new_result in changes:
+                for linked_file_id in _propagate_to_duplicates(cursor, record_id, annotation_type, new_result):
+                    file_changes.setdefault(linked_file_id, (annotation_type, []))[1].append((None, new_result))
+                    linked_file_ids.add(linked_file_id)
+                    propagated_count += 1
+
+        for changed_file_id, (changed_type, file_change_list) in file_changes.items():
+            _apply_annotation_deltas(cursor, changed_file_id, changed_type, file_change_list)
+
+    return {
+        "updated_count": len(changes),
+        "propagated_count": propagated_count,
+        "linked_file_ids": sorted(linked_file_ids),
+        "missing": missing
+    }
 
 
 def get_data_stats_from_db(file_id: int) -> Dict:
-    """从数据库获取数据统计信息"""
-    conn = sqlite3.connect(DATABASE_FILE)
+    """从数据库获取数据统计信息（读取物化的计数器）"""
+    conn = get_connection()
     cursor = conn.cursor()
 
-    # 获取文件信息以确定标注类型
-    cursor.execute('SELECT annotation_type FROM files WHERE id = ?', (file_id,))
-    file_row = cursor.fetchone()
-    annotation_type = file_row[0] if file_row else 'qa'
-
-    # 获取总记录数
     cursor.execute('''
-                   SELECT COUNT(*)
-                   FROM data_records
-                   WHERE file_id = ?
-                     AND status = 'active'
+                   SELECT s.total_count, s.correct_count, s.incorrect_count, f.annotation_type
+                   FROM file_stats s
+                            JOIN files f ON f.id = s.file_id
+                   WHERE s.file_id = ?
                    ''', (file_id,))
-    total_count = cursor.fetchone()[0]
+    row = cursor.fetchone()
+
+    if row:
+        total_count, correct_count, incorrect_count, annotation_type = row
+        score_histogram = {}
+        if annotation_type == 'scoring':
+            cursor.execute('''
+                           SELECT score, count
+                           FROM file_score_histogram
+                           WHERE file_id = ?
+                             AND count > 0
+                           ''', (file_id,))
+            score_histogram = dict(cursor.fetchall())
+        return stats_result(annotation_type, total_count, correct_count, incorrect_count, score_histogram)
+
+    # 计数器尚未建立，退回全量统计
+    return stats_result(**_compute_file_stats(cursor, file_id))
+
+
+def ensure_file_stats() -> int:
+    """为尚未建立统计计数器的有效文件（如旧数据库中的文件）补建计数器，返回补建的文件数"""
+    conn = get_connection()
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
 
-    if annotation_type == 'scoring':
-        # 对于评分标注，按评分值统计
-        # 评分 >= 4 为优质（correct），< 4 为劣质（incorrect）
         cursor.execute('''
-                       SELECT annotation_result
-                       FROM data_records
-                       WHERE file_id = ?
-                         AND status = 'active'
-                         AND annotation_result IS NOT NULL
-                       ''', (file_id,))
+                       SELECT f.id
+                       FROM files f
+                                LEFT JOIN file_stats s ON s.file_id = f.id
+                       WHERE f.status = 'active'
+                         AND s.file_id IS NULL
+                       ''')
+        file_ids = [row[0] for row in cursor.fetchall()]
 
-        results = cursor.fetchall()
-        correct_count = 0  # 优质（评分>=4）
-        incorrect_count = 0  # 劣质（评分<4）
+        for file_id in file_ids:
+            _store_file_stats(cursor, file_id, _compute_file_stats(cursor, file_id))
 
-        for (result,) in results:
-            try:
-                score = float(result)
-                if score >= 4:
-                    correct_count += 1
-                else:
-                    incorrect_count += 1
-            except (ValueError, TypeError):
-                pass
+    return len(file_ids)
+
+
+def rebuild_file_stats(file_id: Optional[int] = None) -> int:
+    """全量重建统计计数器，不指定 file_id 时重建所有有效文件，返回重建的文件数"""
+    conn = get_connection()
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+
+        if file_id is None:
+            cursor.execute("SELECT id FROM files WHERE status = 'active'")
+            file_ids = [row[0] for row in cursor.fetchall()]
+        else:
+            file_ids = [file_id]
+
+        for fid in file_ids:
+            _store_file_stats(cursor, fid, _compute_file_stats(cursor, fid))
+
+    return len(file_ids)
+
+
+def check_file_stats() -> List[Dict]:
+    """比较物化计数器与全量统计结果，返回不一致的文件列表"""
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute('''
+                   SELECT f.id, f.filename, s.total_count, s.correct_count, s.incorrect_count
+                   FROM files f
+                            LEFT JOIN file_stats s ON s.file_id = f.id
+                   WHERE f.status = 'active'
+                   ''')
+    rows = cursor.fetchall()
+
+    mismatches = []
+    for file_id, filename, total_count, correct_count, incorrect_count in rows:
+        stored = {'total_count': total_count, 'correct_count': correct_count, 'incorrect_count': incorrect_count}
+        expected = _compute_file_stats(cursor, file_id)
 
-        unannotated_count = total_count - correct_count - incorrect_count
-    else:
-        # 对于QA标注，按原来的方式统计
         cursor.execute('''
-                       SELECT annotation_result, COUNT(*)
-                       FROM data_records
+                       SELECT score, count
+                       FROM file_score_histogram
                        WHERE file_id = ?
-                         AND status = 'active'
-                       GROUP BY annotation_result
+                         AND count > 0
                        ''', (file_id,))
+        mismatch = stats_mismatch(file_id, filename, stored, dict(cursor.fetchall()), expected)
+        if mismatch:
+            mismatches.append(mismatch)
 
-        annotation_stats = dict(cursor.fetchall())
+    return mismatches
 
-        correct_count = annotation_stats.get('correct', 0)
-        incorrect_count = annotation_stats.get('incorrect', 0)
-        unannotated_count = total_count - correct_count - incorrect_count
 
-    conn.close()
+def build_export_query(file_id: int, export_type: str = "correct", min_score: Optional[float] = None,
+                       max_score: Optional[float] = None) -> Tuple[str, List]:
+    """构建导出查询（正确或错误），返回 SQL 与参数
 
-    return {
-        "total_count": total_count,
-        "correct_count": correct_count,
-        "incorrect_count": incorrect_count,
-        "unannotated_count": unannotated_count,
-        "annotation_distribution": {
-            "correct": correct_count,
-            "incorrect": incorrect_count,
-            "unannotated": unannotated_count
-        }
-    }
-
-
-async def export_data_from_db(file_id: int, export_name: str, export_type: str = "correct") -> Optional[Dict]:
-    """从数据库导出标注数据（正确或错误）"""
-    conn = sqlite3.connect(DATABASE_FILE)
+    评分标注可通过 min_score / max_score（闭区间）指定任意分数范围，此时忽略 export_type。
+    """
+    conn = get_connection()
     cursor = conn.cursor()
 
     # 验证导出类型
@@ -324,87 +1086,296 @@ async def export_data_from_db(file_id: int, export_name: str, export_type: str =
 
     # 获取文件的标注类型
     cursor.execute('SELECT annotation_type FROM files WHERE id = ?', (file_id,))
-    file_row = cursor.fetchone()
-    annotation_type = file_row[0] if file_row else 'qa'
+    file_record = cursor.fetchone()
+    annotation_type = file_record[0] if file_record else 'qa'
 
-    # 根据标注类型和导出类型查询数据
+    # 根据标注类型和导出类型构建查询条件
     if annotation_type == 'scoring':
-        # 对于评分标注: >= 4 为优质(correct), < 4 为劣质(incorrect)
-        if export_type == 'correct':
-            # 导出评分 >= 4 的数据
-            cursor.execute('''
-                           SELECT system, query, response, annotation_result
-                           FROM data_records
-                           WHERE file_id = ?
-                             AND annotation_result IS NOT NULL
-                             AND status = 'active'
-                           ORDER BY line_number
-                           ''', (file_id,))
-            all_rows = cursor.fetchall()
-            # 过滤出评分 >= 4 的记录
-            rows = []
-            for row in all_rows:
-                try:
-                    score = float(row[3])  # annotation_result
-                    if score >= 4:
-                        rows.append(row[:3])  # 只取 system, query, response
-                except (ValueError, TypeError):
-                    pass
+        # 对于评分标注: >= 4 为优质(correct), < 4 为劣质(incorrect)，在 SQL 中按 score 列过滤
+        # 分数条件写作 +score，使查询按行号顺序读取已评分记录的索引（idx_data_records_scored_line），
+        # 而不是按分数区间检索后再对结果排序
+        score_conditions = ["score IS NOT NULL"]
+        if min_score is not None or max_score is not None:
+            params = [file_id]
+            if min_score is not None:
+                score_conditions.append("+score >= ?")
+                params.append(min_score)
+            if max_score is not None:
+                score_conditions.append("+score <= ?")
+                params.append(max_score)
+        elif export_type == 'correct':
+            score_conditions.append("+score >= ?")
+            params = [file_id, SCORE_THRESHOLD]
         else:  # incorrect
-            # 导出评分 < 4 的数据
-            cursor.execute('''
-                           SELECT system, query, response, annotation_result
-                           FROM data_records
-                           WHERE file_id = ?
-                             AND annotation_result IS NOT NULL
-                             AND status = 'active'
-                           ORDER BY line_number
-                           ''', (file_id,))
-            all_rows = cursor.fetchall()
-            # 过滤出评分 < 4 的记录
-            rows = []
-            for row in all_rows:
-                try:
-                    score = float(row[3])  # annotation_result
-                    if score < 4:
-                        rows.append(row[:3])  # 只取 system, query, response
-                except (ValueError, TypeError):
-                    pass
+            score_conditions.append("+score < ?")
+            params = [file_id, SCORE_THRESHOLD]
+        export_filter = ' AND '.join(score_conditions)
     else:
         # 对于QA标注: 直接匹配 'correct' 或 'incorrect'
+        export_filter = "annotation_result = ?"
+        params = [file_id, export_type]
+
+    query = f'''
+        SELECT {system_text('data_records')}, query, {response_text('data_records')}, {raw_text('data_records')}
+        FROM data_records
+        WHERE file_id = ?
+          AND status = 'active'
+          AND {export_filter}
+        ORDER BY line_number
+    '''
+    return query, params
+
+
+def iter_export_chunks(query: str, params: List,
+                       fetch_size: int = settings.EXPORT_FETCH_SIZE) -> Iterator[Tuple[bytes, int]]:
+    """分块遍历导出查询结果，每块序列化为 JSONL 字节串，返回 (数据块, 记录数)
+
+    保留了原始记录的数据按原样导出（包含所有字段），其余记录导出 system / query / response。
+    使用独立连接，且不要求在同一线程中迭代，可直接用于流式响应。
+    """
+    conn = connect(check_same_thread=False)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        while rows := cursor.fetchmany(fetch_size):
+            yield export_chunk(rows), len(rows)
+    finally:
+        conn.close()
+
+
+def count_export_rows(query: str, params: List) -> int:
+    """统计导出查询的结果行数"""
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(f'SELECT COUNT(*) FROM ({query})', params)
+    return cursor.fetchone()[0]
+
+
+def lease_records(file_id: int, session_id: str, count: int, prefetch: int, lease_seconds: float) -> Dict:
+    """为标注会话领取文件中的未标注记录（标注任务队列）
+
+    会话已持有且仍未标注的记录续期后继续返回（已标注的自动释放），不足 count + prefetch 条时
+    按行号顺序从未标注队列（idx_data_records_unannotated）中领取其他会话未持有的记录；
+    过期的租约先被清除，对应记录重新进入队列。返回 {records: 当前批次, prefetch: 下一批次, expires_at}。
+    """
+    now = time.time()
+    expires_at = now + lease_seconds
+    conn = get_connection()
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+
+        cursor.execute('DELETE FROM record_leases WHERE file_id = ? AND expires_at < ?', (file_id, now))
         cursor.execute('''
-                       SELECT system, query, response
-                       FROM data_records
+                       DELETE
+                       FROM record_leases
                        WHERE file_id = ?
-                         AND annotation_result = ?
-                         AND status = 'active'
-                       ORDER BY line_number
-                       ''', (file_id, export_type))
-        rows = cursor.fetchall()
+                         AND session_id = ?
+                         AND NOT EXISTS (SELECT 1
+                                         FROM data_records r
+                                         WHERE r.id = record_leases.record_id
+                                           AND r.status = 'active'
+                                           AND r.annotation_result IS NULL)
+                       ''', (file_id, session_id))
+        cursor.execute('UPDATE record_leases SET expires_at = ? WHERE file_id = ? AND session_id = ?',
+                       (expires_at, file_id, session_id))
+        wanted = count + prefetch - cursor.rowcount
+
+        if wanted > 0:
+            cursor.execute('''
+                           SELECT r.id, r.line_number
+                           FROM data_records r
+                           WHERE r.file_id = ?
+                             AND r.status = 'active'
+                             AND r.annotation_result IS NULL
+                             AND NOT EXISTS (SELECT 1 FROM record_leases l WHERE l.record_id = r.id)
+                           ORDER BY r.line_number
+                           LIMIT ?
+                           ''', (file_id, wanted))
+            cursor.executemany('''
+                               INSERT INTO record_leases (record_id, file_id, session_id, line_number, expires_at)
+                               VALUES (?, ?, ?, ?, ?)
+                               ''', [(record_id, file_id, session_id, line_number, expires_at)
+                                     for record_id, line_number in cursor.fetchall()])
+
+        cursor.execute(f'''
+            SELECT r.id, r.unique_id, r.line_number, {system_text('r')}, r.query, {response_text('r')},
+                   r.annotation_result, r.created_at, r.updated_at, NULL, r.duplicate_of, r.near_duplicate_of
+            FROM record_leases l
+                     JOIN data_records r ON r.id = l.record_id
+            WHERE l.file_id = ?
+              AND l.session_id = ?
+            ORDER BY l.line_number
+        ''', (file_id, session_id))
+        session_records = [record_row(row) for row in cursor.fetchall()]
+
+    return leased_records(session_records, count, expires_at)
+
+
+def release_leases(file_id: int, session_id: str) -> int:
+    """释放标注会话在文件中持有的全部记录，返回释放的条数"""
+    conn = get_connection()
+    with conn:
+        cursor = conn.cursor()
+
+        cursor.execute('DELETE FROM record_leases WHERE file_id = ? AND session_id = ?', (file_id, session_id))
+        return cursor.rowcount
+
+
+def create_job(job_type: str, params: Dict) -> str:
+    """创建后台任务，返回任务ID"""
+    job_id = uuid.uuid4().hex
+    conn = get_connection()
+    with conn:
+        cursor = conn.cursor()
 
-    conn.close()
+        cursor.execute('''
+            INSERT INTO jobs (id, job_type, status, params, created_at, updated_at)
+            VALUES (?, ?, 'pending', ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+        ''', (job_id, job_type, json.dumps(params, ensure_ascii=False)))
 
-    # 准备导出数据
-    export_data = []
-    for row in rows:
-        export_data.append({
-            'system': row[0] or '',
-            'query': row[1] or '',
-            'response': row[2] or ''
-        })
+    return job_id
 
-    # 创建导出文件
-    export_path = os.path.join(OUTPUT_FOLDER, export_name)
 
-    try:
-        async with aiofiles.open(export_path, 'w', encoding='utf-8') as f:
-            for item in export_data:
-                await f.write(json.dumps(item, ensure_ascii=False) + '\n')
+def get_job(job_id: str) -> Optional[Dict]:
+    """获取后台任务信息"""
+    conn = get_connection()
+    cursor = conn.cursor()
 
-        return {
-            "export_path": export_path,
-            "export_count": len(export_data)
-        }
-    except Exception as e:
-        print(f"Error exporting data: {e}")
-        return None
+    cursor.execute('''
+                   SELECT id,
+                          job_type,
+                          status,
+                          params,
+                          processed,
+                          progress,
+                          checkpoint,
+                          result,
+                          error,
+                          started_at,
+                          created_at,
+                          updated_at
+                   FROM jobs
+                   WHERE id = ?
+                   ''', (job_id,))
+
+    row = cursor.fetchone()
+    return job_row(row) if row else None
+
+
+def claim_job(job_id: str, owner: str, stale_before: float) -> Optional[Dict]:
+    """认领任务：仅当任务待执行，或执行中但心跳已过期（原工作进程已退出）时成功"""
+    conn = get_connection()
+    with conn:
+        cursor = conn.cursor()
+
+        cursor.execute('''
+                       UPDATE jobs
+                       SET status       = 'running',
+                           owner        = ?,
+                           heartbeat_at = ?,
+                           started_at   = COALESCE(started_at, ?),
+                           updated_at   = CURRENT_TIMESTAMP
+                       WHERE id = ?
+                         AND (status = 'pending' OR (status = 'running' AND heartbeat_at < ?))
+                       ''', (owner, time.time(), time.time(), job_id, stale_before))
+        claimed = cursor.rowcount > 0
+
+    return get_job(job_id) if claimed else None
+
+
+def list_resumable_jobs(stale_before: float) -> List[str]:
+    """列出待执行或心跳已过期的任务ID"""
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute('''
+                   SELECT id
+                   FROM jobs
+                   WHERE status = 'pending'
+                      OR (status = 'running' AND heartbeat_at < ?)
+                   ORDER BY created_at
+                   ''', (stale_before,))
+
+    return [row[0] for row in cursor.fetchall()]
+
+
+def update_job_progress(cursor: sqlite3.Cursor, job_id: str, owner: str, processed: int, progress: float,
+                        checkpoint: Optional[Dict] = None) -> bool:
+    """更新任务进度与断点（在调用方的事务中执行），任务已被其他进程接管时返回 False"""
+    cursor.execute('''
+                   UPDATE jobs
+                   SET processed    = ?,
+                       progress     = ?,
+                       checkpoint   = COALESCE(?, checkpoint),
+                       heartbeat_at = ?,
+                       updated_at   = CURRENT_TIMESTAMP
+                   WHERE id = ?
+                     AND owner = ?
+                   ''', (processed, progress, json.dumps(checkpoint) if checkpoint is not None else None,
+                         time.time(), job_id, owner))
+    return cursor.rowcount > 0
+
+
+def finish_job(job_id: str, owner: str, status: str, result: Optional[Dict] = None, error: Optional[str] = None):
+    """结束任务（completed / failed）"""
+    conn = get_connection()
+    with conn:
+        cursor = conn.cursor()
+
+        cursor.execute('''
+                       UPDATE jobs
+                       SET status     = ?,
+                           result     = ?,
+                           error      = ?,
+                           progress   = CASE WHEN ? = 'completed' THEN 1 ELSE progress END,
+                           updated_at = CURRENT_TIMESTAMP
+                       WHERE id = ?
+                         AND owner = ?
+                       ''', (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error,
+                             status, job_id, owner))
+
+
+def append_file_events(worker_id: str, events: List[Tuple[int, Dict]], expire_before: float):
+    """写入本进程发布的事件供其他工作进程转发，同时清理过期事件"""
+    conn = get_connection()
+    with conn:
+        cursor = conn.cursor()
+
+        now = time.time()
+        cursor.executemany('''
+                           INSERT INTO file_events (worker_id, file_id, event, created_at)
+                           VALUES (?, ?, ?, ?)
+                           ''', [(worker_id, file_id, json.dumps(event, ensure_ascii=False), now)
+                                 for file_id, event in events])
+        cursor.execute('DELETE FROM file_events WHERE created_at < ?', (expire_before,))
+
+
+def get_last_file_event_id() -> int:
+    """当前最新的事件ID（开始转发时从此之后读取）"""
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute('SELECT COALESCE(MAX(id), 0) FROM file_events')
+    return cursor.fetchone()[0]
+
+
+def get_file_events_since(last_id: int, worker_id: str) -> Tuple[int, List[Tuple[int, Dict]]]:
+    """读取其他工作进程在 last_id 之后发布的事件，返回 (读到的最新事件ID, [(文件ID, 事件)])"""
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute('''
+                   SELECT id, worker_id, file_id, event
+                   FROM file_events
+                   WHERE id > ?
+                   ORDER BY id
+                   ''', (last_id,))
+
+    events = []
+    for event_id, event_worker_id, file_id, event in cursor.fetchall():
+        last_id = event_id
+        if event_worker_id != worker_id:
+            events.append((file_id, json.loads(event)))
+    return last_id, events
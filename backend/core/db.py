@@ -1,16 +1,296 @@
+import logging
 import os
+import random
 import sqlite3
+import math
+import threading
+import time
+from functools import lru_cache
+from typing import Callable, Optional, Set, TypeVar
 
-from backend.conf import BASE_PATH
+from backend.conf import BASE_PATH, settings
+from backend.core.dedup import content_hash
+from backend.core.storage import register_functions, system_text, response_text
 
 DATABASE_FILE = os.path.join(BASE_PATH, "files.db")
 
+# 由 `webz run` 在启动工作进程前完成数据库初始化后设置，工作进程据此跳过初始化
+DATABASE_READY_ENV = 'WEBZ_DATABASE_READY'
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+# 所有线程的长连接，关闭时（进程退出、切换数据库文件）需要一并关闭，因此允许在其他线程中关闭
+_connections: Set[sqlite3.Connection] = set()
+_connections_lock = threading.Lock()
+
+T = TypeVar('T')
+
+# data_records 的二级索引（批量导入时可先删除，导入完成后统一重建）
+DATA_RECORD_INDEXES = {
+    # 按文件分页的复合覆盖索引，支持 (file_id, line_number) 游标分页和计数，以及不带状态条件的按行定位
+    'idx_data_records_file_line': 'ON data_records (file_id, line_number, status, annotation_result)',
+    # 按标注结果筛选（导出、统计分组），同一结果内按行号有序
+    'idx_data_records_file_result': "ON data_records (file_id, annotation_result, line_number) WHERE status = 'active'",
+    # 未标注队列：只包含待标注的记录，标注后即移出索引
+    'idx_data_records_unannotated': "ON data_records (file_id, line_number) "
+                                    "WHERE status = 'active' AND annotation_result IS NULL",
+    # 评分标注按分数区间筛选和统计直方图
+    'idx_data_records_file_score': "ON data_records (file_id, score) WHERE status = 'active'",
+    # 评分标注按行号顺序导出已评分的记录
+    'idx_data_records_scored_line': "ON data_records (file_id, line_number, score) "
+                                    "WHERE status = 'active' AND score IS NOT NULL",
+    # 重复记录关联：由首条记录找到关联到它的重复记录
+    'idx_data_records_duplicate_of': "ON data_records (duplicate_of) WHERE duplicate_of IS NOT NULL",
+}
+
+
+# 内容哈希索引（全局及按文件查找重复记录）；导入时需要用它查重，因此不随其他二级索引延迟创建
+CONTENT_HASH_INDEX = 'idx_data_records_content_hash'
+CONTENT_HASH_INDEX_DEFINITION = "ON data_records (content_hash, file_id) WHERE status = 'active'"
+
+# 已被取代的旧索引（unique_id 的 UNIQUE 约束本身已带索引）
+OBSOLETE_INDEXES = ['idx_data_records_file_id', 'idx_data_records_unique_id', 'idx_data_records_annotation_result']
+
+
+def create_data_record_indexes(cursor: sqlite3.Cursor):
+    """创建 data_records 的二级索引"""
+    for name in OBSOLETE_INDEXES:
+        cursor.execute(f'DROP INDEX IF EXISTS {name}')
+    for name, definition in DATA_RECORD_INDEXES.items():
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} {definition}')
+
+
+def drop_data_record_indexes(cursor: sqlite3.Cursor):
+    """删除 data_records 的二级索引"""
+    for name in DATA_RECORD_INDEXES:
+        cursor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+# 全文索引：外部内容表指向还原了 system/response 原文的视图，trigram 分词器支持中文子串匹配
+FTS_TABLE = 'data_records_fts'
+FTS_CONTENT_VIEW = 'data_records_text'
+FTS_CONTENT_VIEW_DEFINITION = f'''
+    SELECT id, {system_text('data_records')} AS system, query, {response_text('data_records')} AS response
+    FROM data_records
+'''
+
+# 连接级 SQL 函数：批量导入的连接上返回 1，其写入的记录不经插入触发器逐行写入全文索引，由 BulkLoader 按批写入
+FTS_DEFERRED_FUNCTION = 'fts_deferred'
+
+# 全文索引同步触发器（只索引 status = 'active' 的记录，软删除时移出索引）
+FTS_INSERT_TRIGGER = 'data_records_fts_ai'
+FTS_UPDATE_TRIGGER = 'data_records_fts_au'
+FTS_TRIGGERS = {
+    FTS_INSERT_TRIGGER: f'''
+        AFTER INSERT ON data_records WHEN NEW.status = 'active' AND NOT {FTS_DEFERRED_FUNCTION}()
+        BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, system, query, response)
+            VALUES (NEW.id, {system_text('NEW')}, NEW.query, {response_text('NEW')});
+        END
+    ''',
+    'data_records_fts_ad': f'''
+        AFTER DELETE ON data_records WHEN OLD.status = 'active'
+        BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, system, query, response)
+            VALUES ('delete', OLD.id, {system_text('OLD')}, OLD.query, {response_text('OLD')});
+        END
+    ''',
+    FTS_UPDATE_TRIGGER: f'''
+        AFTER UPDATE OF system, system_id, query, response, status ON data_records
+        BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, system, query, response)
+            SELECT 'delete', OLD.id, {system_text('OLD')}, OLD.query, {response_text('OLD')}
+            WHERE OLD.status = 'active';
+            INSERT INTO {FTS_TABLE}(rowid, system, query, response)
+            SELECT NEW.id, {system_text('NEW')}, NEW.query, {response_text('NEW')}
+            WHERE NEW.status = 'active';
+        END
+    ''',
+}
+
+
+def create_fts_triggers(cursor: sqlite3.Cursor):
+    """创建全文索引同步触发器"""
+    for name, definition in FTS_TRIGGERS.items():
+        cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {definition}')
+
+
+def init_fts(cursor: sqlite3.Cursor) -> bool:
+    """创建全文索引表及触发器，当前 SQLite 不支持 FTS5/trigram 时返回 False"""
+    cursor.execute(f'CREATE VIEW IF NOT EXISTS {FTS_CONTENT_VIEW} AS {FTS_CONTENT_VIEW_DEFINITION}')
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,))
+    row = cursor.fetchone()
+    if row and FTS_CONTENT_VIEW not in row[0]:
+        # 旧版本的全文索引直接以 data_records 为内容表，无法读取压缩存储的原文，重建
+        for name in FTS_TRIGGERS:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        cursor.execute(f'DROP TABLE {FTS_TABLE}')
+        row = None
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (FTS_INSERT_TRIGGER,))
+    trigger = cursor.fetchone()
+    if trigger and FTS_DEFERRED_FUNCTION not in trigger[0]:
+        # 旧版本的插入触发器在批量导入时也逐行写入全文索引，重建
+        cursor.execute(f'DROP TRIGGER {FTS_INSERT_TRIGGER}')
+    if row is None:
+        try:
+            cursor.execute(f'''
+                CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+                    system, query, response,
+                    content = '{FTS_CONTENT_VIEW}', content_rowid = 'id',
+                    tokenize = 'trigram'
+                )
+            ''')
+        except sqlite3.OperationalError as e:
+            logger.warning("SQLite 不支持 FTS5 全文索引，关键词检索使用 LIKE 逐条匹配: %s", e, exc_info=True)
+            return False
+        # 为已有数据建立索引
+        cursor.execute(f'''
+            INSERT INTO {FTS_TABLE}(rowid, system, query, response)
+            SELECT id, {system_text('data_records')}, query, {response_text('data_records')}
+            FROM data_records
+            WHERE status = 'active'
+        ''')
+    create_fts_triggers(cursor)
+    return True
+
+
+@lru_cache
+def fts_enabled() -> bool:
+    """数据库中是否存在全文索引表"""
+    cursor = get_connection().cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,))
+    return cursor.fetchone() is not None
+
+
+def parse_score(annotation_result) -> Optional[float]:
+    """将评分标注结果解析为数值，无法解析时返回 None"""
+    try:
+        score = float(annotation_result)
+    except (ValueError, TypeError):
+        return None
+    return score if math.isfinite(score) else None
+
+
+def connect(**kwargs) -> sqlite3.Connection:
+    """创建一个新的数据库连接并设置连接级参数"""
+    conn = sqlite3.connect(
+        DATABASE_FILE,
+        timeout=settings.SQLITE_BUSY_TIMEOUT / 1000,
+        cached_statements=settings.SQLITE_CACHED_STATEMENTS,
+        **kwargs
+    )
+    conn.execute(f'PRAGMA busy_timeout = {settings.SQLITE_BUSY_TIMEOUT}')
+    conn.execute(f'PRAGMA mmap_size = {settings.SQLITE_MMAP_SIZE}')
+    # WAL 模式下 NORMAL 即可保证一致性
+    conn.execute('PRAGMA synchronous = NORMAL')
+    register_functions(conn, DATABASE_FILE)
+    conn.create_function(FTS_DEFERRED_FUNCTION, 0, lambda: 0)
+    return conn
+
+
+def is_busy_error(error: BaseException) -> bool:
+    """是否为等待写锁超时（SQLITE_BUSY：其他连接或工作进程持有写锁超过 busy_timeout）"""
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    error_code = getattr(error, 'sqlite_errorcode', None)
+    return error_code is not None and error_code & 0xff == sqlite3.SQLITE_BUSY
+
+
+def retry_on_busy(func: Callable[..., T], *args, **kwargs) -> T:
+    """执行写操作，等待写锁超时时按指数退避（带随机抖动）重试 SQLITE_BUSY_RETRIES 次
+
+    写操作都在 `with conn` 事务中执行，失败时事务已回滚，整体重试是安全的。
+    """
+    delay = settings.SQLITE_BUSY_RETRY_DELAY
+    for _ in range(settings.SQLITE_BUSY_RETRIES):
+        try:
+            return func(*args, **kwargs)
+        except sqlite3.OperationalError as e:
+            if not is_busy_error(e):
+                raise
+        time.sleep(delay * random.uniform(0.5, 1.5))
+        delay *= 2
+    return func(*args, **kwargs)
+
+
+def get_connection() -> sqlite3.Connection:
+    """获取当前线程的长连接（每个线程复用同一个连接）"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = connect(check_same_thread=False)
+        _local.conn = conn
+        with _connections_lock:
+            _connections.add(conn)
+    return conn
+
+
+def close_connection():
+    """关闭当前线程的长连接"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        with _connections_lock:
+            _connections.discard(conn)
+        conn.close()
+        _local.conn = None
+
+
+def close_all_connections():
+    """关闭所有线程（读写线程池等）的长连接，各线程之后再次使用时重新建立"""
+    global _local
+    with _connections_lock:
+        connections = list(_connections)
+        _connections.clear()
+        _local = threading.local()
+    for conn in connections:
+        conn.close()
+
+
+def switch_database(database_file: str):
+    """切换数据库文件（检查命令和压测使用临时数据库）：关闭各线程的连接，清除按数据库缓存的状态"""
+    global DATABASE_FILE
+    close_all_connections()
+    DATABASE_FILE = database_file
+    fts_enabled.cache_clear()
+
+
+def _reset_after_fork():
+    """子进程不能继续使用父进程打开的连接，丢弃继承来的连接，由各工作进程重新建立"""
+    global _local, _connections_lock
+    _local = threading.local()
+    _connections.clear()
+    _connections_lock = threading.Lock()
+    fts_enabled.cache_clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
 
 def init_database():
-    """初始化SQLite数据库"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
+    """初始化SQLite数据库
+
+    建表和迁移在同一个写事务中完成，多个进程同时初始化时依次执行，后执行的进程不会重复迁移。
+    """
+    conn = connect(isolation_level=None)
+    try:
+        cursor = conn.cursor()
+
+        # WAL 模式：读操作不再阻塞写操作（该设置持久化在数据库文件中，不能在事务中修改）
+        cursor.execute('PRAGMA journal_mode = WAL')
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            _migrate(cursor)
+        except BaseException:
+            cursor.execute('ROLLBACK')
+            raise
+        cursor.execute('COMMIT')
+    finally:
+        conn.close()
+
 
+def _migrate(cursor: sqlite3.Cursor):
+    """建表及迁移旧版本数据库（在 init_database 的事务中执行）"""
     # 创建文件信息表
     cursor.execute('''
                    CREATE TABLE IF NOT EXISTS files
@@ -64,7 +344,6 @@ def init_database():
         cursor.execute("ALTER TABLE files ADD COLUMN annotation_type TEXT DEFAULT 'qa'")
         # 更新所有现有记录的 annotation_type 为默认值 'qa'
         cursor.execute("UPDATE files SET annotation_type = 'qa' WHERE annotation_type IS NULL")
-        conn.commit()
 
     # 创建数据记录表
     cursor.execute('''
@@ -90,12 +369,28 @@ def init_database():
                        NULL,
                        system
                        TEXT,
+                       system_id
+                       INTEGER,
                        query
                        TEXT,
                        response
                        TEXT,
                        annotation_result
                        TEXT,
+                       score
+                       REAL,
+                       byte_offset
+                       INTEGER,
+                       byte_length
+                       INTEGER,
+                       raw
+                       TEXT,
+                       content_hash
+                       TEXT,
+                       duplicate_of
+                       INTEGER,
+                       near_duplicate_of
+                       INTEGER,
                        created_at
                        TIMESTAMP
                        DEFAULT
@@ -119,21 +414,201 @@ def init_database():
                        )
                    ''')
 
+    # 检查并添加 score 列（如果不存在），回填已有的评分标注
+    try:
+        cursor.execute("SELECT score FROM data_records LIMIT 1")
+    except sqlite3.OperationalError:
+        cursor.execute("ALTER TABLE data_records ADD COLUMN score REAL")
+        cursor.execute('''
+                       SELECT r.id, r.annotation_result
+                       FROM data_records r
+                                JOIN files f ON f.id = r.file_id
+                       WHERE f.annotation_type = 'scoring'
+                         AND r.annotation_result IS NOT NULL
+                       ''')
+        scores = [(parse_score(result), record_id) for record_id, result in cursor.fetchall()]
+        cursor.executemany('UPDATE data_records SET score = ? WHERE id = ?', scores)
+
+    # 检查并添加行偏移索引列（如果不存在），旧数据在首次物化编辑时补建
+    try:
+        cursor.execute("SELECT byte_offset, byte_length FROM data_records LIMIT 1")
+    except sqlite3.OperationalError:
+        cursor.execute("ALTER TABLE data_records ADD COLUMN byte_offset INTEGER")
+        cursor.execute("ALTER TABLE data_records ADD COLUMN byte_length INTEGER")
+
+    # 检查并添加内容哈希及重复关联列（如果不存在），回填已有记录的内容哈希
+    try:
+        cursor.execute("SELECT content_hash, duplicate_of, near_duplicate_of FROM data_records LIMIT 1")
+    except sqlite3.OperationalError:
+        cursor.execute("ALTER TABLE data_records ADD COLUMN content_hash TEXT")
+        cursor.execute("ALTER TABLE data_records ADD COLUMN duplicate_of INTEGER")
+        cursor.execute("ALTER TABLE data_records ADD COLUMN near_duplicate_of INTEGER")
+        last_id = 0
+        while True:
+            cursor.execute('''
+                           SELECT id, system, query, response
+                           FROM data_records
+                           WHERE id > ?
+                           ORDER BY id
+                           LIMIT ?
+                           ''', (last_id, settings.INGEST_BATCH_SIZE))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            cursor.executemany('UPDATE data_records SET content_hash = ? WHERE id = ?',
+                               [(content_hash(system, query, response), record_id)
+                                for record_id, system, query, response in rows])
+            last_id = rows[-1][0]
+
+    # 检查并添加原始记录列（如果不存在），旧数据的原始记录只有 system / query / response，无需回填
+    try:
+        cursor.execute("SELECT raw FROM data_records LIMIT 1")
+    except sqlite3.OperationalError:
+        cursor.execute("ALTER TABLE data_records ADD COLUMN raw TEXT")
+
+    # 检查并添加 system 提示词驻留列（如果不存在）
+    try:
+        cursor.execute("SELECT system_id FROM data_records LIMIT 1")
+    except sqlite3.OperationalError:
+        cursor.execute("ALTER TABLE data_records ADD COLUMN system_id INTEGER")
+
+    # 检查并添加文件版本号列（如果不存在）：文件的数据记录或统计每次变化时递增，用于列表页和统计接口的 ETag
+    try:
+        cursor.execute("SELECT version FROM files LIMIT 1")
+    except sqlite3.OperationalError:
+        cursor.execute("ALTER TABLE files ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+    # 压缩存储：驻留的 system 提示词（按内容哈希去重，各文件共用）和按文件训练的压缩字典
+    cursor.execute('''
+                   CREATE TABLE IF NOT EXISTS system_prompts
+                   (
+                       id           INTEGER PRIMARY KEY AUTOINCREMENT,
+                       content_hash TEXT NOT NULL UNIQUE,
+                       content      TEXT NOT NULL
+                   )
+                   ''')
+    cursor.execute('''
+                   CREATE TABLE IF NOT EXISTS compression_dictionaries
+                   (
+                       id         INTEGER PRIMARY KEY AUTOINCREMENT,
+                       file_id    INTEGER NOT NULL,
+                       data       BLOB    NOT NULL,
+                       created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                   )
+                   ''')
+    cursor.execute('''
+                   CREATE INDEX IF NOT EXISTS idx_compression_dictionaries_file
+                       ON compression_dictionaries (file_id)
+                   ''')
+
+    # 创建编辑日志表（/api/update 的修改先记录在此，物化到源文件时再合并）
+    cursor.execute('''
+                   CREATE TABLE IF NOT EXISTS data_edits
+                   (
+                       id           INTEGER PRIMARY KEY AUTOINCREMENT,
+                       file_id      INTEGER NOT NULL,
+                       line_number  INTEGER NOT NULL,
+                       updates      TEXT    NOT NULL,
+                       materialized INTEGER NOT NULL DEFAULT 0,
+                       created_at   TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                   )
+                   ''')
+    # 未物化的编辑按文件读取，索引隐含 id 列，读取时按 id 顺序合并无需排序
+    cursor.execute('DROP INDEX IF EXISTS idx_data_edits_pending')
+    cursor.execute('''
+                   CREATE INDEX IF NOT EXISTS idx_data_edits_file_pending
+                       ON data_edits (file_id) WHERE materialized = 0
+                   ''')
+
+    # 旧版本的 unique_id 带有导入时间戳，统一改为由 (file_id, line_number) 确定的 "{file_id}_{line_number}"
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_data_records_unique_id'")
+    if cursor.fetchone():
+        cursor.execute('''
+                       UPDATE data_records
+                       SET unique_id = file_id || '_' || line_number
+                       WHERE unique_id <> file_id || '_' || line_number
+                       ''')
+
     # 创建索引
+    create_data_record_indexes(cursor)
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS {CONTENT_HASH_INDEX} {CONTENT_HASH_INDEX_DEFINITION}')
+
+    # 创建文件统计计数器表（由写操作在同一事务中维护）
     cursor.execute('''
-                   CREATE INDEX IF NOT EXISTS idx_data_records_file_id
-                       ON data_records (file_id)
+                   CREATE TABLE IF NOT EXISTS file_stats
+                   (
+                       file_id         INTEGER PRIMARY KEY,
+                       total_count     INTEGER NOT NULL DEFAULT 0,
+                       correct_count   INTEGER NOT NULL DEFAULT 0,
+                       incorrect_count INTEGER NOT NULL DEFAULT 0,
+                       updated_at      TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                   )
                    ''')
 
     cursor.execute('''
-                   CREATE INDEX IF NOT EXISTS idx_data_records_unique_id
-                       ON data_records (unique_id)
+                   CREATE TABLE IF NOT EXISTS file_score_histogram
+                   (
+                       file_id INTEGER NOT NULL,
+                       score   REAL    NOT NULL,
+                       count   INTEGER NOT NULL DEFAULT 0,
+                       PRIMARY KEY (file_id, score)
+                   )
                    ''')
 
+    # 创建后台任务表（导入/导出任务及其进度、断点）
+    cursor.execute('''
+                   CREATE TABLE IF NOT EXISTS jobs
+                   (
+                       id           TEXT PRIMARY KEY,
+                       job_type     TEXT    NOT NULL,
+                       status       TEXT    NOT NULL DEFAULT 'pending',
+                       params       TEXT    NOT NULL,
+                       processed    INTEGER NOT NULL DEFAULT 0,
+                       progress     REAL    NOT NULL DEFAULT 0,
+                       checkpoint   TEXT,
+                       result       TEXT,
+                       error        TEXT,
+                       owner        TEXT,
+                       heartbeat_at REAL,
+                       started_at   REAL,
+                       created_at   TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                       updated_at   TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                   )
+                   ''')
+
+    # 多进程部署时经数据库转发的实时事件（见 FileEventHub），只保留最近一段时间
+    cursor.execute('''
+                   CREATE TABLE IF NOT EXISTS file_events
+                   (
+                       id         INTEGER PRIMARY KEY AUTOINCREMENT,
+                       worker_id  TEXT    NOT NULL,
+                       file_id    INTEGER NOT NULL,
+                       event      TEXT    NOT NULL,
+                       created_at REAL    NOT NULL
+                   )
+                   ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_file_events_created ON file_events (created_at)')
+
+    # 标注任务队列的租约（见 crud.lease_records）：记录被某个标注会话领取后，在到期前不会再分配给其他会话
+    cursor.execute('''
+                   CREATE TABLE IF NOT EXISTS record_leases
+                   (
+                       record_id   INTEGER PRIMARY KEY,
+                       file_id     INTEGER NOT NULL,
+                       session_id  TEXT    NOT NULL,
+                       line_number INTEGER NOT NULL,
+                       expires_at  REAL    NOT NULL
+                   )
+                   ''')
+    # 按会话读取持有的记录（按行号有序），以及按文件清理过期租约
+    cursor.execute('''
+                   CREATE INDEX IF NOT EXISTS idx_record_leases_session
+                       ON record_leases (file_id, session_id, line_number)
+                   ''')
     cursor.execute('''
-                   CREATE INDEX IF NOT EXISTS idx_data_records_annotation_result
-                       ON data_records (annotation_result)
+                   CREATE INDEX IF NOT EXISTS idx_record_leases_expires
+                       ON record_leases (file_id, expires_at)
                    ''')
 
-    conn.commit()
-    conn.close()
+    # 创建全文索引
+    init_fts(cursor)
@@ -0,0 +1,112 @@
+import hashlib
+import zlib
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from backend.conf import settings
+
+DEDUP_OFF = 'off'
+# 完全重复的记录不写入
+DEDUP_SKIP = 'skip'
+# 完全重复的记录照常写入，但关联到首条相同内容的记录（duplicate_of），并继承其标注结果
+DEDUP_LINK = 'link'
+DEDUP_MODES = (DEDUP_OFF, DEDUP_SKIP, DEDUP_LINK)
+
+
+def content_hash(system: str, query: str, response: str) -> str:
+    """计算记录内容（system / query / response）的哈希，用于识别完全重复的记录"""
+    digest = hashlib.blake2b(digest_size=16)
+    for field in (system, query, response):
+        data = (field or '').encode('utf-8')
+        # 写入长度前缀，避免字段边界不同的记录得到相同的哈希
+        digest.update(len(data).to_bytes(8, 'little'))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+_EMPTY_BIN = 0xFFFFFFFF
+# 每个 LSH 桶最多保留的候选记录数，避免大量相似记录落入同一桶时比较次数成平方增长
+_MAX_BUCKET_SIZE = 8
+
+
+class MinHashLSH:
+    """基于 MinHash + LSH 的近似重复检测
+
+    签名使用单次哈希分桶的 MinHash（one permutation hashing）：每个 shingle 只计算一次哈希，
+    按哈希值分到 num_perm 个桶中取最小值，代价与 shingle 数成正比而与签名长度无关。
+    签名按 bands 分段建立 LSH 桶，同桶记录再用签名估计 Jaccard 相似度确认。
+    """
+
+    def __init__(self, num_perm: int = settings.NEAR_DUP_NUM_PERM, bands: int = settings.NEAR_DUP_BANDS,
+                 threshold: float = settings.NEAR_DUP_THRESHOLD, shingle_size: int = settings.NEAR_DUP_SHINGLE_SIZE):
+        if num_perm % bands:
+            raise ValueError("num_perm 必须是 bands 的整数倍")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+        self._signatures: Dict[int, array] = {}
+
+    def _shingles(self, text: str) -> Iterator[bytes]:
+        text = ' '.join(text.lower().split())
+        size = self.shingle_size
+        if len(text) <= size:
+            if text:
+                yield text.encode('utf-8')
+            return
+        for i in range(len(text) - size + 1):
+            yield text[i:i + size].encode('utf-8')
+
+    def signature(self, text: str) -> array:
+        signature = array('I', [_EMPTY_BIN]) * self.num_perm
+        for shingle in self._shingles(text):
+            value = zlib.crc32(shingle)
+            index = value % self.num_perm
+            if value < signature[index]:
+                signature[index] = value
+        return signature
+
+    def similarity(self, a: array, b: array) -> float:
+        """由签名估计 Jaccard 相似度（两边均为空的桶不计入）"""
+        matched = total = 0
+        for x, y in zip(a, b):
+            if x == _EMPTY_BIN and y == _EMPTY_BIN:
+                continue
+            total += 1
+            matched += x == y
+        return matched / total if total else 0.0
+
+    def add(self, key: int, text: str) -> Optional[Tuple[int, float]]:
+        """加入一条记录，返回此前加入的最相似的近似重复记录 (key, 相似度)，没有则返回 None"""
+        signature = self.signature(text)
+        best: Optional[Tuple[int, float]] = None
+        checked = set()
+        for band, buckets in enumerate(self._buckets):
+            band_values = signature[band * self.rows:(band + 1) * self.rows]
+            if all(value == _EMPTY_BIN for value in band_values):
+                # 短文本的空桶不构成相似的证据
+                continue
+            candidates = buckets.setdefault(band_values.tobytes(), [])
+            for candidate in candidates:
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                score = self.similarity(signature, self._signatures[candidate])
+                if score >= self.threshold and (best is None or score > best[1]):
+                    best = (candidate, score)
+            if len(candidates) < _MAX_BUCKET_SIZE:
+                candidates.append(key)
+        self._signatures[key] = signature
+        return best
+
+
+def find_near_duplicates(records: Iterable[Tuple[int, str]], lsh: Optional[MinHashLSH] = None) \
+        -> Iterator[Tuple[int, int]]:
+    """按顺序检测近似重复，返回 (记录ID, 此前最相似记录的ID)"""
+    lsh = lsh or MinHashLSH()
+    for record_id, text in records:
+        match = lsh.add(record_id, text)
+        if match:
+            yield record_id, match[0]
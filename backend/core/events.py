@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Callable, Dict, List, Set, Optional, Tuple
+
+from backend.core.executor import run_read, run_write
+from backend.core.repository import get_repository
+
+logger = logging.getLogger(__name__)
+
+# 会改变统计信息的事件类型（从其他工作进程转发来时需要刷新本进程订阅者的统计）
+_STATS_EVENT_TYPES = ('annotation', 'bulk_annotation')
+# 文件信息已修改（上传、删除、记录数或文件大小变化），只在进程间转发，不推送给订阅者
+_FILE_CHANGED = 'file_changed'
+
+
+class FileEventHub:
+    """按文件分发实时事件（SSE）
+
+    数据项级别的事件（标注、编辑）立即推送给订阅者；统计信息在发生变化后按 interval 合并，
+    每个文件每个间隔最多读取并推送一次，推送的是完整计数，断线重连的客户端不会累积误差。
+
+    多进程部署时（relay=True）订阅者只连接到其中一个工作进程：本进程发布的事件按 interval 批量写入
+    file_events 表，同时读取其他进程写入的事件推送给本进程的订阅者；统计信息不转发，由各进程自行读取。
+    文件信息修改的通知（file_changed）同样经 file_events 表转发，其他进程收到后调用 on_file_changed(文件名)
+    失效各自的文件信息缓存；设置了 on_file_changed 时转发在 start() 之后持续运行，不依赖订阅者。
+    """
+
+    def __init__(self, load_stats: Callable[[int], Dict], interval: float, queue_size: int,
+                 relay: bool = False, retention: float = 60.0,
+                 on_file_changed: Optional[Callable[[Optional[str]], None]] = None):
+        self.load_stats = load_stats
+        self.interval = interval
+        self.queue_size = queue_size
+        self.relay = relay
+        self.retention = retention
+        self.on_file_changed = on_file_changed
+        self.worker_id = uuid.uuid4().hex
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}
+        self._dirty: Set[int] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._outbox: List[Tuple[int, Dict]] = []
+        self._relay_task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self):
+        """在服务的事件循环中调用（启动时），此后可以在任意线程中调用 file_changed"""
+        self._loop = asyncio.get_running_loop()
+        self._start_relay()
+
+    def subscribe(self, file_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(file_id, set()).add(queue)
+        self._start_relay()
+        return queue
+
+    def unsubscribe(self, file_id: int, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(file_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[file_id]
+
+    def publish(self, file_id: int, event: Dict):
+        """推送事件给订阅该文件的所有客户端（处理不过来的客户端丢弃事件，统计信息仍会追上）"""
+        self._deliver(file_id, event)
+        if self.relay and event['type'] != 'stats':
+            self._outbox.append((file_id, event))
+            self._start_relay()
+
+    def file_changed(self, filename: Optional[str] = None):
+        """通知其他工作进程失效该文件（不指定时为全部文件）的信息缓存，可在任意线程中调用"""
+        loop = self._loop
+        if self.relay and loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._queue_file_changed, filename)
+
+    def _queue_file_changed(self, filename: Optional[str]):
+        self._outbox.append((0, {"type": _FILE_CHANGED, "filename": filename}))
+        self._start_relay()
+
+    def _deliver(self, file_id: int, event: Dict):
+        for queue in self._subscribers.get(file_id, ()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                pass
+
+    def stats_changed(self, file_id: int):
+        """标记文件统计信息已变化，稍后推送最新统计"""
+        if file_id not in self._subscribers:
+            return
+        self._dirty.add(file_id)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_stats())
+
+    async def _flush_stats(self):
+        while self._dirty:
+            await asyncio.sleep(self.interval)
+            file_ids, self._dirty = self._dirty, set()
+            for file_id in file_ids:
+                if file_id in self._subscribers:
+                    stats = await run_read(self.load_stats, file_id)
+                    self.publish(file_id, {"type": "stats", "stats": stats})
+
+    def _start_relay(self):
+        if self.relay and (self._relay_task is None or self._relay_task.done()):
+            self._relay_task = asyncio.get_running_loop().create_task(self._run_relay())
+
+    async def _run_relay(self):
+        """进程间转发：有待写出的事件、有订阅者或需要接收缓存失效通知时运行，否则退出（之前的事件不再补发）"""
+        repository = get_repository()
+        last_event_id = await run_read(repository.get_last_file_event_id)
+        while self._outbox or self._subscribers or self._receives_file_changes:
+            await asyncio.sleep(self.interval)
+            try:
+                if self._outbox:
+                    events, self._outbox = self._outbox, []
+                    await run_write(repository.append_file_events, self.worker_id, events, time.time() - self.retention)
+                if self._subscribers or self._receives_file_changes:
+                    last_event_id, events = await run_read(repository.get_file_events_since, last_event_id, self.worker_id)
+                    for file_id, event in events:
+                        if event['type'] == _FILE_CHANGED:
+                            if self.on_file_changed is not None:
+                                self.on_file_changed(event['filename'])
+                            continue
+                        self._deliver(file_id, event)
+                        if event['type'] in _STATS_EVENT_TYPES:
+                            self.stats_changed(file_id)
+            except Exception as e:
+                # 转发失败只影响其他进程的实时推送，客户端刷新后仍能看到最新数据
+                logger.warning("实时事件转发失败: %s", e, exc_info=True)
+
+    @property
+    def _receives_file_changes(self) -> bool:
+        return self.on_file_changed is not None and self._loop is not None
+
+    def stop(self):
+        self._loop = None
+        if self._relay_task is not None:
+            self._relay_task.cancel()
@@ -0,0 +1,142 @@
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar, Iterator, AsyncIterator, List, Dict, Generic, Optional
+
+from backend.conf import settings
+from backend.core.db import retry_on_busy
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+# 读操作：有界线程池，最多 DB_READ_CONCURRENCY 个查询并发执行
+_read_executor = ThreadPoolExecutor(max_workers=settings.DB_READ_CONCURRENCY, thread_name_prefix='db-read')
+# 写操作：单线程写队列，所有写入按提交顺序串行执行（SQLite 同一时刻只允许一个写者）
+_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-write')
+# 写队列长度上限，超过后新的写请求在事件循环中等待
+_write_slots = asyncio.Semaphore(settings.DB_WRITE_QUEUE_SIZE)
+# 导入：上传时直接导入的文件在独立的线程中解析和写入（使用自己的连接并分段提交），不占用写队列
+_ingest_executor = ThreadPoolExecutor(max_workers=settings.INGEST_CONCURRENCY, thread_name_prefix='db-ingest')
+
+
+async def run_read(func: Callable[..., T], *args, **kwargs) -> T:
+    """在读线程池中执行同步的数据库读操作"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_read_executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_write(func: Callable[..., T], *args, **kwargs) -> T:
+    """将同步的数据库写操作放入写队列执行（多进程部署时其他进程持有写锁超时后退避重试）"""
+    async with _write_slots:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_write_executor, functools.partial(retry_on_busy, func, *args, **kwargs))
+
+
+async def run_ingest(func: Callable[..., T], *args, **kwargs) -> T:
+    """在导入线程池中执行耗时的导入（分段提交，期间写队列中的标注等写操作照常执行）"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_ingest_executor, functools.partial(func, *args, **kwargs))
+
+
+async def iterate_in_read_pool(iterator: Iterator[T]) -> AsyncIterator[T]:
+    """在读线程池中逐项推进同步迭代器（用于流式响应）"""
+    sentinel = object()
+    while (item := await run_read(next, iterator, sentinel)) is not sentinel:
+        yield item
+
+
+class GroupCommitWriter(Generic[T, R]):
+    """合并提交：收集各请求的写操作，攒够 max_batch 条或等待 max_delay 秒后在一个事务中统一提交
+
+    apply_batch 接收一批写操作并返回等长的结果列表，在写队列中执行；
+    每个请求在所在批次提交后才得到结果。
+    """
+
+    def __init__(self, apply_batch: Callable[[List[T]], List[R]], max_delay: float, max_batch: int):
+        self.apply_batch = apply_batch
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # 统计指标
+        self.batch_count = 0
+        self.item_count = 0
+        self.max_batch_size = 0
+        self.total_commit_seconds = 0.0
+        self.max_commit_seconds = 0.0
+        self.last_commit_seconds = 0.0
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run())
+
+    async def submit(self, item: T) -> R:
+        """提交一个写操作，等待其所在批次提交后返回结果"""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _collect(self) -> List:
+        """等待第一条写操作，再在 max_delay 内继续收集，最多 max_batch 条"""
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            items = [item for item, _ in batch]
+            started = time.perf_counter()
+            try:
+                results = await run_write(self.apply_batch, items)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self._record_commit(len(batch), time.perf_counter() - started)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def _record_commit(self, batch_size: int, elapsed: float):
+        self.batch_count += 1
+        self.item_count += batch_size
+        self.max_batch_size = max(self.max_batch_size, batch_size)
+        self.total_commit_seconds += elapsed
+        self.max_commit_seconds = max(self.max_commit_seconds, elapsed)
+        self.last_commit_seconds = elapsed
+
+    def stop(self):
+        """停止后台提交任务"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    @property
+    def metrics(self) -> Dict:
+        """批大小与提交耗时统计"""
+        batches = self.batch_count or 1
+        return {
+            "batch_count": self.batch_count,
+            "item_count": self.item_count,
+            "avg_batch_size": round(self.item_count / batches, 2),
+            "max_batch_size": self.max_batch_size,
+            "avg_commit_ms": round(self.total_commit_seconds / batches * 1000, 3),
+            "max_commit_ms": round(self.max_commit_seconds * 1000, 3),
+            "last_commit_ms": round(self.last_commit_seconds * 1000, 3),
+            "max_delay_ms": self.max_delay * 1000,
+            "max_batch": self.max_batch
+        }
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from backend.conf import settings
+from backend.core.executor import run_read
+from backend.core.mapping import parse_field_mapping
+from backend.core.repository import RecordLoader, get_repository
+from backend.core.service import open_record_reader
+
+logger = logging.getLogger(__name__)
+
+JOB_INGEST = 'ingest'
+JOB_EXPORT = 'export'
+
+# 当前进程的标识，用于认领任务和判断任务是否已被其他进程接管
+WORKER_ID = uuid.uuid4().hex
+
+_executor = ThreadPoolExecutor(max_workers=settings.JOB_WORKERS, thread_name_prefix='job')
+
+
+class JobLostError(Exception):
+    """任务已被其他工作进程接管"""
+
+
+def _run_ingest(job: Dict):
+    """执行导入任务：分段提交，每次提交同时记录断点，重启后从最后一次提交的位置继续"""
+    params = job['params']
+    checkpoint = job['checkpoint'] or {}
+    file_path = params['file_path']
+
+    reader = open_record_reader(file_path, start_offset=checkpoint.get('offset', 0),
+                                start_line=checkpoint.get('line_number', 0))
+    reader.error_count = checkpoint.get('error_count', 0)
+    processed = job['processed']
+    repository = get_repository()
+
+    def save_checkpoint(loader: RecordLoader):
+        # 断点与本段数据在同一事务中提交
+        checkpoint_data = {
+            'offset': reader.offset,
+            'line_number': reader.line_number,
+            'error_count': reader.error_count,
+            'duplicate_count': duplicates + loader.duplicates
+        }
+        saved = repository.update_job_progress(job['id'], WORKER_ID, processed, reader.progress, checkpoint_data,
+                                               loader=loader)
+        if not saved:
+            raise JobLostError(job['id'])
+        loader.commit()
+
+    dedup_mode = params.get('dedup_mode', settings.INGEST_DEDUP_MODE)
+    field_mapping = parse_field_mapping(params.get('field_mapping'))
+    duplicates = checkpoint.get('duplicate_count', 0)
+    with repository.bulk_loader(params['file_id'], defer_indexes=False, dedup_mode=dedup_mode,
+                                field_mapping=field_mapping, on_error=reader.add_error) as loader:
+        for batch_index, batch in enumerate(reader.iter_batches(), start=1):
+            inserted = loader.inserted
+            loader.add_batch(batch)
+            processed += loader.inserted - inserted
+            if batch_index % settings.JOB_COMMIT_BATCHES == 0:
+                save_checkpoint(loader)
+        save_checkpoint(loader)
+
+    repository.update_file_total_records(params['file_id'], processed)
+    result = {
+        "total_count": processed,
+        "error_count": reader.error_count,
+        "errors": reader.errors,
+        "duplicate_count": duplicates + loader.duplicates
+    }
+    if params.get('near_duplicates'):
+        result["near_duplicate_count"] = repository.flag_near_duplicates(params['file_id'])
+    return result
+
+
+def _run_export(job: Dict):
+    """执行导出任务（导出是幂等的，中断后重新执行）"""
+    params = job['params']
+    repository = get_repository()
+    query, query_params = repository.build_export_query(params['file_id'], params['export_type'],
+                                                        params.get('min_score'), params.get('max_score'))
+    total = repository.count_export_rows(query, query_params) or 1
+
+    def report_progress(exported: int):
+        if not repository.update_job_progress(job['id'], WORKER_ID, exported, exported / total):
+            raise JobLostError(job['id'])
+
+    result = repository.export_data_from_db(params['file_id'], params['export_name'], params['export_type'],
+                                            params.get('min_score'), params.get('max_score'),
+                                            on_progress=report_progress)
+    if result is None:
+        raise RuntimeError("导出失败")
+    return result
+
+
+_RUNNERS = {
+    JOB_INGEST: _run_ingest,
+    JOB_EXPORT: _run_export,
+}
+
+
+def _run_job(job_id: str):
+    """认领并执行任务"""
+    repository = get_repository()
+    job = repository.claim_job(job_id, WORKER_ID, time.time() - settings.JOB_STALE_SECONDS)
+    if not job:
+        return
+    try:
+        result = _RUNNERS[job['job_type']](job)
+    except JobLostError:
+        return
+    except Exception as e:
+        logger.error("后台任务 %s 执行失败: %s", job_id, e, exc_info=True)
+        repository.finish_job(job_id, WORKER_ID, 'failed', error=str(e))
+    else:
+        repository.finish_job(job_id, WORKER_ID, 'completed', result=result)
+
+
+def submit_job(job_type: str, params: Dict) -> str:
+    """创建任务并提交到后台执行，返回任务ID"""
+    job_id = get_repository().create_job(job_type, params)
+    _executor.submit(_run_job, job_id)
+    return job_id
+
+
+def resume_jobs() -> int:
+    """重新提交待执行或已中断的任务，返回提交的任务数"""
+    job_ids = get_repository().list_resumable_jobs(time.time() - settings.JOB_STALE_SECONDS)
+    for job_id in job_ids:
+        _executor.submit(_run_job, job_id)
+    return len(job_ids)
+
+
+async def resume_jobs_periodically():
+    """定期接管中断的任务（工作进程重启或崩溃后）"""
+    while True:
+        await run_read(resume_jobs)
+        await asyncio.sleep(settings.JOB_STALE_SECONDS)
+
+
+def get_job_status(job_id: str) -> Optional[Dict]:
+    """获取任务状态，附带吞吐量和预计剩余时间"""
+    job = get_repository().get_job(job_id)
+    if not job:
+        return None
+
+    throughput = None
+    eta = None
+    if job['status'] == 'running' and job['started_at'] and job['processed']:
+        elapsed = time.time() - job['started_at']
+        if elapsed > 0:
+            throughput = round(job['processed'] / elapsed, 1)
+        if 0 < job['progress'] < 1:
+            eta = round(elapsed * (1 - job['progress']) / job['progress'], 1)
+
+    return {
+        "job_id": job['id'],
+        "job_type": job['job_type'],
+        "status": job['status'],
+        "processed": job['processed'],
+        "progress": round(job['progress'], 4),
+        "rows_per_second": throughput,
+        "eta_seconds": eta,
+        "result": job['result'],
+        "error": job['error'],
+        "created_at": job['created_at'],
+        "updated_at": job['updated_at']
+    }
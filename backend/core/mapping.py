@@ -0,0 +1,160 @@
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+# 映射的目标字段
+MAPPED_FIELDS = ('system', 'query', 'response')
+
+# 选择器语法（JSONPath 的子集）：$.a.b、a[0]、a[-1]、a[*]、a[?role=user]
+_STEP = re.compile(r"\.([^.\[\]]+)|\[(-?\d+|\*)\]|\[\?([^=\]]+)=([^\]]*)\]")
+
+# 常见对话格式中的角色别名（ShareGPT 等）
+_ROLE_ALIASES = {'human': 'user', 'gpt': 'assistant', 'bot': 'assistant', 'model': 'assistant'}
+
+# 同一字段选中多个值时的连接符
+_JOIN = '\n\n'
+
+
+def _parse_selector(selector: str) -> List[Tuple]:
+    path = selector.strip()
+    if path.startswith('$'):
+        path = path[1:]
+    if path and path[0] not in '.[':
+        path = '.' + path
+    steps = []
+    position = 0
+    while position < len(path):
+        match = _STEP.match(path, position)
+        if not match:
+            raise ValueError(f"无法解析字段选择器: {selector}")
+        key, index, filter_key, filter_value = match.groups()
+        if key is not None:
+            steps.append(('key', key))
+        elif index == '*':
+            steps.append(('all',))
+        elif index is not None:
+            steps.append(('index', int(index)))
+        else:
+            steps.append(('filter', filter_key.strip(), filter_value.strip().strip('\'"')))
+        position = match.end()
+    return steps
+
+
+def _select(record: Any, steps: List[Tuple]) -> List[Any]:
+    values = [record]
+    for step in steps:
+        selected = []
+        for value in values:
+            if step[0] == 'key':
+                # 对列表取键时作用于每个元素
+                items = value if isinstance(value, list) else [value]
+                selected.extend(item[step[1]] for item in items if isinstance(item, dict) and step[1] in item)
+            elif step[0] == 'index':
+                if isinstance(value, list) and -len(value) <= step[1] < len(value):
+                    selected.append(value[step[1]])
+            elif step[0] == 'all':
+                if isinstance(value, list):
+                    selected.extend(value)
+                elif isinstance(value, dict):
+                    selected.extend(value.values())
+            elif isinstance(value, list):
+                # 过滤结果仍是列表，之后可以继续按下标选取
+                selected.append([item for item in value
+                                 if isinstance(item, dict) and str(item.get(step[1])) == step[2]])
+        values = selected
+    return values
+
+
+def to_text(value: Any) -> str:
+    """将字段值转换为文本：None 为空串，数值等按 str 转换，列表逐项连接，字节按 UTF-8 解码（失败时抛出 ValueError）"""
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    if isinstance(value, list):
+        return _JOIN.join(text for text in (to_text(item) for item in value) if text)
+    if isinstance(value, dict):
+        # OpenAI 的多段内容 {"type": "text", "text": ...}
+        if isinstance(value.get('text'), str):
+            return value['text']
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+def _message_text(content: Any) -> str:
+    if isinstance(content, list):
+        return _JOIN.join(text for text in (to_text(part) for part in content) if text)
+    return to_text(content)
+
+
+def _map_messages(record: Dict, field: str) -> Tuple[str, str, str]:
+    """将对话消息列表拆分为 system / query / response
+
+    system 为所有 system 消息；response 为最后一条 assistant 消息；
+    query 为其余的消息，多轮对话按 "角色: 内容" 逐条展开。
+    """
+    turns = []
+    for message in record.get(field) or []:
+        if not isinstance(message, dict):
+            continue
+        role = str(message.get('role', message.get('from', '')))
+        role = _ROLE_ALIASES.get(role, role)
+        turns.append((role, _message_text(message.get('content', message.get('value')))))
+
+    system = _JOIN.join(text for role, text in turns if role == 'system') or to_text(record.get('system'))
+    dialog = [(role, text) for role, text in turns if role != 'system']
+    response = ''
+    if dialog and dialog[-1][0] == 'assistant':
+        response = dialog.pop()[1]
+    if len(dialog) == 1:
+        query = dialog[0][1]
+    else:
+        query = _JOIN.join(f"{role}: {text}" for role, text in dialog)
+    return system, query, response
+
+
+class FieldMapping:
+    """上传时的字段映射：从任意结构的记录中取出 system / query / response
+
+    spec 为 "messages"（内置的对话消息适配器），或 JSON 对象：
+    {"adapter": "messages", "field": "conversations"}，或按字段指定选择器
+    {"system": "$.instruction", "query": "$.input", "response": "$.output"}（未指定的字段取同名键）。
+    """
+
+    def __init__(self, spec: Union[str, Dict]):
+        if isinstance(spec, str):
+            spec = spec.strip()
+            spec = {'adapter': 'messages'} if spec == 'messages' else json.loads(spec)
+        if not isinstance(spec, dict):
+            raise ValueError("字段映射必须是 \"messages\" 或 JSON 对象")
+        self.spec = spec
+        self.adapter = spec.get('adapter')
+        if self.adapter not in (None, 'messages'):
+            raise ValueError(f"不支持的字段映射适配器: {self.adapter}")
+        self.messages_field = spec.get('field', 'messages')
+        unknown = set(spec) - set(MAPPED_FIELDS) - {'adapter', 'field'}
+        if unknown:
+            raise ValueError(f"字段映射中有未知的键: {', '.join(sorted(unknown))}")
+        self._selectors = {field: _parse_selector(spec.get(field, field)) for field in MAPPED_FIELDS}
+
+    def apply(self, record: Dict) -> Tuple[str, str, str]:
+        """返回记录的 (system, query, response)"""
+        if self.adapter == 'messages':
+            return _map_messages(record, self.messages_field)
+        system, query, response = (to_text(_select(record, self._selectors[field])) for field in MAPPED_FIELDS)
+        return system, query, response
+
+    def to_json(self) -> str:
+        return json.dumps(self.spec, ensure_ascii=False)
+
+
+def parse_field_mapping(spec: Optional[str]) -> Optional[FieldMapping]:
+    """解析上传参数中的字段映射，为空时返回 None（按 system / query / response 键读取）"""
+    if not spec or not spec.strip():
+        return None
+    try:
+        return FieldMapping(spec)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"字段映射不是合法的 JSON: {e}")
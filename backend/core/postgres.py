@@ -0,0 +1,1224 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from backend.conf import settings
+from backend.core.db import DATA_RECORD_INDEXES, CONTENT_HASH_INDEX, CONTENT_HASH_INDEX_DEFINITION, parse_score
+from backend.core.dedup import DEDUP_OFF, DEDUP_SKIP, DEDUP_LINK, DEDUP_MODES, content_hash, find_near_duplicates
+from backend.core.mapping import FieldMapping
+from backend.core.records import RecordKey, RecordErrorHandler, EDITABLE_FIELDS, FTS_MIN_SEARCH_LENGTH, \
+    SCORE_THRESHOLD, SYSTEM_ID_COLUMN, CONTENT_HASH_COLUMN, decode_cursor, data_record_rows, annotation_deltas, \
+    record_key_column, records_page, like_pattern, record_row, leased_records, file_stats, tally_annotation_results, \
+    stats_mismatch, stats_result, export_chunk, file_row, job_row
+from backend.core.repository import Repository, DATABASE_POSTGRES
+from backend.core.storage import STORAGE_MODES
+
+try:
+    import psycopg
+    from psycopg_pool import ConnectionPool
+except ImportError:
+    psycopg = None
+
+# 时间戳与 SQLite 的 CURRENT_TIMESTAMP 一致：UTC，精确到秒，读取时转为文本
+_NOW = "(now() AT TIME ZONE 'UTC')::timestamp(0)"
+
+# 关键词检索：与 SQLite 的 trigram 全文索引一致按子串匹配（不区分大小写），
+# 安装了 pg_trgm 扩展时在拼接后的文本上建 GIN 三元组索引，否则在文件内逐条匹配
+_SEARCH_DOCUMENT = "(coalesce({0}system, '') || E'\\n' || coalesce({0}query, '') || E'\\n' || coalesce({0}response, ''))"
+
+# 高亮片段中关键词前后保留的字符数
+_SNIPPET_CONTEXT = 32
+
+_SCHEMA = [
+    f'''
+    CREATE TABLE IF NOT EXISTS files
+    (
+        id                BIGSERIAL PRIMARY KEY,
+        filename          TEXT    NOT NULL UNIQUE,
+        original_filename TEXT    NOT NULL,
+        file_size         BIGINT  NOT NULL,
+        total_records     INTEGER NOT NULL,
+        annotation_type   TEXT         DEFAULT 'qa',
+        upload_time       TIMESTAMP(0) DEFAULT {_NOW},
+        last_modified     TIMESTAMP(0) DEFAULT {_NOW},
+        status            TEXT         DEFAULT 'active',
+        version           BIGINT       NOT NULL DEFAULT 0
+    )
+    ''',
+    f'''
+    CREATE TABLE IF NOT EXISTS data_records
+    (
+        id                BIGSERIAL PRIMARY KEY,
+        file_id           BIGINT  NOT NULL REFERENCES files (id),
+        unique_id         TEXT    NOT NULL UNIQUE,
+        line_number       INTEGER NOT NULL,
+        system            TEXT,
+        query             TEXT,
+        response          TEXT,
+        annotation_result TEXT,
+        score             DOUBLE PRECISION,
+        byte_offset       BIGINT,
+        byte_length       BIGINT,
+        raw               TEXT,
+        content_hash      TEXT,
+        duplicate_of      BIGINT,
+        near_duplicate_of BIGINT,
+        created_at        TIMESTAMP(0) DEFAULT {_NOW},
+        updated_at        TIMESTAMP(0) DEFAULT {_NOW},
+        status            TEXT         DEFAULT 'active'
+    )
+    ''',
+    *(f'CREATE INDEX IF NOT EXISTS {name} {definition}' for name, definition in DATA_RECORD_INDEXES.items()),
+    f'CREATE INDEX IF NOT EXISTS {CONTENT_HASH_INDEX} {CONTENT_HASH_INDEX_DEFINITION}',
+    f'''
+    CREATE TABLE IF NOT EXISTS data_edits
+    (
+        id           BIGSERIAL PRIMARY KEY,
+        file_id      BIGINT  NOT NULL,
+        line_number  INTEGER NOT NULL,
+        updates      TEXT    NOT NULL,
+        materialized INTEGER NOT NULL DEFAULT 0,
+        created_at   TIMESTAMP(0) DEFAULT {_NOW}
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_data_edits_file_pending ON data_edits (file_id, id) WHERE materialized = 0',
+    f'''
+    CREATE TABLE IF NOT EXISTS file_stats
+    (
+        file_id         BIGINT PRIMARY KEY,
+        total_count     INTEGER NOT NULL DEFAULT 0,
+        correct_count   INTEGER NOT NULL DEFAULT 0,
+        incorrect_count INTEGER NOT NULL DEFAULT 0,
+        updated_at      TIMESTAMP(0) DEFAULT {_NOW}
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS file_score_histogram
+    (
+        file_id BIGINT           NOT NULL,
+        score   DOUBLE PRECISION NOT NULL,
+        count   INTEGER          NOT NULL DEFAULT 0,
+        PRIMARY KEY (file_id, score)
+    )
+    ''',
+    f'''
+    CREATE TABLE IF NOT EXISTS jobs
+    (
+        id           TEXT PRIMARY KEY,
+        job_type     TEXT             NOT NULL,
+        status       TEXT             NOT NULL DEFAULT 'pending',
+        params       TEXT             NOT NULL,
+        processed    INTEGER          NOT NULL DEFAULT 0,
+        progress     DOUBLE PRECISION NOT NULL DEFAULT 0,
+        checkpoint   TEXT,
+        result       TEXT,
+        error        TEXT,
+        owner        TEXT,
+        heartbeat_at DOUBLE PRECISION,
+        started_at   DOUBLE PRECISION,
+        created_at   TIMESTAMP(0) DEFAULT {_NOW},
+        updated_at   TIMESTAMP(0) DEFAULT {_NOW}
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS file_events
+    (
+        id         BIGSERIAL PRIMARY KEY,
+        worker_id  TEXT             NOT NULL,
+        file_id    BIGINT           NOT NULL,
+        event      TEXT             NOT NULL,
+        created_at DOUBLE PRECISION NOT NULL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_file_events_created ON file_events (created_at)',
+    '''
+    CREATE TABLE IF NOT EXISTS record_leases
+    (
+        record_id   BIGINT PRIMARY KEY,
+        file_id     BIGINT           NOT NULL,
+        session_id  TEXT             NOT NULL,
+        line_number INTEGER          NOT NULL,
+        expires_at  DOUBLE PRECISION NOT NULL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_record_leases_session ON record_leases (file_id, session_id, line_number)',
+    'CREATE INDEX IF NOT EXISTS idx_record_leases_expires ON record_leases (file_id, expires_at)',
+    # 迁移：文件版本号
+    'ALTER TABLE files ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0',
+]
+
+_SEARCH_INDEX = (f'CREATE INDEX IF NOT EXISTS idx_data_records_search '
+                 f'ON data_records USING GIN ({_SEARCH_DOCUMENT.format("")} gin_trgm_ops)')
+
+# 初始化时持有的事务级咨询锁，多个节点同时启动时依次建表
+_SCHEMA_LOCK_ID = 0x7765627a
+
+# 使用 PostgreSQL 存储需要的可选依赖
+POSTGRES_INSTALL_HINT = "pip install 'annotation-system[postgres]'"
+
+logger = logging.getLogger(__name__)
+
+_FILE_COLUMNS = ('id, filename, original_filename, file_size, total_records, annotation_type, '
+                 'upload_time::text, last_modified::text, status')
+
+# COPY 写入的数据列（记录ID预先从序列分配，重复记录的关联在写入前即可确定）
+_COPY_COLUMNS = ('id, file_id, unique_id, line_number, system, query, response, byte_offset, byte_length, raw, '
+                 'content_hash, duplicate_of, annotation_result, score')
+# 同一行重复导入时整行替换（与 SQLite 的 INSERT OR REPLACE 一致，记录ID也换成新分配的）
+_UPSERT_COLUMNS = [column.strip() for column in _COPY_COLUMNS.split(',') if column.strip() != 'unique_id']
+
+
+def _highlight(search: str, texts: Iterable[Optional[str]]) -> Optional[str]:
+    """在记录文本中找到关键词，返回带 <mark> 标记的上下文片段"""
+    needle = search.lower()
+    for text in texts:
+        if not text:
+            continue
+        position = text.lower().find(needle)
+        if position < 0:
+            continue
+        start = max(0, position - _SNIPPET_CONTEXT)
+        end = position + len(search) + _SNIPPET_CONTEXT
+        return ('...' if start else '') + text[start:position] + '<mark>' + text[position:position + len(search)] \
+            + '</mark>' + text[position + len(search):end] + ('...' if end < len(text) else '')
+    return None
+
+
+def _bump_file_version(cursor: 'psycopg.Cursor', file_id: int):
+    """文件的数据记录或统计发生变化后递增版本号（与修改在同一事务中）"""
+    cursor.execute('UPDATE files SET version = version + 1 WHERE id = %s', (file_id,))
+
+
+def _compute_file_stats(cursor: 'psycopg.Cursor', file_id: int) -> Dict:
+    """从 data_records 全量计算文件的统计计数"""
+    cursor.execute('SELECT annotation_type FROM files WHERE id = %s', (file_id,))
+    row = cursor.fetchone()
+    annotation_type = row[0] if row else 'qa'
+
+    if annotation_type == 'scoring':
+        cursor.execute('''
+                       SELECT COUNT(*),
+                              COUNT(*) FILTER (WHERE score >= %s),
+                              COUNT(*) FILTER (WHERE score < %s)
+                       FROM data_records
+                       WHERE file_id = %s
+                         AND status = 'active'
+                       ''', (SCORE_THRESHOLD, SCORE_THRESHOLD, file_id))
+        total_count, correct_count, incorrect_count = cursor.fetchone()
+
+        cursor.execute('''
+                       SELECT score, COUNT(*)
+                       FROM data_records
+                       WHERE file_id = %s
+                         AND status = 'active'
+                         AND score IS NOT NULL
+                       GROUP BY score
+                       ''', (file_id,))
+        return file_stats(annotation_type, total_count, correct_count, incorrect_count, dict(cursor.fetchall()))
+
+    cursor.execute('''
+                   SELECT annotation_result, COUNT(*)
+                   FROM data_records
+                   WHERE file_id = %s
+                     AND status = 'active'
+                   GROUP BY annotation_result
+                   ''', (file_id,))
+    return tally_annotation_results(annotation_type, cursor.fetchall())
+
+
+def _store_file_stats(cursor: 'psycopg.Cursor', file_id: int, stats: Dict):
+    """写入文件的统计计数器（覆盖已有值）"""
+    cursor.execute(f'''
+        INSERT INTO file_stats (file_id, total_count, correct_count, incorrect_count, updated_at)
+        VALUES (%s, %s, %s, %s, {_NOW})
+        ON CONFLICT (file_id) DO UPDATE
+            SET total_count     = excluded.total_count,
+                correct_count   = excluded.correct_count,
+                incorrect_count = excluded.incorrect_count,
+                updated_at      = excluded.updated_at
+    ''', (file_id, stats['total_count'], stats['correct_count'], stats['incorrect_count']))
+    cursor.execute('DELETE FROM file_score_histogram WHERE file_id = %s', (file_id,))
+    cursor.executemany('INSERT INTO file_score_histogram (file_id, score, count) VALUES (%s, %s, %s)',
+                       [(file_id, score, count) for score, count in stats['score_histogram'].items()])
+    _bump_file_version(cursor, file_id)
+
+
+def _apply_annotation_deltas(cursor: 'psycopg.Cursor', file_id: int, annotation_type: str,
+                             changes: Iterable[Tuple[Optional[str], Optional[str]]]):
+    """根据一批记录标注结果的变化 (旧值, 新值) 汇总后增量更新统计计数器"""
+    deltas, histogram_deltas = annotation_deltas(annotation_type, changes)
+    if deltas['correct'] or deltas['incorrect']:
+        cursor.execute(f'''
+                       UPDATE file_stats
+                       SET correct_count   = correct_count + %s,
+                           incorrect_count = incorrect_count + %s,
+                           updated_at      = {_NOW}
+                       WHERE file_id = %s
+                       ''', (deltas['correct'], deltas['incorrect'], file_id))
+
+    cursor.executemany('''
+        INSERT INTO file_score_histogram (file_id, score, count)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (file_id, score) DO UPDATE SET count = file_score_histogram.count + excluded.count
+    ''', [(file_id, score, delta) for score, delta in histogram_deltas.items() if delta])
+    _bump_file_version(cursor, file_id)
+
+
+def _propagate_to_duplicates(cursor: 'psycopg.Cursor', record_id: int, annotation_type: str,
+                             annotation_result: str) -> List[int]:
+    """将标注同步到同一组重复记录中尚未标注、标注类型相同的记录，返回这些记录的 file_id"""
+    cursor.execute('SELECT COALESCE(duplicate_of, id) FROM data_records WHERE id = %s', (record_id,))
+    original_id = cursor.fetchone()[0]
+    cursor.execute('''
+                   SELECT r.id, r.file_id
+                   FROM data_records r
+                            JOIN files f ON f.id = r.file_id
+                   WHERE (r.id = %s OR r.duplicate_of = %s)
+                     AND r.id <> %s
+                     AND r.status = 'active'
+                     AND r.annotation_result IS NULL
+                     AND f.annotation_type = %s
+                   FOR UPDATE OF r
+                   ''', (original_id, original_id, record_id, annotation_type))
+    members = cursor.fetchall()
+    if members:
+        score = parse_score(annotation_result) if annotation_type == 'scoring' else None
+        cursor.execute(f'''
+                       UPDATE data_records
+                       SET annotation_result = %s,
+                           score             = %s,
+                           updated_at        = {_NOW}
+                       WHERE id = ANY(%s)
+                       ''', (annotation_result, score, [member_id for member_id, _ in members]))
+    return [member_file_id for _, member_file_id in members]
+
+
+def _has_linked_duplicates(cursor: 'psycopg.Cursor') -> bool:
+    cursor.execute('SELECT 1 FROM data_records WHERE duplicate_of IS NOT NULL LIMIT 1')
+    return cursor.fetchone() is not None
+
+
+def _build_record_filter(file_id: int, search: str = "",
+                         annotation_status: str = "all") -> Tuple[List[str], List]:
+    """构建数据记录的筛选条件，返回 (WHERE 条件列表, 参数)，数据表别名为 r"""
+    where_conditions = ["r.file_id = %s", "r.status = 'active'"]
+    params = [file_id]
+
+    if search:
+        where_conditions.append(f"{_SEARCH_DOCUMENT.format('r.')} ILIKE %s ESCAPE '\\'")
+        params.append(like_pattern(search))
+
+    if annotation_status == "annotated":
+        where_conditions.append("r.annotation_result IS NOT NULL")
+    elif annotation_status == "not_annotated":
+        where_conditions.append("r.annotation_result IS NULL")
+
+    return where_conditions, params
+
+
+class PostgresBulkLoader:
+    """批量导入数据记录（语义同 crud.BulkLoader）
+
+    每批记录先用 COPY 写入临时表，再合并到 data_records（同一行重复导入时覆盖）。
+    记录ID在写入前从序列预先分配，关联重复记录时无需逐行插入。
+    PostgreSQL 不在导入期间删除索引（会阻塞其他会话的查询），defer_indexes 为 True 时只禁止分段提交；
+    大字段由 TOAST 自动压缩，storage_mode 不影响存储方式。
+    """
+
+    def __init__(self, repository: 'PostgresRepository', file_id: int, defer_indexes: Optional[bool] = None,
+                 dedup_mode: str = DEDUP_OFF, storage_mode: str = settings.STORAGE_MODE,
+                 field_mapping: Optional[FieldMapping] = None, on_error: Optional[RecordErrorHandler] = None):
+        if dedup_mode not in DEDUP_MODES:
+            raise ValueError(f"dedup_mode 必须是 {', '.join(DEDUP_MODES)} 之一")
+        if storage_mode not in STORAGE_MODES:
+            raise ValueError(f"storage_mode 必须是 {', '.join(STORAGE_MODES)} 之一")
+        self.repository = repository
+        self.file_id = file_id
+        self.defer_indexes = bool(defer_indexes)
+        self.dedup_mode = dedup_mode
+        self.field_mapping = field_mapping
+        self.on_error = on_error
+        self.annotation_type = 'qa'
+        self.inserted = 0
+        self.duplicates = 0
+        self.labels_carried_over = 0
+        self.conn: Optional['psycopg.Connection'] = None
+        self._context = None
+        self._started_at = 0.0
+        self._finished_at: Optional[float] = None
+
+    def __enter__(self) -> 'PostgresBulkLoader':
+        self._context = self.repository.pool.connection()
+        self.conn = self._context.__enter__()
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
+            CREATE TEMP TABLE IF NOT EXISTS data_records_staging
+            AS SELECT {_COPY_COLUMNS} FROM data_records WITH NO DATA
+        ''')
+        cursor.execute('SELECT annotation_type FROM files WHERE id = %s', (self.file_id,))
+        file_record = cursor.fetchone()
+        if file_record:
+            self.annotation_type = file_record[0]
+        self._started_at = time.perf_counter()
+        return self
+
+    def add_batch(self, data_records: List[Dict]):
+        """写入一批记录（不提交）"""
+        rows = [row[:SYSTEM_ID_COLUMN] + row[SYSTEM_ID_COLUMN + 1:]
+                for row in data_record_rows(self.file_id, data_records, self.field_mapping, self.on_error)]
+        hash_column = CONTENT_HASH_COLUMN - 1
+        if self.dedup_mode == DEDUP_SKIP:
+            seen = set(self._find_originals([row[hash_column] for row in rows]))
+            unique_rows = []
+            for row in rows:
+                if row[hash_column] in seen:
+                    self.duplicates += 1
+                    continue
+                seen.add(row[hash_column])
+                unique_rows.append(row)
+            rows = unique_rows
+
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT nextval(pg_get_serial_sequence('data_records', 'id')) FROM generate_series(1, %s)",
+                       (len(rows),))
+        record_ids = [row[0] for row in cursor.fetchall()]
+        rows = [(record_id,) + row for record_id, row in zip(record_ids, rows)]
+
+        if self.dedup_mode == DEDUP_LINK:
+            rows = self._link_duplicates(rows)
+
+        with cursor.copy(f'COPY data_records_staging ({_COPY_COLUMNS}) FROM STDIN') as copy:
+            for row in rows:
+                copy.write_row(row)
+        cursor.execute(f'''
+            INSERT INTO data_records ({_COPY_COLUMNS})
+            SELECT {_COPY_COLUMNS} FROM data_records_staging
+            ON CONFLICT (unique_id) DO UPDATE
+                SET {', '.join(f'{column} = excluded.{column}' for column in _UPSERT_COLUMNS)},
+                    near_duplicate_of = NULL,
+                    status            = 'active',
+                    created_at        = {_NOW},
+                    updated_at        = {_NOW}
+        ''')
+        cursor.execute('TRUNCATE data_records_staging')
+        self.inserted += len(rows)
+
+    def _find_originals(self, hashes: List[str]) -> Dict[str, Tuple[int, Optional[str], Optional[float], str]]:
+        """按内容哈希查找已有的首条记录，返回 {哈希: (记录ID, 标注结果, 分数, 标注类型)}"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+                       SELECT DISTINCT ON (r.content_hash) r.content_hash, r.id, r.annotation_result, r.score,
+                                                           f.annotation_type
+                       FROM data_records r
+                                JOIN files f ON f.id = r.file_id
+                       WHERE r.content_hash = ANY(%s)
+                         AND r.status = 'active'
+                         AND r.duplicate_of IS NULL
+                       ORDER BY r.content_hash, r.id
+                       ''', (list(set(hashes)),))
+        return {row[0]: row[1:] for row in cursor.fetchall()}
+
+    def _link_duplicates(self, rows: List[Tuple]) -> List[Tuple]:
+        hash_column = CONTENT_HASH_COLUMN
+        originals = self._find_originals([row[hash_column] for row in rows])
+        linked_rows = []
+        for row in rows:
+            original = originals.get(row[hash_column])
+            if original:
+                original_id, annotation_result, score, annotation_type = original
+                if annotation_result is None or annotation_type != self.annotation_type:
+                    annotation_result = score = None
+                else:
+                    self.labels_carried_over += 1
+                row = row[:hash_column + 1] + (original_id, annotation_result, score)
+                self.duplicates += 1
+            else:
+                originals[row[hash_column]] = (row[0], None, None, self.annotation_type)
+            linked_rows.append(row)
+        return linked_rows
+
+    def commit(self):
+        """提交已写入的批次（分段提交，仅在未延迟索引时可用，与 SQLite 后端一致）"""
+        if self.defer_indexes:
+            raise RuntimeError("defer_indexes 模式下只能在导入结束时提交")
+        _bump_file_version(self.conn.cursor(), self.file_id)
+        self.conn.commit()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                cursor = self.conn.cursor()
+                _store_file_stats(cursor, self.file_id, _compute_file_stats(cursor, self.file_id))
+        finally:
+            # 连接池在正常退出时提交，异常时回滚
+            self._context.__exit__(exc_type, exc_val, exc_tb)
+            self.conn = None
+            self._context = None
+        if exc_type is None:
+            self._finished_at = time.perf_counter()
+
+    @property
+    def stats(self) -> Dict:
+        """导入统计信息"""
+        elapsed = (self._finished_at or time.perf_counter()) - self._started_at
+        return {
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "labels_carried_over": self.labels_carried_over,
+            "elapsed": round(elapsed, 3),
+            "rows_per_second": round(self.inserted / elapsed) if elapsed > 0 else 0
+        }
+
+
+class PostgresRepository(Repository):
+    """PostgreSQL 后端：多个服务节点共用同一个数据库
+
+    连接池在首次使用时创建（工作进程各自建立），各方法在从池中取出的连接上执行，
+    正常返回时提交、异常时回滚。写操作通过行锁（SELECT ... FOR UPDATE）保证读取旧值与更新之间不被并发修改。
+    """
+
+    name = DATABASE_POSTGRES
+
+    def __init__(self, dsn: str):
+        if psycopg is None:
+            raise RuntimeError(f"使用 PostgreSQL 存储需要安装 psycopg 和 psycopg_pool（{POSTGRES_INSTALL_HINT}）")
+        super().__init__()
+        self.dsn = dsn
+        self._pool: Optional['ConnectionPool'] = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def pool(self) -> 'ConnectionPool':
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ConnectionPool(self.dsn, min_size=settings.POSTGRES_POOL_MIN_SIZE,
+                                                max_size=settings.POSTGRES_POOL_MAX_SIZE,
+                                                timeout=settings.POSTGRES_POOL_TIMEOUT, open=True)
+        return self._pool
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
+
+    def initialize(self):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', (_SCHEMA_LOCK_ID,))
+            for statement in _SCHEMA:
+                cursor.execute(statement)
+            try:
+                with conn.transaction():
+                    cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+                    cursor.execute(_SEARCH_INDEX)
+            except psycopg.Error as e:
+                # 没有 pg_trgm 扩展（或无权安装）时检索仍可用，只是逐条匹配；check-storage 的 search 检查也会提示
+                logger.warning("pg_trgm 扩展不可用，关键词检索不使用索引: %s", e)
+
+    def search_indexed(self) -> bool:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1 FROM pg_indexes WHERE tablename = 'data_records' "
+                           "AND indexname = 'idx_data_records_search'")
+            return cursor.fetchone() is not None
+
+    # 统计计数器
+
+    def ensure_file_stats(self) -> int:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                           SELECT f.id
+                           FROM files f
+                                    LEFT JOIN file_stats s ON s.file_id = f.id
+                           WHERE f.status = 'active'
+                             AND s.file_id IS NULL
+                           ''')
+            file_ids = [row[0] for row in cursor.fetchall()]
+            for file_id in file_ids:
+                _store_file_stats(cursor, file_id, _compute_file_stats(cursor, file_id))
+        return len(file_ids)
+
+    def rebuild_file_stats(self, file_id: Optional[int] = None) -> int:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            if file_id is None:
+                cursor.execute("SELECT id FROM files WHERE status = 'active'")
+                file_ids = [row[0] for row in cursor.fetchall()]
+            else:
+                file_ids = [file_id]
+            for fid in file_ids:
+                _store_file_stats(cursor, fid, _compute_file_stats(cursor, fid))
+        return len(file_ids)
+
+    def check_file_stats(self) -> List[Dict]:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                           SELECT f.id, f.filename, s.total_count, s.correct_count, s.incorrect_count
+                           FROM files f
+                                    LEFT JOIN file_stats s ON s.file_id = f.id
+                           WHERE f.status = 'active'
+                           ''')
+            mismatches = []
+            for file_id, filename, total_count, correct_count, incorrect_count in cursor.fetchall():
+                stored = {'total_count': total_count, 'correct_count': correct_count,
+                          'incorrect_count': incorrect_count}
+                expected = _compute_file_stats(cursor, file_id)
+                cursor.execute('''
+                               SELECT score, count
+                               FROM file_score_histogram
+                               WHERE file_id = %s
+                                 AND count > 0
+                               ''', (file_id,))
+                mismatch = stats_mismatch(file_id, filename, stored, dict(cursor.fetchall()), expected)
+                if mismatch:
+                    mismatches.append(mismatch)
+        return mismatches
+
+    # 文件
+
+    def save_file_info(self, filename: str, original_filename: str, file_size: int, total_records: int,
+                       annotation_type: str = "qa"):
+        with self.pool.connection() as conn:
+            conn.execute(f'''
+                INSERT INTO files (filename, original_filename, file_size, total_records, annotation_type,
+                                   last_modified)
+                VALUES (%s, %s, %s, %s, %s, {_NOW})
+                ON CONFLICT (filename) DO UPDATE
+                    SET original_filename = excluded.original_filename,
+                        file_size         = excluded.file_size,
+                        total_records     = excluded.total_records,
+                        annotation_type   = excluded.annotation_type,
+                        upload_time       = {_NOW},
+                        last_modified     = excluded.last_modified,
+                        status            = 'active',
+                        version           = files.version + 1
+            ''', (filename, original_filename, file_size, total_records, annotation_type))
+        self.file_cache.invalidate(filename)
+
+    def update_file_total_records(self, file_id: int, total_records: int):
+        with self.pool.connection() as conn:
+            conn.execute(f'UPDATE files SET total_records = %s, last_modified = {_NOW} WHERE id = %s',
+                         (total_records, file_id))
+        # 缓存按文件名索引，按ID修改时清空（很少发生）
+        self.file_cache.invalidate()
+
+    def load_file_info(self, filename: str) -> Optional[Dict]:
+        with self.pool.connection() as conn:
+            row = conn.execute(f'SELECT {_FILE_COLUMNS} FROM files WHERE filename = %s', (filename,)).fetchone()
+        return file_row(row) if row else None
+
+    def get_file_version(self, file_id: int) -> int:
+        with self.pool.connection() as conn:
+            row = conn.execute('SELECT version FROM files WHERE id = %s', (file_id,)).fetchone()
+        return row[0] if row else 0
+
+    def get_all_files(self) -> List[Dict]:
+        with self.pool.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT {_FILE_COLUMNS}
+                FROM files
+                WHERE status = 'active'
+                ORDER BY upload_time DESC
+            ''').fetchall()
+        return [file_row(row) for row in rows]
+
+    def delete_file_info(self, filename: str):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE files SET status = 'deleted' WHERE filename = %s RETURNING id", (filename,))
+            file_record = cursor.fetchone()
+            if file_record:
+                file_id = file_record[0]
+                cursor.execute("UPDATE data_records SET status = 'deleted' WHERE file_id = %s", (file_id,))
+                cursor.execute('DELETE FROM file_stats WHERE file_id = %s', (file_id,))
+                cursor.execute('DELETE FROM file_score_histogram WHERE file_id = %s', (file_id,))
+                cursor.execute('DELETE FROM record_leases WHERE file_id = %s', (file_id,))
+                _bump_file_version(cursor, file_id)
+        self.file_cache.invalidate(filename)
+
+    # 数据记录
+
+    def bulk_loader(self, file_id: int, defer_indexes: Optional[bool] = None, dedup_mode: str = DEDUP_OFF,
+                    storage_mode: str = settings.STORAGE_MODE,
+                    field_mapping: Optional[FieldMapping] = None,
+                    on_error: Optional[RecordErrorHandler] = None) -> PostgresBulkLoader:
+        return PostgresBulkLoader(self, file_id, defer_indexes, dedup_mode, storage_mode, field_mapping, on_error)
+
+    def flag_near_duplicates(self, file_id: int) -> int:
+        with self.pool.connection() as conn:
+            # 服务器端游标逐批读取，不把整个文件的文本读入内存
+            with conn.cursor(name=f'near_duplicates_{uuid.uuid4().hex}') as cursor:
+                cursor.itersize = settings.EXPORT_FETCH_SIZE
+                cursor.execute('''
+                               SELECT id, query, response
+                               FROM data_records
+                               WHERE file_id = %s
+                                 AND status = 'active'
+                                 AND duplicate_of IS NULL
+                               ORDER BY line_number
+                               ''', (file_id,))
+                records = ((record_id, f"{query or ''}\n{response or ''}") for record_id, query, response in cursor)
+                pairs = [(original_id, record_id) for record_id, original_id in find_near_duplicates(records)]
+
+            cursor = conn.cursor()
+            cursor.execute('''
+                           UPDATE data_records
+                           SET near_duplicate_of = NULL
+                           WHERE file_id = %s
+                             AND near_duplicate_of IS NOT NULL
+                           ''', (file_id,))
+            cursor.executemany('UPDATE data_records SET near_duplicate_of = %s WHERE id = %s', pairs)
+            _bump_file_version(cursor, file_id)
+        return len(pairs)
+
+    def get_data_records_from_db(self, file_id: int, search: str = "", annotation_status: str = "all",
+                                 selected_only: bool = False, page: int = 1, per_page: int = 20,
+                                 cursor: Optional[str] = None, skip_count: bool = False) -> Dict:
+        after_line = decode_cursor(cursor, file_id) if cursor else None
+        where_conditions, params = _build_record_filter(file_id, search, annotation_status)
+
+        with self.pool.connection() as conn:
+            db_cursor = conn.cursor()
+            total_count = None
+            if not skip_count:
+                db_cursor.execute(f"SELECT COUNT(*) FROM data_records r WHERE {' AND '.join(where_conditions)}",
+                                  params)
+                total_count = db_cursor.fetchone()[0]
+
+            if after_line is not None:
+                where_conditions.append("r.line_number > %s")
+                params.append(after_line)
+                offset = 0
+            else:
+                offset = (page - 1) * per_page
+            db_cursor.execute(f'''
+                SELECT r.id, r.unique_id, r.line_number, r.system, r.query, r.response, r.annotation_result,
+                       r.created_at::text, r.updated_at::text, NULL, r.duplicate_of, r.near_duplicate_of
+                FROM data_records r
+                WHERE {' AND '.join(where_conditions)}
+                ORDER BY r.line_number
+                LIMIT %s OFFSET %s
+            ''', params + [per_page + 1, offset])
+            rows = db_cursor.fetchall()
+
+        if search and len(search) >= FTS_MIN_SEARCH_LENGTH:
+            # 与 SQLite 后端一致，只为全文检索（关键词不少于 3 个字符）生成高亮片段
+            rows = [row[:9] + (_highlight(search, row[3:6]),) + row[10:] for row in rows]
+        return records_page(file_id, rows, total_count, page, per_page)
+
+    def _refresh_content_hash(self, cursor: 'psycopg.Cursor', record_id: int):
+        """记录内容修改后重新计算内容哈希，并解除与原重复记录的关联"""
+        cursor.execute('SELECT system, query, response FROM data_records WHERE id = %s', (record_id,))
+        system, query, response = cursor.fetchone()
+        cursor.execute('''
+                       UPDATE data_records
+                       SET content_hash      = %s,
+                           duplicate_of      = NULL,
+                           near_duplicate_of = NULL
+                       WHERE id = %s
+                       ''', (content_hash(system, query, response), record_id))
+
+        # 关联到该记录的重复记录改为关联到其中的第一条
+        cursor.execute('SELECT MIN(id) FROM data_records WHERE duplicate_of = %s', (record_id,))
+        new_original_id = cursor.fetchone()[0]
+        if new_original_id is not None:
+            cursor.execute('''
+                           UPDATE data_records
+                           SET duplicate_of = CASE WHEN id = %s THEN NULL ELSE %s END
+                           WHERE duplicate_of = %s
+                           ''', (new_original_id, new_original_id, record_id))
+
+    def apply_data_edit(self, file_id: int, line_number: int, updates: Dict) -> bool:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                           SELECT id, raw
+                           FROM data_records
+                           WHERE file_id = %s
+                             AND line_number = %s
+                             AND status = 'active'
+                           FOR UPDATE
+                           ''', (file_id, line_number))
+            row = cursor.fetchone()
+            if not row:
+                return False
+            record_id, raw = row
+
+            columns = [field for field in EDITABLE_FIELDS if field in updates]
+            assignments = [f'{column} = %s' for column in columns]
+            values = [updates[column] for column in columns]
+            if raw is not None:
+                raw_record = json.loads(raw)
+                raw_record.update(updates)
+                assignments.append('raw = %s')
+                values.append(json.dumps(raw_record, ensure_ascii=False))
+            if assignments:
+                cursor.execute(f'''
+                               UPDATE data_records
+                               SET {', '.join(assignments)},
+                                   updated_at = {_NOW}
+                               WHERE id = %s
+                               ''', values + [record_id])
+            if columns:
+                self._refresh_content_hash(cursor, record_id)
+
+            cursor.execute(f'''
+                INSERT INTO data_edits (file_id, line_number, updates, created_at)
+                VALUES (%s, %s, %s, {_NOW})
+            ''', (file_id, line_number, json.dumps(updates, ensure_ascii=False)))
+            _bump_file_version(cursor, file_id)
+        return True
+
+    def get_pending_edits(self, file_id: int) -> Tuple[int, Dict[int, Dict]]:
+        with self.pool.connection() as conn:
+            rows = conn.execute('''
+                                SELECT id, line_number, updates
+                                FROM data_edits
+                                WHERE file_id = %s
+                                  AND materialized = 0
+                                ORDER BY id
+                                ''', (file_id,)).fetchall()
+        max_edit_id = 0
+        edits = {}
+        for edit_id, line_number, updates in rows:
+            max_edit_id = edit_id
+            edits.setdefault(line_number, {}).update(json.loads(updates))
+        return max_edit_id, edits
+
+    def get_line_offsets(self, file_id: int, line_numbers: List[int]) -> Dict[int, Tuple[Optional[int], Optional[int]]]:
+        with self.pool.connection() as conn:
+            rows = conn.execute('''
+                                SELECT line_number, byte_offset, byte_length
+                                FROM data_records
+                                WHERE file_id = %s
+                                  AND line_number = ANY(%s)
+                                ''', (file_id, line_numbers)).fetchall()
+        return {line_number: (byte_offset, byte_length) for line_number, byte_offset, byte_length in rows}
+
+    def save_line_offsets(self, file_id: int, offsets: Iterator[Tuple[int, int, int]]):
+        with self.pool.connection() as conn:
+            conn.cursor().executemany('''
+                                      UPDATE data_records
+                                      SET byte_offset = %s,
+                                          byte_length = %s
+                                      WHERE file_id = %s
+                                        AND line_number = %s
+                                      ''', ((offset, length, file_id, line_number)
+                                            for offset, length, line_number in offsets))
+
+    def complete_materialization(self, file_id: int, max_edit_id: int, new_lengths: Dict[int, Tuple[int, int]],
+                                 file_size: int):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            line_numbers = sorted(new_lengths)
+            shift = 0
+            for index, line_number in enumerate(line_numbers):
+                old_length, new_length = new_lengths[line_number]
+                cursor.execute('UPDATE data_records SET byte_length = %s WHERE file_id = %s AND line_number = %s',
+                               (new_length, file_id, line_number))
+                # 当前行之后、下一被修改行之前（含）的记录整体平移
+                shift += new_length - old_length
+                if shift:
+                    next_line = line_numbers[index + 1] if index + 1 < len(line_numbers) else None
+                    cursor.execute(f'''
+                                   UPDATE data_records
+                                   SET byte_offset = byte_offset + %s
+                                   WHERE file_id = %s
+                                     AND line_number > %s
+                                     {'AND line_number <= %s' if next_line is not None else ''}
+                                   ''', [shift, file_id, line_number] + ([next_line] if next_line is not None else []))
+
+            cursor.execute('UPDATE data_edits SET materialized = 1 WHERE file_id = %s AND id <= %s',
+                           (file_id, max_edit_id))
+            cursor.execute(f'UPDATE files SET file_size = %s, last_modified = {_NOW} WHERE id = %s',
+                           (file_size, file_id))
+        self.file_cache.invalidate()
+
+    # 标注与统计
+
+    def update_data_annotations(self, annotations: List[Tuple[RecordKey, str]]) -> List[Optional[Dict]]:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            results = []
+            # {file_id: (标注类型, [(旧值, 新值)])}
+            file_changes = {}
+            propagate = settings.DEDUP_PROPAGATE_LABELS and _has_linked_duplicates(cursor)
+            for record_key, annotation_result in annotations:
+                # 锁定记录，保证读取的旧值与更新之间不被其他节点修改
+                cursor.execute(f'''
+                    SELECT r.id, r.unique_id, r.file_id, r.line_number, r.annotation_result, f.annotation_type
+                    FROM data_records r
+                             JOIN files f ON f.id = r.file_id
+                    WHERE r.{record_key_column(record_key)} = %s
+                      AND r.status = 'active'
+                    FOR UPDATE OF r
+                ''', (record_key,))
+                row = cursor.fetchone()
+                if not row:
+                    results.append(None)
+                    continue
+                record_id, unique_id, file_id, line_number, old_result, annotation_type = row
+
+                score = parse_score(annotation_result) if annotation_type == 'scoring' else None
+                cursor.execute(f'''
+                               UPDATE data_records
+                               SET annotation_result = %s,
+                                   score             = %s,
+                                   updated_at        = {_NOW}
+                               WHERE id = %s
+                               ''', (annotation_result, score, record_id))
+                file_changes.setdefault(file_id, (annotation_type, []))[1].append((old_result, annotation_result))
+
+                linked_file_ids = []
+                if propagate:
+                    linked_file_ids = _propagate_to_duplicates(cursor, record_id, annotation_type, annotation_result)
+                    for linked_file_id in linked_file_ids:
+                        file_changes.setdefault(linked_file_id, (annotation_type, []))[1].append(
+                            (None, annotation_result))
+
+                results.append({
+                    'id': record_id,
+                    'file_id': file_id,
+                    'unique_id': unique_id,
+                    'line_number': line_number,
+                    'annotation_result': annotation_result,
+                    'linked_file_ids': sorted(set(linked_file_ids))
+                })
+
+            for file_id, (annotation_type, changes) in file_changes.items():
+                _apply_annotation_deltas(cursor, file_id, annotation_type, changes)
+        return results
+
+    def batch_update_annotations(self, file_id: int, annotations: Optional[List[Tuple[RecordKey, str]]] = None,
+                                 annotation_result: Optional[str] = None, search: str = "",
+                                 annotation_status: str = "all") -> Dict:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT annotation_type FROM files WHERE id = %s', (file_id,))
+            file_record = cursor.fetchone()
+            if not file_record:
+                return {"updated_count": 0, "missing": []}
+            annotation_type = file_record[0]
+
+            # 读取并锁定旧值：(记录ID, 旧标注结果, 新标注结果)
+            changes = []
+            missing = []
+            if annotations is not None:
+                new_results = dict(annotations)
+                keys_by_column = {}
+                for record_key in new_results:
+                    keys_by_column.setdefault(record_key_column(record_key), []).append(record_key)
+                found = set()
+                for column, record_keys in keys_by_column.items():
+                    cursor.execute(f'''
+                        SELECT id, {column}, annotation_result
+                        FROM data_records
+                        WHERE file_id = %s
+                          AND status = 'active'
+                          AND {column} = ANY(%s)
+                        FOR UPDATE
+                    ''', (file_id, record_keys))
+                    for record_id, record_key, old_result in cursor.fetchall():
+                        found.add(record_key)
+                        changes.append((record_id, old_result, new_results[record_key]))
+                missing = [record_key for record_key in new_results if record_key not in found]
+            else:
+                where_conditions, params = _build_record_filter(file_id, search, annotation_status)
+                cursor.execute(f'''
+                    SELECT r.id, r.annotation_result
+                    FROM data_records r
+                    WHERE {' AND '.join(where_conditions)}
+                    FOR UPDATE
+                ''', params)
+                changes = [(record_id, old_result, annotation_result) for record_id, old_result in cursor.fetchall()]
+
+            cursor.executemany(f'''
+                               UPDATE data_records
+                               SET annotation_result = %s,
+                                   score             = %s,
+                                   updated_at        = {_NOW}
+                               WHERE id = %s
+                               ''', [(new_result, parse_score(new_result) if annotation_type == 'scoring' else None,
+                                      record_id) for record_id, _, new_result in changes])
+
+            file_changes = {file_id: (annotation_type,
+                                      [(old_result, new_result) for _, old_result, new_result in changes])}
+            propagated_count = 0
+            linked_file_ids = set()
+            if settings.DEDUP_PROPAGATE_LABELS and _has_linked_duplicates(cursor):
+                for record_id, _, new_result in changes:
+                    for linked_file_id in _propagate_to_duplicates(cursor, record_id, annotation_type, new_result):
+                        file_changes.setdefault(linked_file_id, (annotation_type, []))[1].append((None, new_result))
+                        linked_file_ids.add(linked_file_id)
+                        propagated_count += 1
+
+            for changed_file_id, (changed_type, file_change_list) in file_changes.items():
+                _apply_annotation_deltas(cursor, changed_file_id, changed_type, file_change_list)
+
+        return {
+            "updated_count": len(changes),
+            "propagated_count": propagated_count,
+            "linked_file_ids": sorted(linked_file_ids),
+            "missing": missing
+        }
+
+    def get_data_stats_from_db(self, file_id: int) -> Dict:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                           SELECT s.total_count, s.correct_count, s.incorrect_count, f.annotation_type
+                           FROM file_stats s
+                                    JOIN files f ON f.id = s.file_id
+                           WHERE s.file_id = %s
+                           ''', (file_id,))
+            row = cursor.fetchone()
+            if row:
+                total_count, correct_count, incorrect_count, annotation_type = row
+                score_histogram = {}
+                if annotation_type == 'scoring':
+                    cursor.execute('''
+                                   SELECT score, count
+                                   FROM file_score_histogram
+                                   WHERE file_id = %s
+                                     AND count > 0
+                                   ''', (file_id,))
+                    score_histogram = dict(cursor.fetchall())
+                return stats_result(annotation_type, total_count, correct_count, incorrect_count, score_histogram)
+            # 计数器尚未建立，退回全量统计
+            return stats_result(**_compute_file_stats(cursor, file_id))
+
+    # 导出
+
+    def build_export_query(self, file_id: int, export_type: str = "correct", min_score: Optional[float] = None,
+                           max_score: Optional[float] = None) -> Tuple[str, List]:
+        if export_type not in ["correct", "incorrect"]:
+            raise ValueError("export_type 必须是 'correct' 或 'incorrect'")
+
+        with self.pool.connection() as conn:
+            file_record = conn.execute('SELECT annotation_type FROM files WHERE id = %s', (file_id,)).fetchone()
+        annotation_type = file_record[0] if file_record else 'qa'
+
+        if annotation_type == 'scoring':
+            score_conditions = ["score IS NOT NULL"]
+            if min_score is not None or max_score is not None:
+                params = [file_id]
+                if min_score is not None:
+                    score_conditions.append("score >= %s")
+                    params.append(min_score)
+                if max_score is not None:
+                    score_conditions.append("score <= %s")
+                    params.append(max_score)
+            elif export_type == 'correct':
+                score_conditions.append("score >= %s")
+                params = [file_id, SCORE_THRESHOLD]
+            else:
+                score_conditions.append("score < %s")
+                params = [file_id, SCORE_THRESHOLD]
+            export_filter = ' AND '.join(score_conditions)
+        else:
+            export_filter = "annotation_result = %s"
+            params = [file_id, export_type]
+
+        query = f'''
+            SELECT system, query, response, raw
+            FROM data_records
+            WHERE file_id = %s
+              AND status = 'active'
+              AND {export_filter}
+            ORDER BY line_number
+        '''
+        return query, params
+
+    def iter_export_chunks(self, query: str, params: List,
+                           fetch_size: int = settings.EXPORT_FETCH_SIZE) -> Iterator[Tuple[bytes, int]]:
+        # 服务器端游标分块读取；连接在迭代结束（或生成器关闭）时归还连接池
+        with self.pool.connection() as conn:
+            with conn.cursor(name=f'export_{uuid.uuid4().hex}') as cursor:
+                cursor.execute(query, params)
+                while rows := cursor.fetchmany(fetch_size):
+                    yield export_chunk(rows), len(rows)
+
+    def count_export_rows(self, query: str, params: List) -> int:
+        with self.pool.connection() as conn:
+            return conn.execute(f'SELECT COUNT(*) FROM ({query}) AS export_rows', params).fetchone()[0]
+
+    # 标注任务队列
+
+    def lease_records(self, file_id: int, session_id: str, count: int, prefetch: int,
+                      lease_seconds: float) -> Dict:
+        now = time.time()
+        expires_at = now + lease_seconds
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM record_leases WHERE file_id = %s AND expires_at < %s', (file_id, now))
+            cursor.execute('''
+                           DELETE
+                           FROM record_leases l
+                           WHERE l.file_id = %s
+                             AND l.session_id = %s
+                             AND NOT EXISTS (SELECT 1
+                                             FROM data_records r
+                                             WHERE r.id = l.record_id
+                                               AND r.status = 'active'
+                                               AND r.annotation_result IS NULL)
+                           ''', (file_id, session_id))
+            cursor.execute('UPDATE record_leases SET expires_at = %s WHERE file_id = %s AND session_id = %s',
+                           (expires_at, file_id, session_id))
+            wanted = count + prefetch - cursor.rowcount
+
+            if wanted > 0:
+                # 多个会话同时领取时跳过其他事务正在领取的记录而不是等待；
+                # 与刚提交的领取仍可能撞上同一条记录，由 ON CONFLICT 忽略（本次少领几条）
+                cursor.execute('''
+                               INSERT INTO record_leases (record_id, file_id, session_id, line_number, expires_at)
+                               SELECT r.id, r.file_id, %s, r.line_number, %s
+                               FROM data_records r
+                               WHERE r.file_id = %s
+                                 AND r.status = 'active'
+                                 AND r.annotation_result IS NULL
+                                 AND NOT EXISTS (SELECT 1 FROM record_leases l WHERE l.record_id = r.id)
+                               ORDER BY r.line_number
+                               LIMIT %s
+                               FOR NO KEY UPDATE SKIP LOCKED
+                               ON CONFLICT (record_id) DO NOTHING
+                               ''', (session_id, expires_at, file_id, wanted))
+
+            cursor.execute('''
+                           SELECT r.id, r.unique_id, r.line_number, r.system, r.query, r.response,
+                                  r.annotation_result, r.created_at::text, r.updated_at::text, NULL,
+                                  r.duplicate_of, r.near_duplicate_of
+                           FROM record_leases l
+                                    JOIN data_records r ON r.id = l.record_id
+                           WHERE l.file_id = %s
+                             AND l.session_id = %s
+                           ORDER BY l.line_number
+                           ''', (file_id, session_id))
+            session_records = [record_row(row) for row in cursor.fetchall()]
+        return leased_records(session_records, count, expires_at)
+
+    def release_leases(self, file_id: int, session_id: str) -> int:
+        with self.pool.connection() as conn:
+            return conn.execute('DELETE FROM record_leases WHERE file_id = %s AND session_id = %s',
+                                (file_id, session_id)).rowcount
+
+    # 后台任务
+
+    def create_job(self, job_type: str, params: Dict) -> str:
+        job_id = uuid.uuid4().hex
+        with self.pool.connection() as conn:
+            conn.execute(f'''
+                INSERT INTO jobs (id, job_type, status, params, created_at, updated_at)
+                VALUES (%s, %s, 'pending', %s, {_NOW}, {_NOW})
+            ''', (job_id, job_type, json.dumps(params, ensure_ascii=False)))
+        return job_id
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        with self.pool.connection() as conn:
+            row = conn.execute('''
+                               SELECT id, job_type, status, params, processed, progress, checkpoint, result, error,
+                                      started_at, created_at::text, updated_at::text
+                               FROM jobs
+                               WHERE id = %s
+                               ''', (job_id,)).fetchone()
+        return job_row(row) if row else None
+
+    def claim_job(self, job_id: str, owner: str, stale_before: float) -> Optional[Dict]:
+        now = time.time()
+        with self.pool.connection() as conn:
+            claimed = conn.execute(f'''
+                UPDATE jobs
+                SET status       = 'running',
+                    owner        = %s,
+                    heartbeat_at = %s,
+                    started_at   = COALESCE(started_at, %s),
+                    updated_at   = {_NOW}
+                WHERE id = %s
+                  AND (status = 'pending' OR (status = 'running' AND heartbeat_at < %s))
+            ''', (owner, now, now, job_id, stale_before)).rowcount > 0
+        return self.get_job(job_id) if claimed else None
+
+    def list_resumable_jobs(self, stale_before: float) -> List[str]:
+        with self.pool.connection() as conn:
+            rows = conn.execute('''
+                                SELECT id
+                                FROM jobs
+                                WHERE status = 'pending'
+                                   OR (status = 'running' AND heartbeat_at < %s)
+                                ORDER BY created_at
+                                ''', (stale_before,)).fetchall()
+        return [row[0] for row in rows]
+
+    def update_job_progress(self, job_id: str, owner: str, processed: int, progress: float,
+                            checkpoint: Optional[Dict] = None, loader: Optional[PostgresBulkLoader] = None) -> bool:
+        statement = f'''
+            UPDATE jobs
+            SET processed    = %s,
+                progress     = %s,
+                checkpoint   = COALESCE(%s, checkpoint),
+                heartbeat_at = %s,
+                updated_at   = {_NOW}
+            WHERE id = %s
+              AND owner = %s
+        '''
+        params = (processed, progress, json.dumps(checkpoint) if checkpoint is not None else None, time.time(),
+                  job_id, owner)
+        if loader is not None:
+            return loader.conn.execute(statement, params).rowcount > 0
+        with self.pool.connection() as conn:
+            return conn.execute(statement, params).rowcount > 0
+
+    def finish_job(self, job_id: str, owner: str, status: str, result: Optional[Dict] = None,
+                   error: Optional[str] = None):
+        with self.pool.connection() as conn:
+            conn.execute(f'''
+                UPDATE jobs
+                SET status     = %s,
+                    result     = %s,
+                    error      = %s,
+                    progress   = CASE WHEN %s = 'completed' THEN 1 ELSE progress END,
+                    updated_at = {_NOW}
+                WHERE id = %s
+                  AND owner = %s
+            ''', (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error, status,
+                  job_id, owner))
+
+    # 多进程（多节点）事件转发
+
+    def append_file_events(self, worker_id: str, events: List[Tuple[int, Dict]], expire_before: float):
+        now = time.time()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            # 写入串行化，使事件ID按提交顺序递增，读取方按ID增量读取时不会漏掉晚提交的事件
+            cursor.execute('LOCK TABLE file_events IN SHARE ROW EXCLUSIVE MODE')
+            cursor.executemany('''
+                               INSERT INTO file_events (worker_id, file_id, event, created_at)
+                               VALUES (%s, %s, %s, %s)
+                               ''', [(worker_id, file_id, json.dumps(event, ensure_ascii=False), now)
+                                     for file_id, event in events])
+            cursor.execute('DELETE FROM file_events WHERE created_at < %s', (expire_before,))
+
+    def get_last_file_event_id(self) -> int:
+        with self.pool.connection() as conn:
+            return conn.execute('SELECT COALESCE(MAX(id), 0) FROM file_events').fetchone()[0]
+
+    def get_file_events_since(self, last_id: int, worker_id: str) -> Tuple[int, List[Tuple[int, Dict]]]:
+        with self.pool.connection() as conn:
+            rows = conn.execute('''
+                                SELECT id, worker_id, file_id, event
+                                FROM file_events
+                                WHERE id > %s
+                                ORDER BY id
+                                ''', (last_id,)).fetchall()
+        events = []
+        for event_id, event_worker_id, file_id, event in rows:
+            last_id = event_id
+            if event_worker_id != worker_id:
+                events.append((file_id, json.loads(event)))
+        return last_id, events
@@ -0,0 +1,300 @@
+import base64
+import json
+from collections import Counter
+from typing import Callable, List, Dict, Optional, Iterable, Tuple, Union
+
+from backend.core.db import parse_score
+from backend.core.dedup import content_hash
+from backend.core.mapping import FieldMapping, MAPPED_FIELDS, to_text
+
+# 与 SQL 方言无关的数据记录、统计和任务的转换逻辑，由各存储后端（crud / postgres）共用
+
+# 数据记录的定位方式：整数为记录ID（主键），字符串为 unique_id
+RecordKey = Union[int, str]
+
+# /api/update 可直接修改的数据列，其他字段只记录在编辑日志中，物化时写回源文件
+EDITABLE_FIELDS = ('system', 'query', 'response')
+
+# 评分标注中评分 >= 该阈值视为优质（correct），否则为劣质（incorrect）
+SCORE_THRESHOLD = 4
+
+# trigram 分词器至少需要 3 个字符才能命中索引（更短的关键词不生成高亮片段）
+FTS_MIN_SEARCH_LENGTH = 3
+
+# 解析器附加在记录上的元数据，不属于原始记录；JSONL 解析器同时附带原始行文本，保留原始记录时无需重新序列化
+RAW_LINE_KEY = '_raw_line'
+RECORD_METADATA_KEYS = ('line_number', 'byte_offset', 'byte_length', RAW_LINE_KEY)
+_PLAIN_RECORD_KEYS = frozenset(MAPPED_FIELDS + RECORD_METADATA_KEYS)
+
+# data_record_rows 数据行中 system、system_id（只用于 SQLite 的压缩存储）、response、原始记录和内容哈希所在的位置，
+# 内容哈希之后依次为 duplicate_of、annotation_result、score
+SYSTEM_COLUMN = 3
+SYSTEM_ID_COLUMN = 4
+RESPONSE_COLUMN = 6
+RAW_COLUMN = 9
+CONTENT_HASH_COLUMN = 10
+
+
+def make_unique_id(file_id: int, line_number: int) -> str:
+    """数据记录的稳定标识，由文件ID（自增不复用）和行号确定，重复导入同一行得到相同的标识"""
+    return f"{file_id}_{line_number}"
+
+
+def record_key_column(record_key: RecordKey) -> str:
+    return 'id' if isinstance(record_key, int) else 'unique_id'
+
+
+def _raw_record(record: Dict, field_mapping: Optional[FieldMapping]) -> Optional[str]:
+    """需要保留原始记录时返回其 JSON 文本：使用了字段映射，或记录中有 system / query / response 以外的字段"""
+    if field_mapping is None and _PLAIN_RECORD_KEYS.issuperset(record):
+        return None
+    raw_line = record.get(RAW_LINE_KEY)
+    if raw_line is not None:
+        return raw_line
+    return json.dumps({key: value for key, value in record.items() if key not in RECORD_METADATA_KEYS},
+                      ensure_ascii=False, default=str)
+
+
+# 记录无法转换时的回调 (行号, 异常)，与解析器的逐行错误一起报告
+RecordErrorHandler = Callable[[int, Exception], None]
+
+
+def data_record_rows(file_id: int, data_records: List[Dict], field_mapping: Optional[FieldMapping] = None,
+                     on_error: Optional[RecordErrorHandler] = None):
+    """将记录转换为批量写入的参数（原文存储，重复关联及继承的标注结果为空）
+
+    system / query / response 统一转换为文本（CSV、Parquet 中的数值列，JSON 中的数字、null 等）；
+    无法转换的记录交给 on_error 并跳过，未指定 on_error 时抛出异常。
+    """
+    for record in data_records:
+        line_number = record['line_number']
+        try:
+            if field_mapping:
+                system, query, response = field_mapping.apply(record)
+            else:
+                system, query, response = (to_text(record.get(field)) for field in MAPPED_FIELDS)
+        except (TypeError, ValueError) as e:
+            if on_error is None:
+                raise
+            on_error(line_number, ValueError(f"无法读取 system / query / response 字段: {e}"))
+            continue
+        yield (
+            file_id,
+            make_unique_id(file_id, line_number),
+            line_number,
+            system,
+            None,
+            query,
+            response,
+            record.get('byte_offset'),
+            record.get('byte_length'),
+            _raw_record(record, field_mapping),
+            content_hash(system, query, response),
+            None,
+            None,
+            None
+        )
+
+
+def like_pattern(search: str) -> str:
+    """子串匹配的 LIKE 模式（配合 ESCAPE '\\'）：关键词中的 % 和 _ 按字面匹配，与全文检索的结果一致"""
+    escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+
+def encode_cursor(file_id: int, line_number: int) -> str:
+    """生成分页游标（对客户端不透明）"""
+    raw = json.dumps([file_id, line_number]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, file_id: int) -> int:
+    """解析分页游标，返回上一页最后一条记录的行号"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_file_id, line_number = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("无效的分页游标")
+    if cursor_file_id != file_id or not isinstance(line_number, int):
+        raise ValueError("分页游标与文件不匹配")
+    return line_number
+
+
+def record_row(row: Tuple) -> Dict:
+    """数据记录行（id, unique_id, line_number, system, query, response, annotation_result, created_at, updated_at,
+    高亮片段, duplicate_of, near_duplicate_of）转换为列表接口中的一项"""
+    return {
+        'id': row[0],
+        'unique_id': row[1],
+        'line_number': row[2],
+        'system': row[3],
+        'query': row[4],
+        'response': row[5],
+        'annotation_result': row[6],
+        'created_at': row[7],
+        'updated_at': row[8],
+        'highlight': row[9],
+        'duplicate_of': row[10],
+        'near_duplicate_of': row[11],
+        'selected': False
+    }
+
+
+def records_page(file_id: int, rows: List[Tuple], total_count: Optional[int], page: int, per_page: int) -> Dict:
+    """将分页查询结果（比每页多取一条）格式化为列表接口的返回结构"""
+    has_more = len(rows) > per_page
+    data = [record_row(row) for row in rows[:per_page]]
+
+    return {
+        "data": data,
+        "total_count": total_count,
+        "page": page,
+        "per_page": per_page,
+        "total_pages": (total_count + per_page - 1) // per_page if total_count is not None else None,
+        "has_more": has_more,
+        "next_cursor": encode_cursor(file_id, data[-1]['line_number']) if has_more else None
+    }
+
+
+def classify_annotation(annotation_type: str, annotation_result: Optional[str]) -> Optional[str]:
+    """将标注结果归类为 correct / incorrect，其余情况（含未标注）返回 None"""
+    if annotation_type == 'scoring':
+        score = parse_score(annotation_result)
+        if score is None:
+            return None
+        return 'correct' if score >= SCORE_THRESHOLD else 'incorrect'
+    if annotation_result in ('correct', 'incorrect'):
+        return annotation_result
+    return None
+
+
+def file_stats(annotation_type: str, total_count: int = 0, correct_count: int = 0, incorrect_count: int = 0,
+               score_histogram: Optional[Dict[float, int]] = None) -> Dict:
+    """文件的统计计数（全量统计的结果，与物化计数器的列一一对应）"""
+    return {'annotation_type': annotation_type, 'total_count': total_count, 'correct_count': correct_count,
+            'incorrect_count': incorrect_count, 'score_histogram': score_histogram or {}}
+
+
+def tally_annotation_results(annotation_type: str, result_counts: Iterable[Tuple[Optional[str], int]]) -> Dict:
+    """将按标注结果分组的计数 [(标注结果, 条数)] 汇总为文件的统计计数（非评分标注）"""
+    stats = file_stats(annotation_type)
+    for annotation_result, count in result_counts:
+        stats['total_count'] += count
+        category = classify_annotation(annotation_type, annotation_result)
+        if category:
+            stats[f'{category}_count'] += count
+    return stats
+
+
+def annotation_deltas(annotation_type: str, changes: Iterable[Tuple[Optional[str], Optional[str]]]) \
+        -> Tuple[Dict[str, int], Counter]:
+    """汇总一批记录标注结果的变化 (旧值, 新值)，返回 ({correct/incorrect: 增量}, {分数: 增量})"""
+    deltas = {'correct': 0, 'incorrect': 0}
+    histogram_deltas = Counter()
+    for old_result, new_result in changes:
+        old_category = classify_annotation(annotation_type, old_result)
+        new_category = classify_annotation(annotation_type, new_result)
+        if old_category != new_category:
+            if old_category:
+                deltas[old_category] -= 1
+            if new_category:
+                deltas[new_category] += 1
+
+        if annotation_type == 'scoring':
+            old_score = parse_score(old_result)
+            new_score = parse_score(new_result)
+            if old_score != new_score:
+                if old_score is not None:
+                    histogram_deltas[old_score] -= 1
+                if new_score is not None:
+                    histogram_deltas[new_score] += 1
+    return deltas, histogram_deltas
+
+
+def stats_mismatch(file_id: int, filename: str, stored: Dict, stored_histogram: Dict[float, int],
+                   expected: Dict) -> Optional[Dict]:
+    """比较物化计数器（stored 为 total/correct/incorrect 计数）与全量统计，不一致时返回差异"""
+    if all(stored[key] == expected[key] for key in stored) and stored_histogram == expected['score_histogram']:
+        return None
+    return {
+        'file_id': file_id,
+        'filename': filename,
+        'stored': stored,
+        'expected': {key: expected[key] for key in stored}
+    }
+
+
+def stats_result(annotation_type: str, total_count: int, correct_count: int, incorrect_count: int,
+                 score_histogram: Dict[float, int]) -> Dict:
+    """统计接口的返回结构（参数与 file_stats 的字段相同）"""
+    unannotated_count = total_count - correct_count - incorrect_count
+
+    result = {
+        "total_count": total_count,
+        "correct_count": correct_count,
+        "incorrect_count": incorrect_count,
+        "unannotated_count": unannotated_count,
+        "annotation_distribution": {
+            "correct": correct_count,
+            "incorrect": incorrect_count,
+            "unannotated": unannotated_count
+        }
+    }
+    if annotation_type == 'scoring':
+        result["score_distribution"] = {f"{score:g}": count for score, count in sorted(score_histogram.items())}
+    return result
+
+
+def export_chunk(rows: List[Tuple]) -> bytes:
+    """将导出查询的 (system, query, response, raw) 行序列化为 JSONL"""
+    lines = [
+        raw if raw is not None else
+        json.dumps({'system': system or '', 'query': query_text or '', 'response': response or ''},
+                   ensure_ascii=False)
+        for system, query_text, response, raw in rows
+    ]
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def leased_records(session_records: List[Dict], count: int, expires_at: float) -> Dict:
+    """会话持有的记录（按行号有序）分为当前批次和预取的下一批次"""
+    return {
+        "records": session_records[:count],
+        "prefetch": session_records[count:],
+        "expires_at": expires_at
+    }
+
+
+def file_row(row: Tuple) -> Dict:
+    """文件信息行（id, filename, original_filename, file_size, total_records, annotation_type, upload_time,
+    last_modified, status）转换为字典"""
+    return {
+        'id': row[0],
+        'filename': row[1],
+        'original_filename': row[2],
+        'file_size': row[3],
+        'total_records': row[4],
+        'annotation_type': row[5],
+        'upload_time': row[6],
+        'last_modified': row[7],
+        'status': row[8]
+    }
+
+
+def job_row(row: Tuple) -> Dict:
+    """任务行（id, job_type, status, params, processed, progress, checkpoint, result, error, started_at,
+    created_at, updated_at）转换为字典"""
+    return {
+        'id': row[0],
+        'job_type': row[1],
+        'status': row[2],
+        'params': json.loads(row[3]),
+        'processed': row[4],
+        'progress': row[5],
+        'checkpoint': json.loads(row[6]) if row[6] else None,
+        'result': json.loads(row[7]) if row[7] else None,
+        'error': row[8],
+        'started_at': row[9],
+        'created_at': row[10],
+        'updated_at': row[11]
+    }
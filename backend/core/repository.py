@@ -0,0 +1,375 @@
+import logging
+import os
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Protocol
+
+from backend.conf import settings
+from backend.core import crud
+from backend.core.cache import TTLCache
+from backend.core.crud import OUTPUT_FOLDER
+from backend.core.db import init_database, close_all_connections, fts_enabled
+from backend.core.dedup import DEDUP_OFF
+from backend.core.mapping import FieldMapping
+from backend.core.records import RecordKey, RecordErrorHandler
+
+logger = logging.getLogger(__name__)
+
+DATABASE_SQLITE = 'sqlite'
+DATABASE_POSTGRES = 'postgres'
+
+
+class RecordLoader(Protocol):
+    """批量导入数据记录（见 crud.BulkLoader）：进入时开启事务，正常退出时更新统计计数器并提交"""
+
+    file_id: int
+    # 是否延迟索引维护（此时只能在导入结束时提交），进入后确定
+    defer_indexes: bool
+    inserted: int
+    duplicates: int
+
+    def __enter__(self) -> 'RecordLoader':
+        ...
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        ...
+
+    def add_batch(self, data_records: List[Dict]):
+        """写入一批记录（不提交）"""
+
+    def commit(self):
+        """提交已写入的批次并开启新事务（分段提交）"""
+
+    @property
+    def stats(self) -> Dict:
+        """导入统计信息"""
+
+
+class Repository(ABC):
+    """存储后端接口，各方法的语义与 crud 中的同名函数一致
+
+    方法均为同步调用，由 executor 的读写线程池执行；实现需保证可在多个线程中并发调用。
+    文件信息经 file_cache 缓存（get_file_info），实现在修改 files 表后需调用 file_cache.invalidate。
+    """
+
+    name: str
+
+    def __init__(self):
+        self.file_cache: TTLCache[Dict] = TTLCache(settings.FILE_INFO_CACHE_SIZE, settings.FILE_INFO_CACHE_TTL)
+
+    # 初始化与统计计数器
+
+    @abstractmethod
+    def initialize(self):
+        """建表及迁移（多个进程同时执行时依次进行）"""
+
+    def close(self):
+        """释放当前进程持有的数据库连接（含各线程的连接），之后再次调用其他方法时重新建立"""
+
+    @abstractmethod
+    def search_indexed(self) -> bool:
+        """关键词检索是否有索引可用（否则逐条匹配）"""
+
+    @abstractmethod
+    def ensure_file_stats(self) -> int:
+        ...
+
+    @abstractmethod
+    def rebuild_file_stats(self, file_id: Optional[int] = None) -> int:
+        ...
+
+    @abstractmethod
+    def check_file_stats(self) -> List[Dict]:
+        ...
+
+    # 文件
+
+    @abstractmethod
+    def save_file_info(self, filename: str, original_filename: str, file_size: int, total_records: int,
+                       annotation_type: str = "qa"):
+        ...
+
+    @abstractmethod
+    def update_file_total_records(self, file_id: int, total_records: int):
+        ...
+
+    @abstractmethod
+    def load_file_info(self, filename: str) -> Optional[Dict]:
+        """从数据库读取文件信息（不经过缓存）"""
+
+    def cached_file_info(self, filename: str) -> Optional[Dict]:
+        """只查缓存，未命中时返回 None（不访问数据库，可在事件循环中直接调用）"""
+        file_info = self.file_cache.get(filename)
+        return dict(file_info) if file_info is not None else None
+
+    def fetch_file_info(self, filename: str) -> Optional[Dict]:
+        """从数据库读取文件信息并写入缓存"""
+        generation = self.file_cache.generation
+        file_info = self.load_file_info(filename)
+        if file_info is None:
+            return None
+        self.file_cache.put(filename, file_info, generation)
+        return dict(file_info)
+
+    def get_file_info(self, filename: str) -> Optional[Dict]:
+        """获取文件信息，优先使用缓存（返回副本，调用方可以修改）"""
+        file_info = self.cached_file_info(filename)
+        return file_info if file_info is not None else self.fetch_file_info(filename)
+
+    @abstractmethod
+    def get_file_version(self, file_id: int) -> int:
+        """文件的当前版本号：数据记录或统计每次变化时递增（不经过文件信息缓存）"""
+
+    @abstractmethod
+    def get_all_files(self) -> List[Dict]:
+        ...
+
+    @abstractmethod
+    def delete_file_info(self, filename: str):
+        ...
+
+    # 数据记录
+
+    @abstractmethod
+    def bulk_loader(self, file_id: int, defer_indexes: Optional[bool] = None, dedup_mode: str = DEDUP_OFF,
+                    storage_mode: str = settings.STORAGE_MODE,
+                    field_mapping: Optional[FieldMapping] = None,
+                    on_error: Optional[RecordErrorHandler] = None) -> RecordLoader:
+        ...
+
+    @abstractmethod
+    def flag_near_duplicates(self, file_id: int) -> int:
+        ...
+
+    @abstractmethod
+    def get_data_records_from_db(self, file_id: int, search: str = "", annotation_status: str = "all",
+                                 selected_only: bool = False, page: int = 1, per_page: int = 20,
+                                 cursor: Optional[str] = None, skip_count: bool = False) -> Dict:
+        ...
+
+    @abstractmethod
+    def apply_data_edit(self, file_id: int, line_number: int, updates: Dict) -> bool:
+        ...
+
+    @abstractmethod
+    def get_pending_edits(self, file_id: int) -> Tuple[int, Dict[int, Dict]]:
+        ...
+
+    @abstractmethod
+    def get_line_offsets(self, file_id: int, line_numbers: List[int]) -> Dict[int, Tuple[Optional[int], Optional[int]]]:
+        ...
+
+    @abstractmethod
+    def save_line_offsets(self, file_id: int, offsets: Iterator[Tuple[int, int, int]]):
+        ...
+
+    @abstractmethod
+    def complete_materialization(self, file_id: int, max_edit_id: int, new_lengths: Dict[int, Tuple[int, int]],
+                                 file_size: int):
+        ...
+
+    # 标注与统计
+
+    @abstractmethod
+    def update_data_annotations(self, annotations: List[Tuple[RecordKey, str]]) -> List[Optional[Dict]]:
+        ...
+
+    def update_data_annotation(self, record_key: RecordKey, annotation_result: str) -> bool:
+        return self.update_data_annotations([(record_key, annotation_result)])[0] is not None
+
+    @abstractmethod
+    def batch_update_annotations(self, file_id: int, annotations: Optional[List[Tuple[RecordKey, str]]] = None,
+                                 annotation_result: Optional[str] = None, search: str = "",
+                                 annotation_status: str = "all") -> Dict:
+        ...
+
+    @abstractmethod
+    def get_data_stats_from_db(self, file_id: int) -> Dict:
+        ...
+
+    # 导出（查询由各后端构建，对调用方不透明）
+
+    @abstractmethod
+    def build_export_query(self, file_id: int, export_type: str = "correct", min_score: Optional[float] = None,
+                           max_score: Optional[float] = None) -> Tuple[str, List]:
+        ...
+
+    @abstractmethod
+    def iter_export_chunks(self, query: str, params: List,
+                           fetch_size: int = settings.EXPORT_FETCH_SIZE) -> Iterator[Tuple[bytes, int]]:
+        ...
+
+    @abstractmethod
+    def count_export_rows(self, query: str, params: List) -> int:
+        ...
+
+    def export_data_from_db(self, file_id: int, export_name: str, export_type: str = "correct",
+                            min_score: Optional[float] = None, max_score: Optional[float] = None,
+                            on_progress: Optional[Callable[[int], None]] = None) -> Optional[Dict]:
+        """导出标注数据（正确或错误）到 OUTPUT_FOLDER，逐块写入而不加载整个结果集
+
+        on_progress 在每写入一块后以已导出的记录数调用。
+        """
+        query, params = self.build_export_query(file_id, export_type, min_score, max_score)
+        export_path = os.path.join(OUTPUT_FOLDER, export_name)
+
+        try:
+            export_count = 0
+            with open(export_path, 'wb', buffering=settings.EXPORT_BUFFER_SIZE) as f:
+                for chunk, count in self.iter_export_chunks(query, params):
+                    f.write(chunk)
+                    export_count += count
+                    if on_progress:
+                        on_progress(export_count)
+
+            return {
+                "export_path": export_path,
+                "export_count": export_count
+            }
+        except Exception as e:
+            logger.error("导出文件 %s 失败: %s", export_path, e, exc_info=True)
+            return None
+
+    # 标注任务队列
+
+    @abstractmethod
+    def lease_records(self, file_id: int, session_id: str, count: int, prefetch: int,
+                      lease_seconds: float) -> Dict:
+        ...
+
+    @abstractmethod
+    def release_leases(self, file_id: int, session_id: str) -> int:
+        ...
+
+    # 后台任务
+
+    @abstractmethod
+    def create_job(self, job_type: str, params: Dict) -> str:
+        ...
+
+    @abstractmethod
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    def claim_job(self, job_id: str, owner: str, stale_before: float) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    def list_resumable_jobs(self, stale_before: float) -> List[str]:
+        ...
+
+    @abstractmethod
+    def update_job_progress(self, job_id: str, owner: str, processed: int, progress: float,
+                            checkpoint: Optional[Dict] = None, loader: Optional[RecordLoader] = None) -> bool:
+        """更新任务进度与断点，传入 loader 时在其事务中执行（与导入的数据一起提交）"""
+
+    @abstractmethod
+    def finish_job(self, job_id: str, owner: str, status: str, result: Optional[Dict] = None,
+                   error: Optional[str] = None):
+        ...
+
+    # 多进程事件转发
+
+    @abstractmethod
+    def append_file_events(self, worker_id: str, events: List[Tuple[int, Dict]], expire_before: float):
+        ...
+
+    @abstractmethod
+    def get_last_file_event_id(self) -> int:
+        ...
+
+    @abstractmethod
+    def get_file_events_since(self, last_id: int, worker_id: str) -> Tuple[int, List[Tuple[int, Dict]]]:
+        ...
+
+
+class SqliteRepository(Repository):
+    """SQLite 后端（本地 files.db），直接使用 crud 中的实现"""
+
+    name = DATABASE_SQLITE
+
+    initialize = staticmethod(init_database)
+    close = staticmethod(close_all_connections)
+    search_indexed = staticmethod(fts_enabled)
+    ensure_file_stats = staticmethod(crud.ensure_file_stats)
+    rebuild_file_stats = staticmethod(crud.rebuild_file_stats)
+    check_file_stats = staticmethod(crud.check_file_stats)
+
+    load_file_info = staticmethod(crud.get_file_info)
+    get_file_version = staticmethod(crud.get_file_version)
+    get_all_files = staticmethod(crud.get_all_files)
+
+    bulk_loader = staticmethod(crud.BulkLoader)
+    flag_near_duplicates = staticmethod(crud.flag_near_duplicates)
+    get_data_records_from_db = staticmethod(crud.get_data_records_from_db)
+    apply_data_edit = staticmethod(crud.apply_data_edit)
+    get_pending_edits = staticmethod(crud.get_pending_edits)
+    get_line_offsets = staticmethod(crud.get_line_offsets)
+    save_line_offsets = staticmethod(crud.save_line_offsets)
+
+    update_data_annotations = staticmethod(crud.update_data_annotations)
+    batch_update_annotations = staticmethod(crud.batch_update_annotations)
+    get_data_stats_from_db = staticmethod(crud.get_data_stats_from_db)
+
+    build_export_query = staticmethod(crud.build_export_query)
+    iter_export_chunks = staticmethod(crud.iter_export_chunks)
+    count_export_rows = staticmethod(crud.count_export_rows)
+
+    lease_records = staticmethod(crud.lease_records)
+    release_leases = staticmethod(crud.release_leases)
+
+    create_job = staticmethod(crud.create_job)
+    get_job = staticmethod(crud.get_job)
+    claim_job = staticmethod(crud.claim_job)
+    list_resumable_jobs = staticmethod(crud.list_resumable_jobs)
+    finish_job = staticmethod(crud.finish_job)
+
+    append_file_events = staticmethod(crud.append_file_events)
+    get_last_file_event_id = staticmethod(crud.get_last_file_event_id)
+    get_file_events_since = staticmethod(crud.get_file_events_since)
+
+    def save_file_info(self, filename: str, original_filename: str, file_size: int, total_records: int,
+                       annotation_type: str = "qa"):
+        crud.save_file_info(filename, original_filename, file_size, total_records, annotation_type)
+        self.file_cache.invalidate(filename)
+
+    def update_file_total_records(self, file_id: int, total_records: int):
+        crud.update_file_total_records(file_id, total_records)
+        # 缓存按文件名索引，按ID修改时清空（很少发生）
+        self.file_cache.invalidate()
+
+    def delete_file_info(self, filename: str):
+        crud.delete_file_info(filename)
+        self.file_cache.invalidate(filename)
+
+    def complete_materialization(self, file_id: int, max_edit_id: int, new_lengths: Dict[int, Tuple[int, int]],
+                                 file_size: int):
+        crud.complete_materialization(file_id, max_edit_id, new_lengths, file_size)
+        self.file_cache.invalidate()
+
+    def update_job_progress(self, job_id: str, owner: str, processed: int, progress: float,
+                            checkpoint: Optional[Dict] = None, loader: Optional[crud.BulkLoader] = None) -> bool:
+        if loader is not None:
+            return crud.update_job_progress(loader.conn.cursor(), job_id, owner, processed, progress, checkpoint)
+        conn = crud.get_connection()
+        with conn:
+            return crud.update_job_progress(conn.cursor(), job_id, owner, processed, progress, checkpoint)
+
+
+def create_repository(backend: str = None, dsn: str = None) -> Repository:
+    """按配置（DATABASE_BACKEND）创建存储后端"""
+    backend = backend or settings.DATABASE_BACKEND
+    if backend == DATABASE_POSTGRES:
+        from backend.core.postgres import PostgresRepository
+
+        return PostgresRepository(dsn or settings.POSTGRES_DSN)
+    if backend != DATABASE_SQLITE:
+        raise ValueError(f"不支持的存储后端: {backend}")
+    return SqliteRepository()
+
+
+@lru_cache
+def get_repository() -> Repository:
+    """当前进程使用的存储后端"""
+    return create_repository()
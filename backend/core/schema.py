@@ -1,6 +1,8 @@
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Union
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from backend.conf import settings
 
 
 class DataUpdateRequest(BaseModel):
@@ -10,12 +12,43 @@ class DataUpdateRequest(BaseModel):
 
 
 class AnnotationRequest(BaseModel):
-    unique_id: str
+    id: Optional[int] = None  # 记录ID（整数主键，优先使用）
+    unique_id: Optional[str] = None
     annotation_result: str
 
+    @property
+    def record_key(self) -> Union[int, str, None]:
+        return self.id if self.id is not None else self.unique_id
+
+
+class BatchAnnotationRequest(BaseModel):
+    filename: str
+    annotations: Optional[List[AnnotationRequest]] = None  # 逐条指定的标注结果
+    # 不传 annotations 时，将符合筛选条件的全部记录标注为 annotation_result
+    annotation_result: Optional[str] = None
+    search: Optional[str] = ""
+    annotation_status: Optional[str] = "all"
+
+
+class LeaseRequest(BaseModel):
+    filename: str
+    session_id: str  # 标注会话标识（由客户端生成，同一会话重复领取时续期并返回已持有的记录）
+    count: int = Field(20, ge=1, le=settings.WORK_QUEUE_MAX_BATCH)  # 当前批次的条数
+    # 同时领取的下一批次条数，默认与 count 相同，0 表示不预取
+    prefetch: Optional[int] = Field(None, ge=0, le=settings.WORK_QUEUE_MAX_BATCH)
+
+
+class LeaseReleaseRequest(BaseModel):
+    filename: str
+    session_id: str
+
 
 class ExportRequest(BaseModel):
     filename: str
     export_name: Optional[str] = "filtered_dataset.jsonl"
     selected_only: Optional[bool] = True
     export_type: Optional[str] = "correct"  # "correct" 或 "incorrect"
+    min_score: Optional[float] = None  # 评分标注：导出 score >= min_score 的数据
+    max_score: Optional[float] = None  # 评分标注：导出 score <= max_score 的数据
+    stream: Optional[bool] = False  # 直接以流式响应返回 JSONL，不在 OUTPUT_FOLDER 中生成文件
+    background: Optional[bool] = False  # 作为后台任务执行，立即返回任务ID
@@ -1,35 +1,388 @@
+import csv
+import gzip
+import io
 import json
-from typing import List, Dict
+import os
+import shutil
+import zlib
+from abc import ABC, abstractmethod
+from typing import List, Dict, Iterator, Tuple, Optional
 
-import aiofiles
+from backend.conf import settings
+from backend.core.mapping import FieldMapping
+from backend.core.records import RAW_LINE_KEY
+from backend.core.repository import get_repository
+from backend.core.storage import COMPACT_INSTALL_HINT
 
-ALLOWED_EXTENSIONS = {"jsonl"}
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = pq = None
+
+# Parquet 依赖的安装方式（pyproject.toml 中的 parquet 可选依赖）
+PARQUET_INSTALL_HINT = "pip install 'annotation-system[parquet]'"
+
+# 支持的上传格式（按文件名后缀识别，压缩格式在前以优先匹配）
+FORMAT_JSONL_GZ = 'jsonl.gz'
+FORMAT_JSONL_ZST = 'jsonl.zst'
+FORMAT_JSONL = 'jsonl'
+FORMAT_PARQUET = 'parquet'
+FORMAT_CSV = 'csv'
+UPLOAD_FORMATS = (FORMAT_JSONL_GZ, FORMAT_JSONL_ZST, FORMAT_JSONL, FORMAT_PARQUET, FORMAT_CSV)
+
+# CSV 单元格可能包含很长的 response，放宽 csv 模块默认 128KB 的字段长度限制
+csv.field_size_limit(2 ** 31 - 1)
+
+
+class RecordDecodeError(ValueError):
+    """上传的文件无法解码（压缩数据截断或损坏、不是合法的 Parquet 文件），无法继续读取后面的记录"""
+
+
+def upload_format(filename: str) -> Optional[str]:
+    """根据文件名识别上传格式，不支持时返回 None"""
+    name = filename.lower()
+    for upload_type in UPLOAD_FORMATS:
+        if name.endswith(f'.{upload_type}'):
+            return upload_type
+    return None
 
 
 def allowed_file(filename: str) -> bool:
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return upload_format(filename) is not None
 
 
-async def read_jsonl_file(file_path: str) -> List[Dict]:
-    """读取JSONL文件并返回数据列表"""
-    data = []
-    try:
-        async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
-            line_num = 1
-            async for line in f:
+def missing_dependency(filename: str) -> Optional[str]:
+    """解析该文件所需但未安装的可选依赖及其安装方式"""
+    upload_type = upload_format(filename)
+    if upload_type == FORMAT_JSONL_ZST and zstandard is None:
+        return f'zstandard（{COMPACT_INSTALL_HINT}）'
+    if upload_type == FORMAT_PARQUET and pq is None:
+        return f'pyarrow（{PARQUET_INSTALL_HINT}）'
+    return None
+
+
+class RecordStreamReader(ABC):
+    """流式记录解析器基类：逐条产出记录，分批写入数据库，内存占用与文件大小无关
+
+    line_number 为已产出的最后一条记录的行号（CSV 为数据行序号，Parquet 为行序号），
+    可作为断点传入 start_line 继续解析（跳过此前的记录）；progress 为已读取的比例，用于任务进度。
+    """
+
+    def __init__(self, file_path: str, max_errors: int = settings.INGEST_MAX_REPORTED_ERRORS,
+                 start_offset: int = 0, start_line: int = 0):
+        self.file_path = file_path
+        self.max_errors = max_errors
+        self.error_count = 0
+        self.errors: List[Dict] = []
+        self.offset = start_offset
+        self.start_line = start_line
+        self.line_number = start_line
+        self.file_size = os.path.getsize(file_path) or 1
+
+    def add_error(self, line_num: int, error: Exception):
+        """记录第 line_num 行的错误（只保留前 max_errors 条详情）"""
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line_number': line_num, 'error': str(error)})
+
+    @property
+    @abstractmethod
+    def progress(self) -> float:
+        ...
+
+    @abstractmethod
+    def __iter__(self) -> Iterator[Dict]:
+        ...
+
+    def iter_batches(self, batch_size: int = settings.INGEST_BATCH_SIZE) -> Iterator[List[Dict]]:
+        """按固定大小分批返回记录"""
+        batch = []
+        for data_item in self:
+            batch.append(data_item)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+class JsonlStreamReader(RecordStreamReader):
+    """流式JSONL解析器，逐行解析
+
+    每条记录附带行号及其在文件中的字节偏移、长度（行偏移索引），以及原始行文本（保留原始记录时免去重新序列化）。
+    offset 记录已产出记录之后的读取位置，可与 line_number 一起作为断点传入 start_offset / start_line 继续解析。
+    """
+
+    # 是否记录行偏移索引（压缩文件中的偏移无法用于写回源文件）
+    record_offsets = True
+
+    def _open(self):
+        """打开解码后的字节流并定位到 offset"""
+        f = open(self.file_path, 'rb')
+        f.seek(self.offset)
+        return f
+
+    @property
+    def progress(self) -> float:
+        return min(self.offset / self.file_size, 1.0)
+
+    def __iter__(self) -> Iterator[Dict]:
+        with self._open() as f:
+            for line in f:
+                byte_offset = self.offset
+                self.offset += len(line)
+                self.line_number += 1
                 line = line.strip()
-                if line:
-                    try:
-                        data_item = json.loads(line)
-                        # 添加元数据
-                        data_item['line_number'] = line_num
-                        data_item['selected'] = False
-                        data_item['annotation_result'] = None
-                        data.append(data_item)
-                    except json.JSONDecodeError as e:
-                        print(f"Error parsing line {line_num}: {e}")
+                if not line:
+                    continue
+                try:
+                    data_item = json.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                    self.add_error(self.line_number, e)
+                    continue
+                if not isinstance(data_item, dict):
+                    self.add_error(self.line_number, ValueError("每行必须是一个JSON对象"))
+                    continue
+                data_item['line_number'] = self.line_number
+                try:
+                    data_item[RAW_LINE_KEY] = line.decode('utf-8')
+                except UnicodeDecodeError:
+                    # 非 UTF-8 编码的 JSON 在保留原始记录时重新序列化
+                    pass
+                if self.record_offsets:
+                    data_item['byte_offset'] = byte_offset
+                    data_item['byte_length'] = self.offset - byte_offset
+                yield data_item
+
+
+class CompressedJsonlReader(JsonlStreamReader):
+    """流式解压并解析 .jsonl.gz / .jsonl.zst
+
+    offset 为解压后数据流中的位置，断点续传时解压并跳过此前的数据；进度按已读取的压缩数据计算。
+    """
+
+    record_offsets = False
+
+    def __init__(self, file_path: str, **kwargs):
+        super().__init__(file_path, **kwargs)
+        self._raw = None
+
+    def _open(self):
+        self._raw = open(self.file_path, 'rb')
+        if upload_format(self.file_path) == FORMAT_JSONL_ZST:
+            decompressor = zstandard.ZstdDecompressor().stream_reader(self._raw, closefd=True)
+            # zstd 解压流只支持向前跳转且不报告 seekable，须在包装为 BufferedReader 之前定位
+            if self.offset:
+                decompressor.seek(self.offset)
+            return io.BufferedReader(decompressor, buffer_size=settings.UPLOAD_CHUNK_SIZE)
+        stream = gzip.GzipFile(fileobj=self._raw, mode='rb')
+        if self.offset:
+            stream.seek(self.offset)
+        return stream
+
+    def __iter__(self) -> Iterator[Dict]:
+        decode_errors = (OSError, EOFError, zlib.error) + ((zstandard.ZstdError,) if zstandard else ())
+        try:
+            yield from super().__iter__()
+        except decode_errors as e:
+            raise RecordDecodeError(f"解压文件失败（第 {self.line_number + 1} 行附近）: {e}") from e
+        finally:
+            self._raw.close()
+
+    @property
+    def progress(self) -> float:
+        if self._raw is None:
+            return 0.0
+        if self._raw.closed:
+            return 1.0
+        return min(self._raw.tell() / self.file_size, 1.0)
+
+
+class CsvStreamReader(RecordStreamReader):
+    """流式CSV解析器：首行为列名，每个数据行转换为 {列名: 值}（带引号的多行单元格按一行数据计）"""
+
+    def __init__(self, file_path: str, **kwargs):
+        super().__init__(file_path, **kwargs)
+        self._raw = None
+
+    @property
+    def progress(self) -> float:
+        if self._raw is None:
+            return 0.0
+        if self._raw.closed:
+            return 1.0
+        return min(self._raw.tell() / self.file_size, 1.0)
+
+    def __iter__(self) -> Iterator[Dict]:
+        with open(self.file_path, 'rb') as self._raw:
+            reader = csv.DictReader(io.TextIOWrapper(self._raw, encoding='utf-8-sig', newline=''))
+            row_number = 0
+            try:
+                for row in reader:
+                    row_number += 1
+                    if row_number <= self.start_line:
                         continue
-                line_num += 1
-    except Exception as e:
-        print(f"Error reading file: {e}")
-    return data
+                    # 多出列名的单元格没有对应字段，丢弃
+                    row.pop(None, None)
+                    row['line_number'] = self.line_number = row_number
+                    yield row
+            except (csv.Error, UnicodeDecodeError) as e:
+                # CSV 格式错误后无法可靠地定位下一行，停止解析
+                self.add_error(row_number + 1, e)
+
+
+class ParquetStreamReader(RecordStreamReader):
+    """按列式批次读取 Parquet 文件，断点续传时跳过已读取的行组"""
+
+    def __init__(self, file_path: str, **kwargs):
+        super().__init__(file_path, **kwargs)
+        self.total_rows = 1
+
+    @property
+    def progress(self) -> float:
+        return min(self.line_number / self.total_rows, 1.0)
+
+    def __iter__(self) -> Iterator[Dict]:
+        try:
+            yield from self._iter_rows()
+        except (pyarrow.ArrowException, OSError) as e:
+            raise RecordDecodeError(f"读取 Parquet 文件失败: {e}") from e
+
+    def _iter_rows(self) -> Iterator[Dict]:
+        parquet_file = pq.ParquetFile(self.file_path)
+        metadata = parquet_file.metadata
+        self.total_rows = metadata.num_rows or 1
+
+        # 从包含断点的行组开始读取
+        row_number = 0
+        first_group = 0
+        while first_group < metadata.num_row_groups and \
+                row_number + metadata.row_group(first_group).num_rows <= self.start_line:
+            row_number += metadata.row_group(first_group).num_rows
+            first_group += 1
+        if first_group >= metadata.num_row_groups:
+            return
+
+        for batch in parquet_file.iter_batches(batch_size=settings.INGEST_BATCH_SIZE,
+                                               row_groups=list(range(first_group, metadata.num_row_groups))):
+            for data_item in batch.to_pylist():
+                row_number += 1
+                if row_number <= self.start_line:
+                    continue
+                data_item['line_number'] = self.line_number = row_number
+                yield data_item
+
+
+_READERS = {
+    FORMAT_JSONL: JsonlStreamReader,
+    FORMAT_JSONL_GZ: CompressedJsonlReader,
+    FORMAT_JSONL_ZST: CompressedJsonlReader,
+    FORMAT_CSV: CsvStreamReader,
+    FORMAT_PARQUET: ParquetStreamReader,
+}
+
+
+def open_record_reader(file_path: str, **kwargs) -> RecordStreamReader:
+    """按文件格式创建流式解析器"""
+    upload_type = upload_format(file_path)
+    if upload_type is None:
+        raise ValueError("不支持的文件格式")
+    return _READERS[upload_type](file_path, **kwargs)
+
+
+def ingest_upload_file(file_id: int, file_path: str, dedup_mode: str = settings.INGEST_DEDUP_MODE,
+                       field_mapping: Optional[FieldMapping] = None) -> Dict:
+    """流式解析上传的文件（JSONL 及其压缩格式、CSV、Parquet）并分批写入数据库，只返回汇总信息
+
+    延迟索引维护时在一个事务中写入，否则每 INGEST_COMMIT_BATCHES 批提交一次，不长时间占用写锁。
+    """
+    reader = open_record_reader(file_path)
+    with get_repository().bulk_loader(file_id, dedup_mode=dedup_mode, field_mapping=field_mapping,
+                                      on_error=reader.add_error) as loader:
+        for batch_index, batch in enumerate(reader.iter_batches(), start=1):
+            loader.add_batch(batch)
+            if not loader.defer_indexes and batch_index % settings.INGEST_COMMIT_BATCHES == 0:
+                loader.commit()
+
+    return {
+        "total_count": loader.inserted,
+        "error_count": reader.error_count,
+        "errors": reader.errors,
+        "duplicate_count": loader.duplicates,
+        "ingest_stats": loader.stats
+    }
+
+
+def iter_line_offsets(file_path: str) -> Iterator[Tuple[int, int, int]]:
+    """扫描文件，返回每一行的 (字节偏移, 字节长度, 行号)"""
+    offset = 0
+    with open(file_path, 'rb') as f:
+        for line_number, line in enumerate(f, start=1):
+            yield offset, len(line), line_number
+            offset += len(line)
+
+
+def _copy_range(src, dst, length: int):
+    """从 src 当前位置复制 length 字节到 dst"""
+    while length > 0:
+        chunk = src.read(min(length, settings.EXPORT_BUFFER_SIZE))
+        if not chunk:
+            break
+        dst.write(chunk)
+        length -= len(chunk)
+
+
+def materialize_file_edits(file_id: int, file_path: str) -> Dict:
+    """将编辑日志合并写回源文件
+
+    借助行偏移索引，未修改的区间按块原样复制，只有被修改的行需要重新序列化。
+    """
+    if upload_format(file_path) != FORMAT_JSONL:
+        raise ValueError("只有 .jsonl 文件支持写回编辑")
+
+    repository = get_repository()
+    max_edit_id, edits = repository.get_pending_edits(file_id)
+    if not edits:
+        return {"materialized_lines": 0, "file_size": os.path.getsize(file_path)}
+
+    line_numbers = sorted(edits)
+    offsets = repository.get_line_offsets(file_id, line_numbers)
+    if any(offsets.get(line_number, (None,))[0] is None for line_number in line_numbers):
+        # 旧数据没有行偏移索引，先扫描一次源文件补建
+        repository.save_line_offsets(file_id, iter_line_offsets(file_path))
+        offsets = repository.get_line_offsets(file_id, line_numbers)
+
+    tmp_path = f"{file_path}.tmp"
+    new_lengths = {}
+    with open(file_path, 'rb') as src, open(tmp_path, 'wb', buffering=settings.EXPORT_BUFFER_SIZE) as dst:
+        position = 0
+        for line_number in line_numbers:
+            byte_offset, byte_length = offsets[line_number]
+            _copy_range(src, dst, byte_offset - position)
+
+            data_item = json.loads(src.read(byte_length))
+            data_item.update(edits[line_number])
+            new_line = (json.dumps(data_item, ensure_ascii=False) + '\n').encode('utf-8')
+            dst.write(new_line)
+
+            new_lengths[line_number] = (byte_length, len(new_line))
+            position = byte_offset + byte_length
+        shutil.copyfileobj(src, dst, settings.EXPORT_BUFFER_SIZE)
+        file_size = dst.tell()
+
+    try:
+        repository.complete_materialization(file_id, max_edit_id, new_lengths, file_size)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    # 行偏移索引提交后再替换源文件：提交失败时源文件保持不变；
+    # 按偏移读取源文件的操作都在写队列中执行，不会在提交与替换之间读到不一致的偏移
+    os.replace(tmp_path, file_path)
+
+    return {"materialized_lines": len(new_lengths), "file_size": file_size}
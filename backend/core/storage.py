@@ -0,0 +1,198 @@
+import functools
+import hashlib
+import sqlite3
+import struct
+import threading
+from typing import Dict, List, Optional, Tuple, Union
+
+from backend.conf import settings
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+STORAGE_PLAIN = 'plain'
+# 重复的 system 提示词驻留在 system_prompts 表，较长的 response 压缩存储
+STORAGE_COMPACT = 'compact'
+STORAGE_MODES = (STORAGE_PLAIN, STORAGE_COMPACT)
+# 压缩依赖的安装方式（pyproject.toml 中的 compact 可选依赖）
+COMPACT_INSTALL_HINT = "pip install 'annotation-system[compact]'"
+
+# 压缩后的 response 以 BLOB 存储：4 字节字典ID（0 表示未使用字典）+ zstd 帧
+_HEADER = struct.Struct('<I')
+
+# 已加载的压缩字典，按 (数据库文件, 字典ID) 缓存：检查命令会切换到临时数据库，不同数据库中的字典ID互不相关
+_dictionaries: Dict[Tuple[str, int], 'zstandard.ZstdCompressionDict'] = {}
+_dictionaries_lock = threading.Lock()
+# 解压器不能在线程间共享，每个线程按 (数据库文件, 字典ID) 各建一个
+_local = threading.local()
+
+
+def compression_available() -> bool:
+    """是否安装了 zstandard（未安装时 compact 模式只驻留 system 提示词，不压缩 response）"""
+    return zstandard is not None
+
+
+def system_text(table: str) -> str:
+    """读取 system 原文的 SQL 表达式（驻留的提示词从 system_prompts 取回）"""
+    return f"COALESCE({table}.system, (SELECT content FROM system_prompts WHERE id = {table}.system_id))"
+
+
+def response_text(table: str) -> str:
+    """读取 response 原文的 SQL 表达式（压缩的 BLOB 由 decompress_text 函数解压）"""
+    return f"decompress_text({table}.response)"
+
+
+def raw_text(table: str) -> str:
+    """读取原始记录（JSON 文本）的 SQL 表达式"""
+    return f"decompress_text({table}.raw)"
+
+
+def _load_dictionary(conn: sqlite3.Connection, database: str,
+                     dictionary_id: int) -> 'zstandard.ZstdCompressionDict':
+    key = (database, dictionary_id)
+    dictionary = _dictionaries.get(key)
+    if dictionary is None:
+        # 在执行 decompress_text 的连接上读取（SQLite 允许在自定义函数中查询），能看到同一事务中刚写入的字典
+        row = conn.execute('SELECT data FROM compression_dictionaries WHERE id = ?', (dictionary_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"压缩字典 {dictionary_id} 不存在")
+        with _dictionaries_lock:
+            dictionary = _dictionaries.setdefault(key, zstandard.ZstdCompressionDict(row[0]))
+    return dictionary
+
+
+def _decompressor(conn: sqlite3.Connection, database: str, dictionary_id: int) -> 'zstandard.ZstdDecompressor':
+    decompressors = getattr(_local, 'decompressors', None)
+    if decompressors is None:
+        decompressors = _local.decompressors = {}
+    key = (database, dictionary_id)
+    decompressor = decompressors.get(key)
+    if decompressor is None:
+        if dictionary_id:
+            decompressor = zstandard.ZstdDecompressor(dict_data=_load_dictionary(conn, database, dictionary_id))
+        else:
+            decompressor = zstandard.ZstdDecompressor()
+        decompressors[key] = decompressor
+    return decompressor
+
+
+def decompress_text(conn: sqlite3.Connection, database: str, value: Union[str, bytes, None]) -> Optional[str]:
+    """还原 response 或原始记录：文本原样返回，压缩的 BLOB 解压（压缩字典从 conn 所连接的 database 中读取）"""
+    if not isinstance(value, bytes):
+        return value
+    if zstandard is None:
+        raise RuntimeError(f"数据库中有压缩存储的记录，需要安装 zstandard（{COMPACT_INSTALL_HINT}）")
+    dictionary_id, = _HEADER.unpack_from(value)
+    return _decompressor(conn, database, dictionary_id).decompress(value[_HEADER.size:]).decode('utf-8')
+
+
+def register_functions(conn: sqlite3.Connection, database: str):
+    """在连接上注册读取压缩存储所需的 SQL 函数（database 为连接的数据库文件）"""
+    conn.create_function('decompress_text', 1, functools.partial(decompress_text, conn, database),
+                         deterministic=True)
+
+
+def train_dictionary(samples: List[bytes]) -> Optional[bytes]:
+    """用样本训练压缩字典，样本不足以训练时返回 None"""
+    try:
+        return zstandard.train_dictionary(settings.COMPRESS_DICT_SIZE, samples).as_bytes()
+    except zstandard.ZstdError:
+        return None
+
+
+class RecordCompactor:
+    """compact 模式下写入记录前的转换：驻留 system 提示词，压缩较长的 response 和原始记录
+
+    每个文件使用一个压缩字典，由该文件最先写入的一批 response 训练得到；
+    继续导入（如断点续传）时沿用文件已有的字典。
+    """
+
+    def __init__(self, conn: sqlite3.Connection, file_id: int):
+        self.conn = conn
+        self.file_id = file_id
+        self.compress = compression_available()
+        self.interned = 0
+        self.compressed = 0
+        self.bytes_saved = 0
+        self._system_ids: Dict[str, int] = {}
+        self._compressor: Optional['zstandard.ZstdCompressor'] = None
+        self._dictionary_id: Optional[int] = None
+        if self.compress:
+            row = conn.execute('''
+                               SELECT id, data
+                               FROM compression_dictionaries
+                               WHERE file_id = ?
+                               ORDER BY id DESC
+                               LIMIT 1
+                               ''', (file_id,)).fetchone()
+            if row:
+                self._use_dictionary(row[0], row[1])
+
+    def _use_dictionary(self, dictionary_id: int, data: Optional[bytes]):
+        self._dictionary_id = dictionary_id
+        if data is None:
+            self._compressor = zstandard.ZstdCompressor(level=settings.COMPRESS_LEVEL)
+            return
+        # 压缩用的字典不放入全局缓存：事务回滚后字典ID可能被其他数据复用，解压时再从数据库读取
+        self._compressor = zstandard.ZstdCompressor(level=settings.COMPRESS_LEVEL,
+                                                    dict_data=zstandard.ZstdCompressionDict(data))
+
+    def _train(self, responses: List[str]):
+        samples = [response.encode('utf-8') for response in responses
+                   if isinstance(response, str) and len(response) >= settings.COMPRESS_MIN_LENGTH]
+        data = train_dictionary(samples[:settings.COMPRESS_DICT_SAMPLES]) if samples else None
+        if data is None:
+            # 样本太少时不使用字典，仍然逐条压缩
+            self._use_dictionary(0, None)
+            return
+        cursor = self.conn.execute('INSERT INTO compression_dictionaries (file_id, data) VALUES (?, ?)',
+                                   (self.file_id, data))
+        self._use_dictionary(cursor.lastrowid, data)
+
+    def intern_system(self, system: Optional[str]) -> Optional[int]:
+        """返回驻留的 system 提示词ID，过短的提示词不驻留（返回 None）"""
+        if not system or len(system) < settings.STORAGE_INTERN_MIN_LENGTH:
+            return None
+        digest = hashlib.blake2b(system.encode('utf-8'), digest_size=16).hexdigest()
+        system_id = self._system_ids.get(digest)
+        if system_id is None:
+            self.conn.execute('INSERT OR IGNORE INTO system_prompts (content_hash, content) VALUES (?, ?)',
+                              (digest, system))
+            system_id = self.conn.execute('SELECT id FROM system_prompts WHERE content_hash = ?',
+                                          (digest,)).fetchone()[0]
+            self._system_ids[digest] = system_id
+        self.interned += 1
+        return system_id
+
+    def compress_text(self, text: Optional[str]) -> Union[str, bytes, None]:
+        """压缩 response 或原始记录，压缩后不更短的保持原文"""
+        if not self.compress or not isinstance(text, str) or len(text) < settings.COMPRESS_MIN_LENGTH:
+            return text
+        data = text.encode('utf-8')
+        compressed = _HEADER.pack(self._dictionary_id) + self._compressor.compress(data)
+        if len(compressed) >= len(data):
+            return text
+        self.compressed += 1
+        self.bytes_saved += len(data) - len(compressed)
+        return compressed
+
+    def compact_values(self, system: Optional[str], response: Optional[str], raw: Optional[str]) \
+            -> Tuple[Optional[str], Optional[int], Union[str, bytes, None], Union[str, bytes, None]]:
+        """返回写入的 (system, system_id, response, raw)"""
+        system_id = self.intern_system(system)
+        return (None if system_id else system), system_id, self.compress_text(response), self.compress_text(raw)
+
+    def prepare(self, responses: List[str]):
+        """写入一批记录前调用：首次写入时训练压缩字典"""
+        if self.compress and self._compressor is None:
+            self._train(responses)
+
+    @property
+    def stats(self) -> Dict:
+        return {
+            "interned_system_count": self.interned,
+            "compressed_text_count": self.compressed,
+            "compressed_bytes_saved": self.bytes_saved
+        }
@@ -0,0 +1,387 @@
+import json
+import os
+import random
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from backend.core import db
+from backend.core.dedup import DEDUP_LINK, DEDUP_SKIP
+from backend.core.records import make_unique_id
+from backend.core.repository import Repository, DATABASE_SQLITE, create_repository
+
+# 并发标注检查的线程数（模拟多个工作进程或节点同时写入）
+_CONCURRENT_WRITERS = 8
+
+
+def _sample_records(count: int) -> List[Dict]:
+    return [{
+        'line_number': line_number,
+        'system': 'system prompt' if line_number % 2 else '系统提示词',
+        'query': f'question {line_number}' if line_number % 3 else f'问题 {line_number} 关于数据集',
+        'response': f'answer {line_number} ' * 8,
+    } for line_number in range(1, count + 1)]
+
+
+# 近似重复检查的样例：{副本行号: (原记录行号, 对原记录 response 的修改)}，其余行互不相似
+_NEAR_DUPLICATE_ROWS = 20
+_NEAR_DUPLICATE_COPIES = {
+    21: (3, lambda text: text.rsplit(' ', 1)[0] + ' 0000ffff'),
+    22: (10, lambda text: text + ' appended'),
+    23: (17, lambda text: text.upper()),
+}
+
+
+def _near_duplicate_records() -> List[Dict]:
+    generator = random.Random(0)
+    responses = {line_number: ' '.join(f'{generator.getrandbits(32):08x}' for _ in range(40))
+                 for line_number in range(1, _NEAR_DUPLICATE_ROWS + 1)}
+    for line_number, (original, modify) in _NEAR_DUPLICATE_COPIES.items():
+        responses[line_number] = modify(responses[original])
+    return [{'line_number': line_number, 'system': 'system prompt', 'query': 'question', 'response': response}
+            for line_number, response in responses.items()]
+
+
+class StorageCheckError(Exception):
+    """存储后端的行为与预期不一致"""
+
+
+def _expect(condition: bool, message: str):
+    if not condition:
+        raise StorageCheckError(message)
+
+
+class _StorageChecks:
+    """在同一组样例文件上依次执行的检查，各项检查依赖前面检查写入的数据"""
+
+    def __init__(self, repository: Repository, rows_per_file: int):
+        self.repository = repository
+        self.rows = rows_per_file
+        self.prefix = f'storage_check_{uuid.uuid4().hex[:8]}'
+        self.files: Dict[str, int] = {}
+
+    def _create_file(self, name: str, annotation_type: str = 'qa') -> int:
+        filename = f'{self.prefix}_{name}.jsonl'
+        self.repository.save_file_info(filename, filename, 0, self.rows, annotation_type)
+        file_id = self.repository.get_file_info(filename)['id']
+        self.files[filename] = file_id
+        return file_id
+
+    def _load(self, file_id: int, **kwargs) -> Dict:
+        with self.repository.bulk_loader(file_id, **kwargs) as loader:
+            for start in range(0, self.rows, 1000):
+                loader.add_batch(_sample_records(self.rows)[start:start + 1000])
+        return loader.stats
+
+    def _stats(self, file_id: int) -> Dict:
+        return self.repository.get_data_stats_from_db(file_id)
+
+    def ingest(self) -> str:
+        self.qa_id = self._create_file('qa')
+        stats = self._load(self.qa_id)
+        _expect(stats['inserted'] == self.rows, f"写入 {stats['inserted']} 条，应为 {self.rows}")
+        _expect(self._stats(self.qa_id)['total_count'] == self.rows, "统计总数与写入条数不一致")
+        self.scoring_id = self._create_file('scoring', 'scoring')
+        self._load(self.scoring_id)
+        return f"{stats['rows_per_second']} 行/秒"
+
+    def annotate(self) -> str:
+        results = self.repository.update_data_annotations([
+            (make_unique_id(self.qa_id, 1), 'correct'),
+            (make_unique_id(self.qa_id, 2), 'incorrect'),
+            ('missing', 'correct'),
+        ])
+        _expect(results[0] is not None and results[0]['line_number'] == 1, "按 unique_id 标注失败")
+        _expect(results[2] is None, "不存在的记录应返回 None")
+        _expect(self.repository.update_data_annotation(results[1]['id'], 'correct'), "按记录ID标注失败")
+        stats = self._stats(self.qa_id)
+        _expect((stats['correct_count'], stats['incorrect_count']) == (2, 0),
+                f"统计计数 {stats['correct_count']}/{stats['incorrect_count']}，应为 2/0")
+        return ''
+
+    def batch_annotate(self) -> str:
+        result = self.repository.batch_update_annotations(
+            self.qa_id, [(make_unique_id(self.qa_id, 3), 'incorrect'), ('missing', 'correct')])
+        _expect(result['updated_count'] == 1 and result['missing'] == ['missing'], f"按记录批量标注结果 {result}")
+
+        result = self.repository.batch_update_annotations(self.qa_id, annotation_result='incorrect',
+                                                          search='answer 1', annotation_status='not_annotated')
+        expected = sum(1 for line_number in range(4, self.rows + 1) if str(line_number).startswith('1'))
+        _expect(result['updated_count'] == expected,
+                f"按筛选条件标注 {result['updated_count']} 条，应为 {expected}")
+        stats = self._stats(self.qa_id)
+        _expect(stats['incorrect_count'] == 1 + expected, f"错误计数 {stats['incorrect_count']}，应为 {1 + expected}")
+        return ''
+
+    def scoring(self) -> str:
+        self.repository.batch_update_annotations(self.scoring_id, annotation_result='5', annotation_status='all')
+        self.repository.update_data_annotations([(make_unique_id(self.scoring_id, 1), '2'),
+                                                 (make_unique_id(self.scoring_id, 2), '3.5')])
+        stats = self._stats(self.scoring_id)
+        _expect((stats['correct_count'], stats['incorrect_count']) == (self.rows - 2, 2),
+                f"评分计数 {stats['correct_count']}/{stats['incorrect_count']}")
+        _expect(stats['score_distribution'] == {'2': 1, '3.5': 1, '5': self.rows - 2},
+                f"分数分布 {stats['score_distribution']}")
+        return ''
+
+    def pagination(self) -> str:
+        pages = 0
+        seen = []
+        page = self.repository.get_data_records_from_db(self.qa_id, per_page=50)
+        _expect(page['total_count'] == self.rows, f"总数 {page['total_count']}，应为 {self.rows}")
+        while True:
+            pages += 1
+            seen.extend(item['line_number'] for item in page['data'])
+            if not page['next_cursor']:
+                break
+            page = self.repository.get_data_records_from_db(self.qa_id, per_page=50, cursor=page['next_cursor'],
+                                                            skip_count=True)
+        _expect(seen == list(range(1, self.rows + 1)), "游标分页遗漏或重复记录")
+
+        offset_page = self.repository.get_data_records_from_db(self.qa_id, page=3, per_page=50)
+        _expect([item['line_number'] for item in offset_page['data']] == seen[100:150], "OFFSET 分页与游标分页不一致")
+
+        annotated = self.repository.get_data_records_from_db(self.qa_id, annotation_status='annotated', per_page=10)
+        not_annotated = self.repository.get_data_records_from_db(self.qa_id, annotation_status='not_annotated',
+                                                                 per_page=10)
+        _expect(annotated['total_count'] + not_annotated['total_count'] == self.rows, "标注状态筛选的总数不一致")
+        return f"{pages} 页"
+
+    def search(self) -> str:
+        cases = {
+            'answer 12': sum(1 for n in range(1, self.rows + 1) if str(n).startswith('12')),
+            'ANSWER 7 ': sum(1 for n in range(1, self.rows + 1) if n == 7),
+            '关于数据集': sum(1 for n in range(1, self.rows + 1) if n % 3 == 0),
+            '系统提示词': self.rows // 2,
+            'an': self.rows,
+            # LIKE 的通配符按字面匹配
+            '%': 0,
+            '_': 0,
+            'answer%1': 0,
+        }
+        for search, expected in cases.items():
+            page = self.repository.get_data_records_from_db(self.qa_id, search=search, per_page=10)
+            _expect(page['total_count'] == expected, f"搜索 {search!r} 得到 {page['total_count']} 条，应为 {expected}")
+            if page['data'] and len(search) >= 3:
+                _expect(any(item.get('highlight') for item in page['data']), f"搜索 {search!r} 没有高亮片段")
+        if not self.repository.search_indexed():
+            return '关键词检索没有索引，逐条匹配'
+        return ''
+
+    def dedup(self) -> str:
+        linked_id = self._create_file('linked')
+        stats = self._load(linked_id, defer_indexes=False, dedup_mode=DEDUP_LINK)
+        _expect(stats['duplicates'] == self.rows, f"关联重复记录 {stats['duplicates']} 条，应为 {self.rows}")
+        annotated = self.repository.get_data_records_from_db(linked_id, annotation_status='annotated', per_page=1)
+        _expect(stats['labels_carried_over'] == annotated['total_count'] > 0, "重复记录未继承已有标注")
+
+        # 标注原记录后同步到关联的重复记录
+        result = self.repository.update_data_annotations([(make_unique_id(self.qa_id, 4), 'correct')])[0]
+        _expect(result['linked_file_ids'] == [linked_id], f"标注未同步到重复记录: {result['linked_file_ids']}")
+
+        skipped_id = self._create_file('skipped')
+        stats = self._load(skipped_id, dedup_mode=DEDUP_SKIP)
+        _expect((stats['inserted'], stats['duplicates']) == (0, self.rows),
+                f"跳过重复记录：写入 {stats['inserted']} 条，跳过 {stats['duplicates']} 条")
+        return ''
+
+    def near_duplicates(self) -> str:
+        # 样例中已知的近似重复副本必须恰好关联到各自的原记录，其他记录不被标记
+        near_id = self._create_file('near')
+        with self.repository.bulk_loader(near_id) as loader:
+            loader.add_batch(_near_duplicate_records())
+        count = self.repository.flag_near_duplicates(near_id)
+        records = self.repository.get_data_records_from_db(near_id, per_page=100)['data']
+        ids = {record['id']: record['line_number'] for record in records}
+        links = {record['line_number']: ids.get(record['near_duplicate_of'])
+                 for record in records if record['near_duplicate_of'] is not None}
+        expected = {line_number: original for line_number, (original, _) in _NEAR_DUPLICATE_COPIES.items()}
+        _expect(links == expected, f"近似重复关联 {links}，应为 {expected}")
+        _expect(count == len(expected), f"近似重复 {count} 条，应为 {len(expected)}")
+        return f"{count} 条"
+
+    def concurrent_annotations(self) -> str:
+        # 多个线程交替修改同一批记录，完成后计数器必须与全量统计一致
+        def annotate(worker: int):
+            for line_number in range(1, self.rows + 1, _CONCURRENT_WRITERS):
+                result = 'correct' if (line_number + worker) % 2 else 'incorrect'
+                self.repository.update_data_annotations([(make_unique_id(self.qa_id, line_number), result)])
+
+        with ThreadPoolExecutor(max_workers=_CONCURRENT_WRITERS) as executor:
+            list(executor.map(annotate, range(_CONCURRENT_WRITERS)))
+        mismatches = [item for item in self.repository.check_file_stats() if item['file_id'] in self.files.values()]
+        _expect(not mismatches, f"计数器与全量统计不一致: {mismatches}")
+        writes = _CONCURRENT_WRITERS * len(range(1, self.rows + 1, _CONCURRENT_WRITERS))
+        return f"{writes} 次写入"
+
+    def export(self) -> str:
+        query, params = self.repository.build_export_query(self.qa_id, 'correct')
+        expected = self.repository.count_export_rows(query, params)
+        lines = b''.join(chunk for chunk, _ in self.repository.iter_export_chunks(query, params, fetch_size=100))
+        records = [json.loads(line) for line in lines.splitlines()]
+        _expect(len(records) == expected == self._stats(self.qa_id)['correct_count'],
+                f"导出 {len(records)} 条，计数 {expected} 条")
+
+        query, params = self.repository.build_export_query(self.scoring_id, 'correct', min_score=3, max_score=4)
+        _expect(self.repository.count_export_rows(query, params) == 1, "按分数区间导出的条数不正确")
+        return f"{len(records)} 条"
+
+    def edit(self) -> str:
+        _expect(self.repository.apply_data_edit(self.qa_id, 5, {'query': 'edited query', 'extra': 1}), "编辑失败")
+        _expect(not self.repository.apply_data_edit(self.qa_id, self.rows + 1, {'query': 'x'}), "编辑不存在的行应返回 False")
+        max_edit_id, edits = self.repository.get_pending_edits(self.qa_id)
+        _expect(max_edit_id > 0 and edits == {5: {'query': 'edited query', 'extra': 1}}, f"编辑日志 {edits}")
+        page = self.repository.get_data_records_from_db(self.qa_id, search='edited query', per_page=1)
+        _expect(page['total_count'] == 1, "编辑后的内容无法检索")
+
+        self.repository.save_line_offsets(self.qa_id, iter((line_number * 10, 10, line_number)
+                                                           for line_number in range(1, self.rows + 1)))
+        self.repository.complete_materialization(self.qa_id, max_edit_id, {5: (10, 15)}, self.rows * 10 + 5)
+        offsets = self.repository.get_line_offsets(self.qa_id, [5, 6])
+        _expect(offsets == {5: (50, 15), 6: (65, 10)}, f"物化后的行偏移 {offsets}")
+        _expect(self.repository.get_pending_edits(self.qa_id)[1] == {}, "物化后仍有未处理的编辑")
+        return ''
+
+    def jobs(self) -> str:
+        job_id = self.repository.create_job('check', {'file_id': self.qa_id})
+        _expect(self.repository.get_job(job_id)['status'] == 'pending', "新任务状态应为 pending")
+        job = self.repository.claim_job(job_id, 'worker-a', time.time() - 60)
+        _expect(job is not None and job['status'] == 'running', "认领任务失败")
+        _expect(self.repository.claim_job(job_id, 'worker-b', time.time() - 60) is None, "执行中的任务被重复认领")
+        _expect(self.repository.update_job_progress(job_id, 'worker-a', 10, 0.5, {'offset': 1}), "更新进度失败")
+        _expect(not self.repository.update_job_progress(job_id, 'worker-b', 10, 0.5), "其他进程不应能更新任务进度")
+        self.repository.finish_job(job_id, 'worker-a', 'completed', result={'ok': True})
+        job = self.repository.get_job(job_id)
+        _expect((job['status'], job['progress'], job['checkpoint'], job['result']) ==
+                ('completed', 1, {'offset': 1}, {'ok': True}), f"任务状态 {job}")
+        return ''
+
+    def events(self) -> str:
+        last_id = self.repository.get_last_file_event_id()
+        self.repository.append_file_events('worker-a', [(self.qa_id, {'type': 'annotation', 'id': 1})],
+                                           time.time() - 60)
+        self.repository.append_file_events('worker-b', [(self.qa_id, {'type': 'edit', 'id': 2})], time.time() - 60)
+        new_last_id, events = self.repository.get_file_events_since(last_id, 'worker-a')
+        _expect(new_last_id > last_id and events == [(self.qa_id, {'type': 'edit', 'id': 2})],
+                f"转发事件 {events}")
+        return ''
+
+    def work_queue(self) -> str:
+        queue_id = self._create_file('queue')
+        self._load(queue_id)
+
+        def lines(records: List[Dict]) -> List[int]:
+            return [item['line_number'] for item in records]
+
+        first = self.repository.lease_records(queue_id, 'session-a', 5, 5, 60)
+        other = self.repository.lease_records(queue_id, 'session-b', 5, 5, 60)
+        _expect((lines(first['records']), lines(first['prefetch'])) == ([1, 2, 3, 4, 5], [6, 7, 8, 9, 10]),
+                f"领取 {lines(first['records'])} / {lines(first['prefetch'])}")
+        _expect(lines(other['records'] + other['prefetch']) == list(range(11, 21)),
+                f"其他会话领取 {lines(other['records'] + other['prefetch'])}")
+
+        # 标注完当前批次后再次领取：上次预取的成为当前批次，并预取新的一批
+        self.repository.batch_update_annotations(queue_id, [(item['id'], 'correct') for item in first['records']])
+        second = self.repository.lease_records(queue_id, 'session-a', 5, 5, 60)
+        _expect((lines(second['records']), lines(second['prefetch'])) == ([6, 7, 8, 9, 10], [21, 22, 23, 24, 25]),
+                f"再次领取 {lines(second['records'])} / {lines(second['prefetch'])}")
+
+        # 释放及过期的记录重新进入队列
+        _expect(self.repository.release_leases(queue_id, 'session-b') == 10, "释放的条数不正确")
+        self.repository.lease_records(queue_id, 'session-c', 3, 0, -1)
+        reclaimed = self.repository.lease_records(queue_id, 'session-d', 10, 3, 60)
+        _expect(lines(reclaimed['records'] + reclaimed['prefetch']) == list(range(11, 21)) + [26, 27, 28],
+                f"释放及过期后领取 {lines(reclaimed['records'] + reclaimed['prefetch'])}")
+
+        # 多个会话并发领取，领取到的记录互不重复
+        def lease(index: int) -> List[int]:
+            batch = self.repository.lease_records(queue_id, f'session-concurrent-{index}', 5, 5, 60)
+            return lines(batch['records'] + batch['prefetch'])
+
+        with ThreadPoolExecutor(_CONCURRENT_WRITERS) as executor:
+            leased = [line_number for batch in executor.map(lease, range(_CONCURRENT_WRITERS))
+                      for line_number in batch]
+        _expect(len(leased) == len(set(leased)) and not set(leased) & set(range(1, 29)),
+                f"并发领取到重复的记录: {sorted(leased)}")
+        return f"{_CONCURRENT_WRITERS} 个会话并发领取 {len(leased)} 条"
+
+    def file_version(self) -> str:
+        # 标注、编辑和近似重复标记都会使版本号递增，只读操作不会
+        versions = [self.repository.get_file_version(self.qa_id)]
+        self.repository.get_data_records_from_db(self.qa_id, per_page=10)
+        self.repository.get_data_stats_from_db(self.qa_id)
+        versions.append(self.repository.get_file_version(self.qa_id))
+        self.repository.update_data_annotations([(make_unique_id(self.qa_id, 6), 'correct')])
+        versions.append(self.repository.get_file_version(self.qa_id))
+        self.repository.apply_data_edit(self.qa_id, 6, {'response': 'edited response'})
+        versions.append(self.repository.get_file_version(self.qa_id))
+        self.repository.flag_near_duplicates(self.qa_id)
+        versions.append(self.repository.get_file_version(self.qa_id))
+        _expect(versions[0] > 0 and versions[1] == versions[0] and versions[1] < versions[2] < versions[3] < versions[4],
+                f"版本号变化 {versions}")
+        return ''
+
+    def stats_consistency(self) -> str:
+        mismatches = [item for item in self.repository.check_file_stats() if item['file_id'] in self.files.values()]
+        _expect(not mismatches, f"计数器与全量统计不一致: {mismatches}")
+        _expect(self.repository.rebuild_file_stats(self.qa_id) == 1, "重建统计失败")
+        return ''
+
+    def cleanup(self):
+        for filename in self.files:
+            self.repository.delete_file_info(filename)
+        _expect(all(self.repository.get_file_info(filename)['status'] == 'deleted' for filename in self.files),
+                "删除文件失败")
+
+    CHECKS = ('ingest', 'annotate', 'batch_annotate', 'scoring', 'pagination', 'search', 'dedup', 'near_duplicates',
+              'concurrent_annotations', 'export', 'edit', 'jobs', 'events', 'work_queue', 'file_version',
+              'stats_consistency', 'cleanup')
+
+
+def _run_checks(repository: Repository, rows_per_file: int, on_check: Optional[Callable[[Dict], None]]) -> List[Dict]:
+    checks = _StorageChecks(repository, rows_per_file)
+    results = []
+    for name in _StorageChecks.CHECKS:
+        started = time.perf_counter()
+        try:
+            detail = getattr(checks, name)() or ''
+            ok = True
+        except Exception as e:
+            detail = str(e) if isinstance(e, StorageCheckError) else f'{type(e).__name__}: {e}'
+            ok = False
+        result = {'name': name, 'ok': ok, 'elapsed': time.perf_counter() - started, 'detail': detail}
+        results.append(result)
+        if on_check:
+            on_check(result)
+        if not ok and name == 'ingest':
+            # 样例数据没有写入，后续检查没有意义
+            break
+    return results
+
+
+def check_storage(backend: str, dsn: Optional[str] = None, rows_per_file: int = 2000,
+                  on_check: Callable[[Dict], None] = None) -> List[Dict]:
+    """对存储后端执行一致性检查并计时，各后端对同一组操作应得到相同的结果
+
+    SQLite 在临时数据库中执行；PostgreSQL 在 dsn 指定的数据库中建表并写入样例文件（完成后标记删除），
+    请使用专门用于检查的数据库。返回 [{name, ok, elapsed, detail}]。
+    """
+    if backend != DATABASE_SQLITE:
+        repository = create_repository(backend, dsn)
+        try:
+            repository.initialize()
+            return _run_checks(repository, rows_per_file, on_check)
+        finally:
+            repository.close()
+
+    original_database = db.DATABASE_FILE
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db.switch_database(os.path.join(tmpdir, 'storage_check.db'))
+        try:
+            repository = create_repository(backend)
+            repository.initialize()
+            return _run_checks(repository, rows_per_file, on_check)
+        finally:
+            db.switch_database(original_database)
@@ -0,0 +1,254 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from backend.core import db
+
+# 模拟的标注者人数，每人每次标注后停顿 _ANNOTATOR_PAUSE 秒
+_ANNOTATORS = 4
+_ANNOTATOR_PAUSE = 0.01
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def _write_sample_file(path: str, rows: int):
+    with open(path, 'w', encoding='utf-8') as f:
+        for line_number in range(1, rows + 1):
+            f.write(json.dumps({
+                'system': 'system prompt',
+                'query': f'question {line_number}',
+                'response': f'answer {line_number} ' * 20,
+            }, ensure_ascii=False) + '\n')
+
+
+async def _annotate_while(client, file_id: int, rows: int, background: Optional[Callable]) -> Dict:
+    """多个标注者持续调用 /api/annotate，直到 background 完成（为 None 时持续 1 秒），返回延迟统计"""
+    latencies = []
+    errors = 0
+    done = asyncio.Event()
+
+    async def annotator():
+        nonlocal errors
+        while not done.is_set():
+            line_number = random.randint(1, rows)
+            started = time.perf_counter()
+            response = await client.post('/api/annotate', json={
+                'unique_id': f'{file_id}_{line_number}',
+                'annotation_result': random.choice(('correct', 'incorrect'))
+            })
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors += 1
+            await asyncio.sleep(_ANNOTATOR_PAUSE)
+
+    tasks = [asyncio.create_task(annotator()) for _ in range(_ANNOTATORS)]
+    started = time.perf_counter()
+    try:
+        if background is None:
+            await asyncio.sleep(1)
+        else:
+            await background()
+    finally:
+        done.set()
+        await asyncio.gather(*tasks)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'elapsed': time.perf_counter() - started,
+        'p50_ms': _percentile(latencies, 50) * 1000,
+        'p99_ms': _percentile(latencies, 99) * 1000,
+        'max_ms': max(latencies, default=0) * 1000,
+    }
+
+
+async def _run_phases(app_module, tmpdir: str, rows: int, on_phase: Optional[Callable[[Dict], None]]) -> List[Dict]:
+    import httpx
+
+    transport = httpx.ASGITransport(app=app_module.app)
+    results = []
+
+    async with httpx.AsyncClient(transport=transport, base_url='http://loadcheck', timeout=None) as client:
+        async def upload(name: str) -> Dict:
+            path = os.path.join(tmpdir, name)
+            with open(path, 'rb') as f:
+                response = await client.post('/api/upload', files={'file': (name, f)})
+            response.raise_for_status()
+            return response.json()
+
+        # 样例文件在测量前生成，避免写文件阻塞事件循环而计入标注延迟
+        for name in ('latency_seed.jsonl', 'latency_import.jsonl'):
+            _write_sample_file(os.path.join(tmpdir, name), rows)
+
+        # 样例数据：全部标注为 correct，使导出的数据量与文件大小相当
+        seed = await upload('latency_seed.jsonl')
+        file_id = (await client.get(f"/api/file/{seed['filename']}")).json()['file_info']['id']
+        await client.post('/api/annotate/batch', json={'filename': seed['filename'], 'annotation_result': 'correct'})
+
+        async def export():
+            async with client.stream('POST', '/api/export', json={
+                'filename': seed['filename'], 'export_type': 'correct', 'selected_only': False, 'stream': True
+            }) as response:
+                async for _ in response.aiter_bytes():
+                    pass
+
+        async def ingest():
+            await upload('latency_import.jsonl')
+
+        for name, background in (('baseline', None), ('export', export), ('import', ingest)):
+            result = {'name': name, **await _annotate_while(client, file_id, rows, background)}
+            results.append(result)
+            if on_phase:
+                on_phase(result)
+    return results
+
+
+async def check_annotate_latency(rows: int = 200000, on_phase: Callable[[Dict], None] = None) -> List[Dict]:
+    """在临时数据库中测量 /api/annotate 的延迟：空闲时、流式导出 rows 条记录期间、上传导入 rows 条记录期间
+
+    经 ASGI 直接调用应用（不经网络），读写线程池与线上一致。
+    返回各阶段的 [{name, requests, errors, elapsed, p50_ms, p99_ms, max_ms}]。
+    """
+    original_database = db.DATABASE_FILE
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db.switch_database(os.path.join(tmpdir, 'loadcheck.db'))
+        from backend import main as app_module
+        from backend.core.repository import get_repository
+
+        original_upload_folder = app_module.UPLOAD_FOLDER
+        app_module.UPLOAD_FOLDER = tmpdir
+        try:
+            get_repository().initialize()
+            return await _run_phases(app_module, tmpdir, rows, on_phase)
+        finally:
+            app_module.UPLOAD_FOLDER = original_upload_folder
+            db.switch_database(original_database)
+
+
+def _worker_process(database_file: str, file_id: int, rows: int, duration: float, results):
+    """模拟一个工作进程：写线程逐条提交标注（与写队列一样遇到 SQLITE_BUSY 时退避重试），读线程持续分页查询"""
+    db.switch_database(database_file)
+    from backend.core import crud
+
+    counts = {'annotations': 0, 'reads': 0, 'errors': 0}
+    deadline = time.monotonic() + duration
+
+    def annotate():
+        while time.monotonic() < deadline:
+            line_number = random.randint(1, rows)
+            try:
+                db.retry_on_busy(crud.update_data_annotations,
+                                 [(f'{file_id}_{line_number}', random.choice(('correct', 'incorrect')))])
+                counts['annotations'] += 1
+            except Exception:
+                counts['errors'] += 1
+
+    def read():
+        while time.monotonic() < deadline:
+            try:
+                crud.get_data_records_from_db(file_id, page=random.randint(1, max(1, rows // 20)), skip_count=True)
+                counts['reads'] += 1
+            except Exception:
+                counts['errors'] += 1
+
+    threads = [threading.Thread(target=annotate), threading.Thread(target=read)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put(counts)
+
+
+def _import_process(database_file: str, file_id: int, path: str, results):
+    """在独立进程中导入文件（与工作进程中的上传导入相同的分段提交路径）"""
+    db.switch_database(database_file)
+    from backend.core.service import ingest_upload_file
+
+    try:
+        results.put(ingest_upload_file(file_id, path))
+    except Exception as e:
+        results.put({'error': str(e)})
+
+
+def _create_file(filename: str, path: str, rows: int) -> int:
+    from backend.core import crud
+
+    _write_sample_file(path, rows)
+    crud.save_file_info(filename, filename, os.path.getsize(path), 0)
+    return crud.get_file_info(filename)['id']
+
+
+def check_worker_scaling(worker_counts: List[int], rows: int = 50000, duration: float = 5.0,
+                         import_rows: int = 0, on_round: Callable[[Dict], None] = None) -> List[Dict]:
+    """在临时 SQLite 数据库中测量不同工作进程数下标注写入和分页读取的总吞吐量
+
+    每个工作进程各有一个写线程和一个读线程，直接调用存储层（不经 HTTP，避免压测客户端成为瓶颈）；
+    import_rows 大于 0 时每轮同时在另一个进程中导入该数量的记录，用于确认导入期间的写入不会因写锁失败。
+    返回各轮的 [{workers, annotations_per_second, reads_per_second, errors, import_seconds}]。
+    """
+    from backend.core import crud
+    from backend.core.service import ingest_upload_file
+
+    context = multiprocessing.get_context('spawn')
+    original_database = db.DATABASE_FILE
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db.switch_database(os.path.join(tmpdir, 'scaling.db'))
+        try:
+            db.init_database()
+            crud.ensure_file_stats()
+            file_id = _create_file('scaling_seed.jsonl', os.path.join(tmpdir, 'scaling_seed.jsonl'), rows)
+            ingest_upload_file(file_id, os.path.join(tmpdir, 'scaling_seed.jsonl'))
+
+            for round_index, workers in enumerate(worker_counts):
+                queue = context.Queue()
+                processes = [context.Process(target=_worker_process,
+                                             args=(db.DATABASE_FILE, file_id, rows, duration, queue))
+                             for _ in range(workers)]
+                if import_rows:
+                    name = f'scaling_import_{round_index}.jsonl'
+                    import_file_id = _create_file(name, os.path.join(tmpdir, name), import_rows)
+                    import_queue = context.Queue()
+                    importer = context.Process(target=_import_process,
+                                               args=(db.DATABASE_FILE, import_file_id, os.path.join(tmpdir, name),
+                                                     import_queue))
+                started = time.monotonic()
+                for process in processes:
+                    process.start()
+                if import_rows:
+                    importer.start()
+                # 各工作进程在完成导入模块后才开始计时，吞吐量按 duration 计算
+                counts = [queue.get() for _ in processes]
+                import_seconds = None
+                if import_rows:
+                    summary = import_queue.get()
+                    import_seconds = time.monotonic() - started
+                    importer.join()
+                    if 'error' in summary:
+                        raise RuntimeError(f"导入失败: {summary['error']}")
+                for process in processes:
+                    process.join()
+
+                result = {
+                    'workers': workers,
+                    'annotations_per_second': sum(count['annotations'] for count in counts) / duration,
+                    'reads_per_second': sum(count['reads'] for count in counts) / duration,
+                    'errors': sum(count['errors'] for count in counts),
+                    'import_seconds': import_seconds,
+                }
+                results.append(result)
+                if on_round:
+                    on_round(result)
+        finally:
+            db.switch_database(original_database)
+    return results
@@ -0,0 +1,146 @@
+import os
+import re
+import tempfile
+from typing import List, Dict, Callable
+
+from backend.core import db
+from backend.core.dedup import DEDUP_LINK
+from backend.core.records import make_unique_id
+from backend.core.storage import STORAGE_COMPACT
+
+# 查询计划中出现这些步骤即视为退化：全表/全索引扫描，或需要临时 B 树排序、分组
+# （全文索引虚拟表和子查询结果的扫描除外）
+_SCAN = re.compile(r'^SCAN (?!\S+ VIRTUAL TABLE|\(subquery)')
+_TEMP_BTREE = 'USE TEMP B-TREE'
+
+# 只检查读写数据记录的语句，不检查建表、事务控制和插入
+_CHECKED_STATEMENT = re.compile(r'^\s*(SELECT|UPDATE|DELETE)\b.*'
+                                r'\b(data_records|data_edits|file_stats|file_score_histogram|record_leases)\b',
+                                re.IGNORECASE | re.DOTALL)
+
+
+def _sample_records(count: int) -> List[Dict]:
+    return [{
+        'line_number': line_number,
+        'system': 'system prompt',
+        'query': f'question {line_number}',
+        'response': f'answer {line_number} ' * 8,
+    } for line_number in range(1, count + 1)]
+
+
+def _run_workload(rows_per_file: int) -> None:
+    """在样例数据上执行各类读写操作（查询形状与线上一致）"""
+    from backend.core import crud
+
+    files = {}
+    for annotation_type in ('qa', 'scoring'):
+        filename = f'plan_check_{annotation_type}.jsonl'
+        crud.save_file_info(filename, filename, 0, rows_per_file, annotation_type)
+        file_id = crud.get_file_info(filename)['id']
+        with crud.BulkLoader(file_id) as loader:
+            loader.add_batch(_sample_records(rows_per_file))
+        files[annotation_type] = file_id
+
+    qa_id, scoring_id = files['qa'], files['scoring']
+
+    # 去重：按内容哈希关联到已有记录（压缩存储），标注同步到重复记录，近似重复检测
+    crud.save_file_info('plan_check_duplicates.jsonl', 'plan_check_duplicates.jsonl', 0, rows_per_file, 'qa')
+    duplicates_id = crud.get_file_info('plan_check_duplicates.jsonl')['id']
+    with crud.BulkLoader(duplicates_id, defer_indexes=False, dedup_mode=DEDUP_LINK,
+                         storage_mode=STORAGE_COMPACT) as loader:
+        loader.add_batch(_sample_records(rows_per_file))
+    crud.flag_near_duplicates(qa_id)
+
+    # 标注：按记录ID、按 unique_id、批量、按筛选条件
+    crud.update_data_annotations([(1, 'correct'), (make_unique_id(qa_id, 2), 'incorrect')])
+    crud.batch_update_annotations(qa_id, [(3, 'correct'), (make_unique_id(qa_id, 4), 'correct')])
+    crud.batch_update_annotations(qa_id, annotation_result='incorrect', search='question 1',
+                                  annotation_status='not_annotated')
+    crud.batch_update_annotations(scoring_id, annotation_result='5', search='qu', annotation_status='all')
+    crud.update_data_annotations([(make_unique_id(scoring_id, 1), '2')])
+
+    # 列表页：各筛选状态、OFFSET 分页和游标分页、全文检索和短关键词
+    for annotation_status in ('all', 'annotated', 'not_annotated'):
+        page = crud.get_data_records_from_db(qa_id, annotation_status=annotation_status, per_page=10)
+        crud.get_data_records_from_db(qa_id, annotation_status=annotation_status, page=3, per_page=10)
+        if page['next_cursor']:
+            crud.get_data_records_from_db(qa_id, annotation_status=annotation_status, per_page=10,
+                                          cursor=page['next_cursor'], skip_count=True)
+    crud.get_data_records_from_db(qa_id, search='answer 12', per_page=10)
+    crud.get_data_records_from_db(qa_id, search='an', per_page=10)
+
+    # 统计与导出
+    for file_id in (qa_id, scoring_id):
+        crud.get_data_stats_from_db(file_id)
+        crud.rebuild_file_stats(file_id)
+    for file_id, export_type, min_score, max_score in ((qa_id, 'correct', None, None),
+                                                       (qa_id, 'incorrect', None, None),
+                                                       (scoring_id, 'correct', None, None),
+                                                       (scoring_id, 'correct', 2, 4)):
+        query, params = crud.build_export_query(file_id, export_type, min_score, max_score)
+        crud.count_export_rows(query, params)
+        db.get_connection().execute(query, params).fetchmany(10)
+
+    # 标注任务队列：领取（含续期和预取）、标注后再次领取、释放
+    crud.lease_records(qa_id, 'plan-check-a', 10, 10, 60)
+    crud.lease_records(qa_id, 'plan-check-b', 10, 10, 60)
+    crud.update_data_annotations([(make_unique_id(qa_id, 20), 'correct')])
+    crud.lease_records(qa_id, 'plan-check-a', 10, 10, 60)
+    crud.release_leases(qa_id, 'plan-check-b')
+
+    # 编辑日志
+    crud.apply_data_edit(qa_id, 5, {'query': 'edited'})
+    crud.get_pending_edits(qa_id)
+    crud.get_line_offsets(qa_id, [5, 6, 7])
+
+
+def explain(sql: str) -> List[str]:
+    """返回语句的查询计划（每个步骤一行）"""
+    rows = db.get_connection().execute(f'EXPLAIN QUERY PLAN {sql}').fetchall()
+    return [row[3] for row in rows]
+
+
+def find_plan_problems(plan: List[str]) -> List[str]:
+    """找出查询计划中的全表扫描和临时排序步骤"""
+    return [step for step in plan if _SCAN.match(step) or _TEMP_BTREE in step]
+
+
+def check_query_plans(rows_per_file: int = 2000, on_statement: Callable[[Dict], None] = None) -> List[Dict]:
+    """在临时数据库中执行样例负载，对其中每条查询运行 EXPLAIN QUERY PLAN
+
+    返回 [{sql, plan, problems}]（相同语句只检查一次），problems 非空即表示该查询退化为全表扫描或临时排序。
+    """
+    statements = []
+
+    def trace(sql: str):
+        if _CHECKED_STATEMENT.match(sql):
+            statements.append(sql)
+
+    original_database = db.DATABASE_FILE
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db.switch_database(os.path.join(tmpdir, 'plans.db'))
+        try:
+            db.init_database()
+            conn = db.get_connection()
+            conn.set_trace_callback(trace)
+            try:
+                _run_workload(rows_per_file)
+            finally:
+                conn.set_trace_callback(None)
+
+            results = []
+            seen = set()
+            for sql in statements:
+                # 参数已展开为字面量，归一化后去重
+                shape = re.sub(r"'[^']*'|\b\d+(\.\d+)?\b", '?', ' '.join(sql.split()))
+                if shape in seen:
+                    continue
+                seen.add(shape)
+                plan = explain(sql)
+                result = {'sql': ' '.join(sql.split()), 'plan': plan, 'problems': find_plan_problems(plan)}
+                results.append(result)
+                if on_statement:
+                    on_statement(result)
+            return results
+        finally:
+            db.switch_database(original_database)
@@ -1,22 +1,60 @@
+import asyncio
 import json
 import os
+import sqlite3
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import List, Dict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
 
 import aiofiles
-from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Form
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Form, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
 from starlette.staticfiles import StaticFiles
 
-from backend.conf import BASE_PATH
-from backend.core.crud import save_file_info, get_file_info, save_data_records, get_data_records_from_db, \
-    update_data_annotation, get_data_stats_from_db, get_all_files, delete_file_info, export_data_from_db
-from backend.core.db import init_database
-from backend.core.schema import DataUpdateRequest, ExportRequest, AnnotationRequest
-from backend.core.service import allowed_file, read_jsonl_file
-
-app = FastAPI(title="优质数据集筛选系统", version="1.0.0")
+from backend.conf import BASE_PATH, settings
+from backend.core.cache import TTLCache
+from backend.core.db import DATABASE_READY_ENV, is_busy_error
+from backend.core.dedup import DEDUP_MODES
+from backend.core.mapping import parse_field_mapping
+from backend.core.events import FileEventHub
+from backend.core.executor import run_read, run_write, run_ingest, iterate_in_read_pool, GroupCommitWriter
+from backend.core.repository import DATABASE_POSTGRES, get_repository
+from backend.core.jobs import submit_job, get_job_status, resume_jobs_periodically, JOB_INGEST, JOB_EXPORT
+from backend.core.schema import DataUpdateRequest, ExportRequest, AnnotationRequest, BatchAnnotationRequest, \
+    LeaseRequest, LeaseReleaseRequest
+from backend.core.service import allowed_file, missing_dependency, ingest_upload_file, materialize_file_edits, \
+    RecordDecodeError
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    file_events.start()
+    # 接管上次退出时未完成的后台任务
+    resume_task = asyncio.create_task(resume_jobs_periodically())
+    yield
+    resume_task.cancel()
+    annotation_writer.stop()
+    file_events.stop()
+    repository.close()
+
+
+# 存储后端（DATABASE_BACKEND）
+repository = get_repository()
+
+# 标注写入合并提交，多个请求的标注在同一事务中写入
+annotation_writer = GroupCommitWriter(repository.update_data_annotations, settings.ANNOTATION_COMMIT_MAX_DELAY,
+                                      settings.ANNOTATION_COMMIT_MAX_BATCH)
+# 按文件推送标注事件和统计信息（多个工作进程或多个节点共用 PostgreSQL 时经数据库在进程间转发）
+file_events = FileEventHub(repository.get_data_stats_from_db, settings.FILE_EVENT_INTERVAL,
+                           settings.FILE_EVENT_QUEUE_SIZE,
+                           relay=settings.SERVER_WORKERS > 1 or repository.name == DATABASE_POSTGRES,
+                           retention=settings.FILE_EVENT_RETENTION,
+                           on_file_changed=lambda filename: repository.file_cache.invalidate(filename, notify=False))
+# 文件信息缓存失效时通知其他工作进程（单进程时不转发）
+repository.file_cache.on_invalidate = file_events.file_changed
+
+app = FastAPI(title="优质数据集筛选系统", version="1.0.0", lifespan=lifespan)
 
 # CORS配置
 app.add_middleware(
@@ -27,6 +65,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.exception_handler(sqlite3.OperationalError)
+async def database_busy_handler(_: Request, exc: sqlite3.OperationalError):
+    """多次重试后仍等不到写锁（其他进程的导入长时间持有写锁）时返回 503，提示客户端稍后重试"""
+    if not is_busy_error(exc):
+        raise exc
+    return JSONResponse(status_code=503, content={"detail": "数据库繁忙，请稍后重试"},
+                        headers={"Retry-After": "1"})
+
 # 配置
 UPLOAD_FOLDER = os.path.join(BASE_PATH, "uploads")
 OUTPUT_FOLDER = os.path.join(BASE_PATH, "output")
@@ -36,142 +83,370 @@ DIST_DIR = os.path.join(BASE_PATH.parent, "frontend/dist")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
-# 启动时初始化数据库
-init_database()
+# 启动时初始化数据库（由 `webz run` 启动时已在创建工作进程前完成，各工作进程不再重复执行）
+if not os.environ.get(DATABASE_READY_ENV):
+    repository.initialize()
+    repository.ensure_file_stats()
 
 
-async def write_jsonl_file(data: List[Dict], file_path: str) -> bool:
-    """将数据写入JSONL文件"""
-    try:
-        async with aiofiles.open(file_path, 'w', encoding='utf-8') as f:
-            for item in data:
-                # 移除元数据字段
-                clean_item = {k: v for k, v in item.items()
-                              if k not in ['line_number', 'selected', 'quality_score']}
-                await f.write(json.dumps(clean_item, ensure_ascii=False) + '\n')
-        return True
-    except Exception as e:
-        print(f"Error writing file: {e}")
+async def get_file_info(filename: str) -> Optional[dict]:
+    """获取文件信息，命中缓存时直接返回，不进入读线程池"""
+    file_info = repository.cached_file_info(filename)
+    if file_info is not None:
+        return file_info
+    return await run_read(repository.fetch_file_info, filename)
+
+
+# 列表页和统计的序列化响应，键中包含文件版本号，数据变化后旧条目不再命中，由 LRU / TTL 淘汰
+page_cache: TTLCache[bytes] = TTLCache(settings.PAGE_CACHE_SIZE, settings.PAGE_CACHE_TTL)
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+    if not if_none_match:
         return False
+    # 弱比较：忽略 W/ 前缀
+    tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return '*' in tags or etag.removeprefix('W/') in tags
+
+
+async def versioned_response(request: Request, file_id: int, key: Tuple,
+                             load: Callable[[], Awaitable[Dict]]) -> Response:
+    """按文件版本号生成 ETag：客户端持有的仍是最新版本时返回 304，否则优先返回缓存的序列化结果
+
+    版本号须在读取数据之前获取：读取期间发生的写入会使版本号递增，不会把新数据记在旧版本下而长期命中。
+    """
+    version = await run_read(repository.get_file_version, file_id)
+    etag = f'W/"{file_id}-{version}"'
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    cache_key = (*key, file_id, version)
+    body = page_cache.get(cache_key)
+    if body is None:
+        body = JSONResponse(await load()).body
+        page_cache.put(cache_key, body)
+    return Response(body, media_type='application/json', headers=headers)
 
 
 @app.post("/api/upload")
-async def upload_file(file: UploadFile = File(...), annotation_type: str = Form("qa")):
-    """上传JSONL文件"""
+async def upload_file(file: UploadFile = File(...), annotation_type: str = Form("qa"),
+                      background: bool = Form(False), dedup: str = Form(settings.INGEST_DEDUP_MODE),
+                      near_duplicates: bool = Form(False), field_mapping: str = Form("")):
+    """上传数据文件（background 为 True 时后台导入并返回任务ID）
+
+    支持 .jsonl、.jsonl.gz、.jsonl.zst、.csv（首行为列名）和 .parquet，均流式解码后写入数据库。
+
+    dedup 为完全重复记录的处理方式：off 不处理、skip 不写入、link 关联到首条相同内容的记录并继承其标注；
+    near_duplicates 为 True 时导入完成后标记文件内的近似重复记录。
+    field_mapping 为字段映射（"messages" 或 JSON 选择器，见 FieldMapping），使用时保留原始记录，导出时原样输出。
+    """
     if not allowed_file(file.filename):
         raise HTTPException(status_code=400, detail="不支持的文件格式")
+    dependency = missing_dependency(file.filename)
+    if dependency:
+        raise HTTPException(status_code=400, detail=f"解析该格式需要安装 {dependency}")
 
     # 验证标注类型
     if annotation_type not in ["qa", "scoring"]:
         raise HTTPException(status_code=400, detail="不支持的标注类型")
 
+    if dedup not in DEDUP_MODES:
+        raise HTTPException(status_code=400, detail="不支持的去重方式")
+
+    try:
+        mapping = parse_field_mapping(field_mapping)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     # 生成唯一文件名（避免重名）
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"{timestamp}_{file.filename}"
     file_path = os.path.join(UPLOAD_FOLDER, filename)
 
-    # 保存文件
-    content = await file.read()
+    # 分块保存文件，避免将整个文件读入内存
+    file_size = 0
     async with aiofiles.open(file_path, 'wb') as f:
-        await f.write(content)
-
-    # 读取文件数据
-    data = await read_jsonl_file(file_path)
+        while chunk := await file.read(settings.UPLOAD_CHUNK_SIZE):
+            await f.write(chunk)
+            file_size += len(chunk)
 
-    # 保存文件信息到数据库
-    save_file_info(filename, file.filename, len(content), len(data), annotation_type)
+    # 保存文件信息到数据库（记录总数在导入完成后更新）
+    await run_write(repository.save_file_info, filename, file.filename, file_size, 0, annotation_type)
 
     # 获取文件ID
-    file_info = get_file_info(filename)
-    if file_info:
-        # 将数据记录保存到数据库
-        save_data_records(file_info['id'], data)
+    file_info = await get_file_info(filename)
+    if not file_info:
+        raise HTTPException(status_code=500, detail="保存文件信息失败")
+
+    if background:
+        job_id = await run_write(submit_job, JOB_INGEST, {
+            'file_id': file_info['id'],
+            'file_path': file_path,
+            'dedup_mode': dedup,
+            'near_duplicates': near_duplicates,
+            'field_mapping': mapping.to_json() if mapping else None
+        })
+        return {
+            "message": "文件上传成功，正在后台导入",
+            "job_id": job_id,
+            "filename": filename,
+            "original_filename": file.filename,
+            "file_size": file_size,
+            "annotation_type": annotation_type
+        }
+
+    # 流式解析并分批写入数据库（在导入线程中分段提交，不阻塞写队列中的标注）
+    try:
+        summary = await run_ingest(ingest_upload_file, file_info['id'], file_path, dedup, mapping)
+    except RecordDecodeError as e:
+        # 文件损坏：撤销本次上传（已分段提交的记录随文件一起删除）
+        await run_write(repository.delete_file_info, filename)
+        os.remove(file_path)
+        raise HTTPException(status_code=400, detail=str(e))
+    await run_write(repository.update_file_total_records, file_info['id'], summary['total_count'])
+    near_duplicate_count = None
+    if near_duplicates:
+        near_duplicate_count = await run_ingest(repository.flag_near_duplicates, file_info['id'])
 
     return {
         "message": "文件上传成功",
         "filename": filename,
         "original_filename": file.filename,
-        "file_size": len(content),
-        "total_count": len(data),
-        "annotation_type": annotation_type,
-        "data": data
+        "file_size": file_size,
+        "total_count": summary['total_count'],
+        "error_count": summary['error_count'],
+        "errors": summary['errors'],
+        "duplicate_count": summary['duplicate_count'],
+        "near_duplicate_count": near_duplicate_count,
+        "ingest_stats": summary['ingest_stats'],
+        "annotation_type": annotation_type
     }
 
 
 @app.get("/api/data")
 async def get_data(
+        request: Request,
         filename: str = Query(...),
         search: str = Query("", description="搜索关键词"),
         annotation_status: str = Query("all", description="标注状态: all/annotated/not_annotated"),
         selected_only: bool = Query(False, description="仅显示已选择"),
         page: int = Query(1, ge=1, description="页码"),
-        per_page: int = Query(20, ge=1, le=100, description="每页数量")
+        per_page: int = Query(20, ge=1, le=100, description="每页数量"),
+        cursor: Optional[str] = Query(None, description="分页游标（上一页返回的 next_cursor），传入时忽略 page"),
+        skip_count: bool = Query(False, description="不计算总数")
 ):
-    """获取数据（支持筛选和分页）"""
+    """获取数据（支持筛选和分页，带 ETag，数据未变化时返回 304）"""
     # 获取文件信息
-    file_info = get_file_info(filename)
+    file_info = await get_file_info(filename)
     if not file_info:
         raise HTTPException(status_code=404, detail="文件不存在")
 
     # 从数据库获取数据记录
-    result = get_data_records_from_db(
-        file_id=file_info['id'],
-        search=search,
-        annotation_status=annotation_status,
-        selected_only=selected_only,
-        page=page,
-        per_page=per_page
-    )
-
-    return result
+    async def load():
+        try:
+            return await run_read(
+                repository.get_data_records_from_db,
+                file_id=file_info['id'],
+                search=search,
+                annotation_status=annotation_status,
+                selected_only=selected_only,
+                page=page,
+                per_page=per_page,
+                cursor=cursor,
+                skip_count=skip_count
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return await versioned_response(request, file_info['id'],
+                                    ('data', search, annotation_status, selected_only, page, per_page, cursor,
+                                     skip_count), load)
 
 
 @app.post("/api/update")
 async def update_data(request: DataUpdateRequest):
-    """更新数据项"""
-    file_path = os.path.join(UPLOAD_FOLDER, request.filename)
-    if not os.path.exists(file_path):
+    """更新数据项（写入数据库并记录编辑日志，源文件在物化时再改写）"""
+    file_info = await get_file_info(request.filename)
+    if not file_info:
         raise HTTPException(status_code=404, detail="文件不存在")
 
-    # 读取所有数据
-    all_data = await read_jsonl_file(file_path)
-
-    # 更新指定行
-    for item in all_data:
-        if item.get('line_number') == request.line_number:
-            item.update(request.updates)
-            break
+    if await run_write(repository.apply_data_edit, file_info['id'], request.line_number, request.updates):
+        file_events.publish(file_info['id'], {
+            "type": "update",
+            "line_number": request.line_number,
+            "updates": request.updates
+        })
+        return {"message": "更新成功"}
     else:
         raise HTTPException(status_code=404, detail="找不到指定的数据项")
 
-    # 写回文件
-    if await write_jsonl_file(all_data, file_path):
-        return {"message": "更新成功"}
-    else:
-        raise HTTPException(status_code=500, detail="更新失败")
+
+@app.post("/api/file/{filename}/materialize")
+async def materialize_file(filename: str):
+    """将累积的编辑写回上传的源文件"""
+    file_info = await get_file_info(filename)
+    file_path = os.path.join(UPLOAD_FOLDER, filename)
+    if not file_info or not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="文件不存在")
+
+    try:
+        result = await run_write(materialize_file_edits, file_info['id'], file_path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"message": "写回成功", **result}
+
+
+def _publish_linked_annotations(file_ids):
+    """通知标注结果已同步到的重复记录所在文件刷新（一次批量标注的各条记录可能有不同的标注结果，事件中不带标注结果）"""
+    for file_id in file_ids:
+        file_events.publish(file_id, {"type": "bulk_annotation", "linked_duplicates": True})
+        file_events.stats_changed(file_id)
 
 
 @app.post("/api/annotate")
 async def annotate_data(request: AnnotationRequest):
-    """标注数据"""
-    success = update_data_annotation(request.unique_id, request.annotation_result)
+    """标注数据（按记录ID或 unique_id 定位）"""
+    if request.record_key is None:
+        raise HTTPException(status_code=400, detail="请提供 id 或 unique_id")
+
+    record = await annotation_writer.submit((request.record_key, request.annotation_result))
 
-    if success:
+    if record:
+        file_events.publish(record['file_id'], {"type": "annotation", **record})
+        file_events.stats_changed(record['file_id'])
+        _publish_linked_annotations(record['linked_file_ids'])
         return {"message": "标注成功"}
     else:
         raise HTTPException(status_code=404, detail="找不到指定的数据项")
 
 
+@app.post("/api/annotate/batch")
+async def annotate_data_batch(request: BatchAnnotationRequest):
+    """批量标注数据（单个事务），返回更新后的统计信息"""
+    if request.annotations is None and request.annotation_result is None:
+        raise HTTPException(status_code=400, detail="请提供 annotations 或 annotation_result")
+
+    file_info = await get_file_info(request.filename)
+    if not file_info:
+        raise HTTPException(status_code=404, detail="文件不存在")
+
+    annotations = None
+    if request.annotations is not None:
+        annotations = [(item.record_key, item.annotation_result) for item in request.annotations]
+        if any(record_key is None for record_key, _ in annotations):
+            raise HTTPException(status_code=400, detail="请为每条标注提供 id 或 unique_id")
+    result = await run_write(repository.batch_update_annotations, file_info['id'], annotations,
+                             request.annotation_result, request.search, request.annotation_status)
+    stats = await run_read(repository.get_data_stats_from_db, file_info['id'])
+
+    if annotations is not None:
+        missing = set(result['missing'])
+        for record_key, annotation_result in annotations:
+            if record_key not in missing:
+                file_events.publish(file_info['id'], {
+                    "type": "annotation",
+                    "id" if isinstance(record_key, int) else "unique_id": record_key,
+                    "annotation_result": annotation_result
+                })
+    else:
+        file_events.publish(file_info['id'], {
+            "type": "bulk_annotation",
+            "annotation_result": request.annotation_result,
+            "search": request.search,
+            "annotation_status": request.annotation_status,
+            "updated_count": result['updated_count']
+        })
+    file_events.publish(file_info['id'], {"type": "stats", "stats": stats})
+    _publish_linked_annotations(result['linked_file_ids'])
+
+    return {"message": "批量标注成功", **result, "stats": stats}
+
+
+@app.post("/api/queue/lease")
+async def lease_next_batch(request: LeaseRequest):
+    """领取下一批未标注记录（标注任务队列）
+
+    同一文件上的多个标注会话领取到的记录互不重复；返回当前批次 records 和预取的下一批次 prefetch，
+    标注完当前批次后再次领取，上次预取的记录成为当前批次，同时预取新的一批。
+    """
+    file_info = await get_file_info(request.filename)
+    if not file_info:
+        raise HTTPException(status_code=404, detail="文件不存在")
+
+    prefetch = request.count if request.prefetch is None else request.prefetch
+    return await run_write(repository.lease_records, file_info['id'], request.session_id, request.count, prefetch,
+                           settings.WORK_QUEUE_LEASE_SECONDS)
+
+
+@app.post("/api/queue/release")
+async def release_leases(request: LeaseReleaseRequest):
+    """释放标注会话领取的全部记录（退出标注时调用），记录立即重新进入队列"""
+    file_info = await get_file_info(request.filename)
+    if not file_info:
+        raise HTTPException(status_code=404, detail="文件不存在")
+
+    released_count = await run_write(repository.release_leases, file_info['id'], request.session_id)
+    return {"message": "释放成功", "released_count": released_count}
+
+
+@app.get("/api/metrics/annotation-writer")
+async def get_annotation_writer_metrics():
+    """标注合并提交的批大小与提交耗时统计"""
+    return annotation_writer.metrics
+
+
+@app.get("/api/metrics/file-cache")
+async def get_file_cache_metrics():
+    """文件信息缓存的命中率统计"""
+    return repository.file_cache.metrics
+
+
+@app.get("/api/metrics/page-cache")
+async def get_page_cache_metrics():
+    """列表页与统计响应缓存的命中率统计"""
+    return page_cache.metrics
+
+
 @app.post("/api/export")
 async def export_data(request: ExportRequest):
     """导出筛选后的数据"""
     # 获取文件信息
-    file_info = get_file_info(request.filename)
+    file_info = await get_file_info(request.filename)
     if not file_info:
         raise HTTPException(status_code=404, detail="文件不存在")
 
+    if request.background:
+        job_id = await run_write(submit_job, JOB_EXPORT, {
+            'file_id': file_info['id'],
+            'export_name': request.export_name,
+            'export_type': request.export_type,
+            'min_score': request.min_score,
+            'max_score': request.max_score
+        })
+        return {"message": "导出任务已创建", "job_id": job_id}
+
+    if request.stream:
+        # 流式返回：边查询边序列化，不落盘
+        try:
+            query, params = await run_read(repository.build_export_query, file_info['id'], request.export_type,
+                                           request.min_score, request.max_score)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        chunks = (chunk for chunk, _ in repository.iter_export_chunks(query, params))
+        return StreamingResponse(
+            iterate_in_read_pool(chunks),
+            media_type='application/x-ndjson',
+            headers={'Content-Disposition': f'attachment; filename="{request.export_name}"'}
+        )
+
     # 导出指定类型的数据（正确或错误）
-    result = await export_data_from_db(file_info['id'], request.export_name, request.export_type)
+    try:
+        result = await run_read(repository.export_data_from_db, file_info['id'], request.export_name,
+                                request.export_type, request.min_score, request.max_score)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     if result:
         export_type_text = "正确" if request.export_type == "correct" else "错误"
@@ -185,6 +460,34 @@ async def export_data(request: ExportRequest):
         raise HTTPException(status_code=500, detail="导出失败")
 
 
+@app.get("/api/jobs/{job_id}")
+async def get_job_api(job_id: str):
+    """获取后台任务状态（已处理行数、吞吐量、预计剩余时间）"""
+    job = await run_read(get_job_status, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """以 SSE 推送后台任务进度，任务结束后关闭连接"""
+    job = await run_read(get_job_status, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在")
+
+    async def event_stream():
+        current = job
+        while True:
+            yield f"data: {json.dumps(current, ensure_ascii=False)}\n\n"
+            if current['status'] in ('completed', 'failed'):
+                break
+            await asyncio.sleep(settings.JOB_EVENT_INTERVAL)
+            current = await run_read(get_job_status, job_id)
+
+    return StreamingResponse(event_stream(), media_type='text/event-stream')
+
+
 @app.get("/api/download/{filename}")
 async def download_file(filename: str):
     """下载文件"""
@@ -196,24 +499,52 @@ async def download_file(filename: str):
 
 
 @app.get("/api/stats/{filename}")
-async def get_stats(filename: str):
-    """获取数据统计信息"""
+async def get_stats(request: Request, filename: str):
+    """获取数据统计信息（带 ETag，统计未变化时返回 304）"""
     # 获取文件信息
-    file_info = get_file_info(filename)
+    file_info = await get_file_info(filename)
     if not file_info:
         raise HTTPException(status_code=404, detail="文件不存在")
 
     # 从数据库获取统计信息
-    stats = get_data_stats_from_db(file_info['id'])
+    return await versioned_response(request, file_info['id'], ('stats',),
+                                    lambda: run_read(repository.get_data_stats_from_db, file_info['id']))
+
+
+@app.get("/api/stats/{filename}/events")
+async def stats_events(filename: str):
+    """以 SSE 推送文件的标注事件和最新统计信息，连接建立时先推送一次当前统计"""
+    file_info = await get_file_info(filename)
+    if not file_info:
+        raise HTTPException(status_code=404, detail="文件不存在")
+
+    file_id = file_info['id']
+    queue = file_events.subscribe(file_id)
+
+    async def event_stream():
+        try:
+            stats = await run_read(repository.get_data_stats_from_db, file_id)
+            yield f"data: {json.dumps({'type': 'stats', 'stats': stats}, ensure_ascii=False)}\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), settings.FILE_EVENT_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+                if event['type'] == 'deleted':
+                    break
+        finally:
+            file_events.unsubscribe(file_id, queue)
 
-    return stats
+    return StreamingResponse(event_stream(), media_type='text/event-stream')
 
 
 @app.get("/api/files")
 async def get_files():
     """获取所有文件列表"""
     try:
-        files = get_all_files()
+        files = await run_read(repository.get_all_files)
 
         # 格式化文件大小
         for file in files:
@@ -238,7 +569,7 @@ async def get_files():
 async def get_file_info_api(filename: str):
     """获取指定文件的详细信息"""
     try:
-        file_info = get_file_info(filename)
+        file_info = await get_file_info(filename)
         if not file_info:
             raise HTTPException(status_code=404, detail="文件不存在")
 
@@ -275,7 +606,10 @@ async def delete_file(filename: str):
         os.remove(file_path)
 
         # 删除数据库记录（软删除）
-        delete_file_info(filename)
+        file_info = await get_file_info(filename)
+        await run_write(repository.delete_file_info, filename)
+        if file_info:
+            file_events.publish(file_info['id'], {"type": "deleted"})
 
         return {"message": "文件删除成功"}
     except HTTPException:
@@ -285,7 +619,9 @@ async def delete_file(filename: str):
 
 
 # Mount static files AFTER all API routes
-app.mount("/assets", StaticFiles(directory=os.path.join(DIST_DIR, "assets")), name="assets")
+# frontend/dist 不随仓库提交，需在 frontend 目录执行 `npm run build` 生成；未构建时只提供 API
+if os.path.isdir(os.path.join(DIST_DIR, "assets")):
+    app.mount("/assets", StaticFiles(directory=os.path.join(DIST_DIR, "assets")), name="assets")
 
 
 # 根路由返回 index.html (MUST be LAST to avoid catching API routes)
@@ -295,7 +631,8 @@ async def serve_vue(full_path: str):
     if os.path.exists(index_path):
         return FileResponse(index_path)
     else:
-        return {"error": "index.html not found"}
+        return JSONResponse(status_code=404,
+                            content={"error": "前端未构建，请在 frontend 目录执行 npm install && npm run build"})
 
 
 if __name__ == "__main__":
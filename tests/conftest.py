@@ -0,0 +1,48 @@
+import json
+
+import pytest
+
+from backend.core import db
+from backend.core.repository import get_repository
+
+
+@pytest.fixture
+def repository(tmp_path):
+    """在临时 SQLite 数据库上运行的存储后端"""
+    original_database = db.DATABASE_FILE
+    db.switch_database(str(tmp_path / 'test.db'))
+    repository = get_repository()
+    repository.file_cache.invalidate()
+    repository.initialize()
+    yield repository
+    db.switch_database(original_database)
+    repository.file_cache.invalidate()
+
+
+@pytest.fixture
+def create_file(repository, tmp_path):
+    """写入 JSONL 样例文件并登记文件信息，返回 (文件ID, 路径)"""
+    def create(filename: str, records, annotation_type: str = 'qa'):
+        path = tmp_path / filename
+        with open(path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write((record if isinstance(record, str) else json.dumps(record, ensure_ascii=False)) + '\n')
+        repository.save_file_info(filename, filename, path.stat().st_size, 0, annotation_type)
+        return repository.get_file_info(filename)['id'], str(path)
+
+    return create
+
+
+@pytest.fixture
+def client(repository, tmp_path, monkeypatch):
+    """直接调用应用的测试客户端（上传目录为临时目录，不执行启动和关闭流程）"""
+    from fastapi.testclient import TestClient
+
+    from backend import main
+
+    upload_folder = tmp_path / 'uploads'
+    upload_folder.mkdir()
+    monkeypatch.setattr(main, 'UPLOAD_FOLDER', str(upload_folder))
+    # 缓存键中的文件ID和版本号在各测试的临时数据库间会重复
+    main.page_cache.invalidate()
+    return TestClient(main.app)
@@ -0,0 +1,32 @@
+import json
+
+from backend import main
+
+
+def _upload(client, name: str, rows: int, dedup: str = 'off') -> str:
+    lines = ''.join(json.dumps({'query': f'question {n}', 'response': f'answer {n}'}) + '\n'
+                    for n in range(1, rows + 1))
+    response = client.post('/api/upload', files={'file': (name, lines.encode())}, data={'dedup': dedup})
+    assert response.status_code == 200
+    return response.json()['filename']
+
+
+def test_batch_annotation_notifies_linked_files_without_a_label(client, monkeypatch):
+    original = _upload(client, 'original.jsonl', 3)
+    linked = _upload(client, 'linked.jsonl', 3, dedup='link')
+    linked_id = client.get(f'/api/file/{linked}').json()['file_info']['id']
+
+    events = []
+    monkeypatch.setattr(main.file_events, 'publish', lambda file_id, event: events.append((file_id, event)))
+    original_id = client.get(f'/api/file/{original}').json()['file_info']['id']
+    response = client.post('/api/annotate/batch', json={'filename': original, 'annotations': [
+        {'unique_id': f'{original_id}_1', 'annotation_result': 'correct'},
+        {'unique_id': f'{original_id}_2', 'annotation_result': 'incorrect'},
+    ]})
+    assert response.status_code == 200
+    assert response.json()['linked_file_ids'] == [linked_id]
+
+    assert [event for file_id, event in events if file_id == linked_id] == \
+        [{'type': 'bulk_annotation', 'linked_duplicates': True}]
+    linked_records = client.get('/api/data', params={'filename': linked}).json()['data']
+    assert [item['annotation_result'] for item in linked_records] == ['correct', 'incorrect', None]
@@ -0,0 +1,59 @@
+import time
+
+from backend.core.cache import TTLCache
+
+
+def test_stale_generation_is_not_cached():
+    cache = TTLCache(max_size=10, ttl=60)
+    generation = cache.generation
+    # 读取数据库期间发生了失效：旧值不写入缓存
+    cache.invalidate('a')
+    cache.put('a', 'old', generation=generation)
+    assert cache.get('a') is None
+
+    cache.put('a', 'new', generation=cache.generation)
+    assert cache.get('a') == 'new'
+
+
+def test_invalidate_key_or_all():
+    cache = TTLCache(max_size=10, ttl=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.invalidate('a')
+    assert (cache.get('a'), cache.get('b')) == (None, 2)
+    cache.invalidate()
+    assert cache.get('b') is None
+    assert cache.metrics['invalidations'] == 2
+
+
+def test_on_invalidate_is_called_unless_notify_is_false():
+    cache = TTLCache(max_size=10, ttl=60)
+    notified = []
+    cache.on_invalidate = notified.append
+    cache.invalidate('a')
+    cache.invalidate()
+    cache.invalidate('b', notify=False)
+    assert notified == ['a', None]
+    assert cache.generation == 3
+
+
+def test_lru_eviction_and_expiry():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (1, None, 3)
+    assert cache.metrics['evictions'] == 1
+
+    cache = TTLCache(max_size=2, ttl=0.01)
+    cache.put('a', 1)
+    time.sleep(0.02)
+    assert cache.get('a') is None
+    assert cache.metrics['expirations'] == 1
+
+
+def test_disabled_cache_stores_nothing():
+    cache = TTLCache(max_size=0, ttl=60)
+    cache.put('a', 1)
+    assert cache.get('a') is None
@@ -0,0 +1,24 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from backend.core import db
+
+
+def test_close_releases_connections_of_all_threads(repository):
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        connections = list(pool.map(lambda _: db.get_connection(), range(8)))
+        repository.close()
+        for conn in set(connections):
+            with pytest.raises(sqlite3.ProgrammingError):
+                conn.execute('SELECT 1')
+        # 各线程之后重新建立连接
+        assert pool.submit(lambda: db.get_connection().execute('SELECT 1').fetchone()).result() == (1,)
+
+
+def test_switching_database_resets_fts_detection(repository, tmp_path):
+    assert db.fts_enabled()
+    # 未初始化的数据库中没有全文索引表
+    db.switch_database(str(tmp_path / 'empty.db'))
+    assert not db.fts_enabled()
@@ -0,0 +1,69 @@
+import asyncio
+
+from backend.core.events import FileEventHub
+
+
+def _hub(**kwargs) -> FileEventHub:
+    return FileEventHub(lambda file_id: {'total_count': 0}, interval=0.01, queue_size=10, relay=True, **kwargs)
+
+
+async def _wait_for(condition, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "等待转发超时"
+        await asyncio.sleep(0.01)
+
+
+def test_events_are_relayed_to_subscribers_of_other_workers(repository):
+    async def run():
+        publisher, receiver = _hub(), _hub()
+        queue = receiver.subscribe(1)
+        # 订阅者所在进程从开始转发时的最新事件之后读取
+        await asyncio.sleep(0.05)
+        publisher.publish(1, {'type': 'annotation', 'id': 7, 'annotation_result': 'correct'})
+        await _wait_for(lambda: not queue.empty())
+        publisher.stop()
+        receiver.stop()
+        return queue.get_nowait()
+
+    assert asyncio.run(run()) == {'type': 'annotation', 'id': 7, 'annotation_result': 'correct'}
+
+
+def test_file_changes_are_relayed_without_subscribers(repository):
+    async def run():
+        changed = []
+        publisher, receiver = _hub(), _hub(on_file_changed=changed.append)
+        publisher.start()
+        receiver.start()
+        await asyncio.sleep(0.05)
+        # 可在其他线程中调用（存储层在读写线程中失效缓存）
+        await asyncio.to_thread(publisher.file_changed, 'a.jsonl')
+        await _wait_for(lambda: changed)
+        publisher.stop()
+        receiver.stop()
+        return changed
+
+    assert asyncio.run(run()) == ['a.jsonl']
+
+
+def test_file_cache_invalidation_reaches_other_workers(repository):
+    async def run():
+        publisher = _hub()
+        receiver = _hub(on_file_changed=lambda filename: repository.file_cache.invalidate(filename, notify=False))
+        repository.file_cache.on_invalidate = publisher.file_changed
+        try:
+            publisher.start()
+            receiver.start()
+            await asyncio.sleep(0.05)
+            repository.save_file_info('cached.jsonl', 'cached.jsonl', 0, 0)
+            generation = repository.file_cache.generation
+            # 本进程的失效只通知一次，收到的通知不会再次转发
+            await _wait_for(lambda: repository.file_cache.generation > generation)
+            await asyncio.sleep(0.05)
+            return repository.file_cache.generation - generation
+        finally:
+            repository.file_cache.on_invalidate = None
+            publisher.stop()
+            receiver.stop()
+
+    assert asyncio.run(run()) == 1
@@ -0,0 +1,54 @@
+import asyncio
+
+from backend.core.executor import GroupCommitWriter
+
+
+def test_writes_are_committed_in_batches():
+    batches = []
+
+    def apply_batch(items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+
+    async def run():
+        writer = GroupCommitWriter(apply_batch, max_delay=0.05, max_batch=3)
+        try:
+            return await asyncio.gather(*(writer.submit(n) for n in range(5))), writer.metrics
+        finally:
+            writer.stop()
+
+    results, metrics = asyncio.run(run())
+    assert results == [0, 10, 20, 30, 40]
+    assert batches == [[0, 1, 2], [3, 4]]
+    assert (metrics['batch_count'], metrics['item_count'], metrics['max_batch_size']) == (2, 5, 3)
+
+
+def test_failed_batch_does_not_affect_later_batches():
+    def apply_batch(items):
+        if 'bad' in items:
+            raise RuntimeError('commit failed')
+        return [item.upper() for item in items]
+
+    async def run():
+        writer = GroupCommitWriter(apply_batch, max_delay=0.05, max_batch=2)
+        try:
+            failed = await asyncio.gather(writer.submit('bad'), writer.submit('a'), return_exceptions=True)
+            # 提交失败后后台任务继续处理新的写操作
+            succeeded = await asyncio.gather(writer.submit('b'), writer.submit('c'))
+            return failed, succeeded, writer.metrics['batch_count']
+        finally:
+            writer.stop()
+
+    failed, succeeded, batch_count = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in failed)
+    assert succeeded == ['B', 'C']
+    # 失败的批次不计入提交统计
+    assert batch_count == 1
+
+
+def test_writer_restarts_on_new_event_loop():
+    writer = GroupCommitWriter(lambda items: items, max_delay=0, max_batch=10)
+    assert asyncio.run(writer.submit(1)) == 1
+    assert asyncio.run(writer.submit(2)) == 2
+    writer.stop()
+
@@ -0,0 +1,57 @@
+import json
+
+from backend import main
+
+
+def _upload(client, filename: str = 'cached.jsonl', count: int = 30) -> str:
+    lines = ''.join(json.dumps({'query': f'question {n}', 'response': f'answer {n}'}) + '\n'
+                    for n in range(1, count + 1))
+    response = client.post('/api/upload', files={'file': (filename, lines.encode())})
+    assert response.status_code == 200
+    return response.json()['filename']
+
+
+def test_unchanged_data_returns_304(client):
+    filename = _upload(client)
+    first = client.get('/api/data', params={'filename': filename})
+    assert first.status_code == 200
+    etag = first.headers['etag']
+
+    second = client.get('/api/data', params={'filename': filename}, headers={'If-None-Match': etag})
+    assert second.status_code == 304
+    assert second.headers['etag'] == etag
+    # 弱比较忽略 W/ 前缀，列表中任意一个匹配即可
+    third = client.get(f'/api/stats/{filename}', headers={'If-None-Match': f'"other", {etag.removeprefix("W/")}'})
+    assert third.status_code == 304
+
+
+def test_annotation_changes_etag(client):
+    filename = _upload(client)
+    first = client.get('/api/data', params={'filename': filename})
+    record_id = first.json()['data'][0]['id']
+
+    response = client.post('/api/annotate', json={'id': record_id, 'annotation_result': 'correct'})
+    assert response.status_code == 200
+
+    second = client.get('/api/data', params={'filename': filename}, headers={'If-None-Match': first.headers['etag']})
+    assert second.status_code == 200
+    assert second.headers['etag'] != first.headers['etag']
+    assert second.json()['data'][0]['annotation_result'] == 'correct'
+
+
+def test_page_cache_is_keyed_by_query(client):
+    filename = _upload(client)
+    hits = main.page_cache.hits
+
+    pages = [client.get('/api/data', params={'filename': filename, 'page': page, 'per_page': 10}).json()
+             for page in (1, 2, 1)]
+    assert [item['line_number'] for item in pages[0]['data']] == list(range(1, 11))
+    assert [item['line_number'] for item in pages[1]['data']] == list(range(11, 21))
+    assert pages[2] == pages[0]
+    assert main.page_cache.hits == hits + 1
+
+    searched = client.get('/api/data', params={'filename': filename, 'search': 'question 3', 'per_page': 10}).json()
+    assert searched['data'] and all('question 3' in item['query'] for item in searched['data'])
+    # 统计与列表页使用不同的键
+    stats = client.get(f'/api/stats/{filename}').json()
+    assert stats['total_count'] == 30
@@ -0,0 +1,55 @@
+from backend.core.mapping import FieldMapping
+from backend.core.service import ingest_upload_file
+
+
+def test_non_string_fields_are_stored_as_text(repository, create_file):
+    file_id, path = create_file('mixed.jsonl', [
+        {'system': 's', 'query': 123, 'response': 'answer'},
+        {'query': None, 'response': 4.5},
+        {'system': False, 'query': ['a', 'b'], 'response': {'text': 'c'}},
+    ])
+    summary = ingest_upload_file(file_id, path)
+    assert summary['total_count'] == 3
+    assert summary['error_count'] == 0
+
+    records = repository.get_data_records_from_db(file_id)['data']
+    assert [(item['system'], item['query'], item['response']) for item in records] == [
+        ('s', '123', 'answer'),
+        ('', '', '4.5'),
+        ('False', 'a\n\nb', 'c'),
+    ]
+
+
+def test_unreadable_fields_are_reported_per_line(repository, create_file):
+    file_id, path = create_file('broken_messages.jsonl', [
+        {'messages': 5},
+        {'messages': [{'role': 'user', 'content': 'q'}, {'role': 'assistant', 'content': 'a'}]},
+        'not json',
+    ])
+    summary = ingest_upload_file(file_id, path, field_mapping=FieldMapping('messages'))
+    assert summary['total_count'] == 1
+    assert summary['error_count'] == 2
+    assert sorted(error['line_number'] for error in summary['errors']) == [1, 3]
+
+    records = repository.get_data_records_from_db(file_id)['data']
+    assert [(item['line_number'], item['query'], item['response']) for item in records] == [(2, 'q', 'a')]
+
+
+def test_search_pages_follow_line_order_after_reimport(repository, create_file):
+    file_id, path = create_file('reimported.jsonl', [
+        {'query': f'question {n}', 'response': f'shared answer {n}'} for n in range(1, 6)
+    ])
+    ingest_upload_file(file_id, path)
+    # 重新导入第 2 行：记录被替换后ID排在最后，与行号不再同序
+    with repository.bulk_loader(file_id, defer_indexes=False) as loader:
+        loader.add_batch([{'line_number': 2, 'query': 'question 2', 'response': 'shared answer 2 again'}])
+
+    lines, cursor = [], None
+    while True:
+        page = repository.get_data_records_from_db(file_id, search='shared answer', per_page=2, cursor=cursor)
+        lines.extend(item['line_number'] for item in page['data'])
+        assert all('<mark>' in item['highlight'] for item in page['data'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert lines == [1, 2, 3, 4, 5]
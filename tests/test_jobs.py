@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+from backend.conf import settings
+from backend.core import jobs
+from backend.core.jobs import JOB_INGEST, WORKER_ID
+
+OTHER_WORKER = 'other-worker'
+
+
+class _Interrupted(Exception):
+    """模拟工作进程在导入中途退出"""
+
+
+def _ingest_job(repository, create_file, count: int):
+    file_id, path = create_file('job.jsonl', [{'query': f'question {n}', 'response': f'answer {n}'}
+                                              for n in range(1, count + 1)])
+    return file_id, repository.create_job(JOB_INGEST, {'file_id': file_id, 'file_path': path})
+
+
+def test_job_is_claimed_by_one_worker(repository):
+    job_id = repository.create_job(JOB_INGEST, {})
+    stale_before = time.time() - settings.JOB_STALE_SECONDS
+
+    job = repository.claim_job(job_id, WORKER_ID, stale_before)
+    assert job['status'] == 'running'
+    assert repository.claim_job(job_id, OTHER_WORKER, stale_before) is None
+    assert repository.list_resumable_jobs(stale_before) == []
+
+
+def test_heartbeat_keeps_job_and_stale_job_is_taken_over(repository):
+    job_id = repository.create_job(JOB_INGEST, {})
+    repository.claim_job(job_id, WORKER_ID, time.time() - settings.JOB_STALE_SECONDS)
+    assert repository.update_job_progress(job_id, WORKER_ID, 10, 0.5, {'offset': 100})
+
+    # 心跳在 stale_before 之前即视为中断，可被其他进程接管
+    stale_before = time.time() + 1
+    assert repository.list_resumable_jobs(stale_before) == [job_id]
+    job = repository.claim_job(job_id, OTHER_WORKER, stale_before)
+    assert (job['processed'], job['checkpoint']) == (10, {'offset': 100})
+
+    # 原进程的心跳和结束状态不再生效
+    assert not repository.update_job_progress(job_id, WORKER_ID, 20, 0.9)
+    repository.finish_job(job_id, WORKER_ID, 'completed')
+    assert repository.get_job(job_id)['status'] == 'running'
+
+
+def test_interrupted_ingest_resumes_from_checkpoint(repository, create_file, monkeypatch):
+    count = settings.INGEST_BATCH_SIZE * 2 + 5
+    file_id, job_id = _ingest_job(repository, create_file, count)
+    monkeypatch.setattr(settings, 'JOB_COMMIT_BATCHES', 1)
+
+    update_job_progress = repository.update_job_progress
+    calls = []
+
+    def interrupt_second_checkpoint(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 2:
+            raise _Interrupted()
+        return update_job_progress(*args, **kwargs)
+
+    monkeypatch.setattr(repository, 'update_job_progress', interrupt_second_checkpoint)
+    job = repository.claim_job(job_id, WORKER_ID, time.time() - settings.JOB_STALE_SECONDS)
+    with pytest.raises(_Interrupted):
+        jobs._run_ingest(job)
+    monkeypatch.setattr(repository, 'update_job_progress', update_job_progress)
+
+    # 只保留第一次断点之前提交的记录
+    assert repository.get_data_stats_from_db(file_id)['total_count'] == settings.INGEST_BATCH_SIZE
+
+    job = repository.claim_job(job_id, WORKER_ID, time.time() + 1)
+    assert job['processed'] == settings.INGEST_BATCH_SIZE
+    result = jobs._run_ingest(job)
+    assert result['total_count'] == count
+
+    lines = [item['line_number'] for item in
+             repository.get_data_records_from_db(file_id, per_page=count, skip_count=True)['data']]
+    assert lines == list(range(1, count + 1))
+
+
+def test_failed_job_records_error(repository):
+    job_id = repository.create_job(JOB_INGEST, {'file_id': 1, 'file_path': '/nonexistent/job.jsonl'})
+    jobs._run_job(job_id)
+    job = repository.get_job(job_id)
+    assert job['status'] == 'failed'
+    assert job['error']
@@ -0,0 +1,71 @@
+import pytest
+
+from backend.core.mapping import FieldMapping, parse_field_mapping
+
+
+def test_selectors():
+    mapping = FieldMapping({
+        'system': '$.meta.prompts[0]',
+        'query': 'turns[?role=user].text',
+        'response': '$.turns[-1].text',
+    })
+    record = {
+        'meta': {'prompts': ['sys', 'unused']},
+        'turns': [
+            {'role': 'user', 'text': 'q1'},
+            {'role': 'assistant', 'text': 'a1'},
+            {'role': 'user', 'text': 'q2'},
+            {'role': 'assistant', 'text': 'a2'},
+        ],
+    }
+    assert mapping.apply(record) == ('sys', 'q1\n\nq2', 'a2')
+
+
+def test_unspecified_fields_use_same_name_keys():
+    mapping = FieldMapping('{"query": "$.input", "response": "output[*]"}')
+    assert mapping.apply({'system': 's', 'input': 7, 'output': ['x', None, 'y']}) == ('s', '7', 'x\n\ny')
+    # 选中的路径不存在时为空串
+    assert mapping.apply({}) == ('', '', '')
+
+
+def test_messages_adapter():
+    mapping = FieldMapping('messages')
+    record = {'messages': [
+        {'role': 'system', 'content': 'be brief'},
+        {'role': 'user', 'content': [{'type': 'text', 'text': 'hello'}]},
+        {'role': 'assistant', 'content': 'hi'},
+    ]}
+    assert mapping.apply(record) == ('be brief', 'hello', 'hi')
+
+
+def test_messages_adapter_multi_turn_with_aliases():
+    mapping = FieldMapping({'adapter': 'messages', 'field': 'conversations'})
+    record = {'system': 'top level', 'conversations': [
+        {'from': 'human', 'value': 'q1'},
+        {'from': 'gpt', 'value': 'a1'},
+        {'from': 'human', 'value': 'q2'},
+        {'from': 'gpt', 'value': 'a2'},
+    ]}
+    assert mapping.apply(record) == ('top level', 'user: q1\n\nassistant: a1\n\nuser: q2', 'a2')
+
+
+def test_messages_adapter_without_final_answer():
+    mapping = FieldMapping('messages')
+    assert mapping.apply({'messages': [{'role': 'user', 'content': 'q'}]}) == ('', 'q', '')
+
+
+@pytest.mark.parametrize('spec, message', [
+    ('{"adapter": "alpaca"}', '不支持的字段映射适配器'),
+    ('{"prompt": "$.a"}', '未知的键'),
+    ('{"query": "$.a[x]"}', '无法解析字段选择器'),
+    ('[1]', '必须是'),
+    ('{"query": ', '不是合法的 JSON'),
+])
+def test_invalid_mappings(spec, message):
+    with pytest.raises(ValueError, match=message):
+        parse_field_mapping(spec)
+
+
+def test_empty_mapping_reads_default_keys():
+    assert parse_field_mapping('') is None
+    assert parse_field_mapping('  ') is None
@@ -0,0 +1,111 @@
+import csv
+import gzip
+import json
+
+import pytest
+
+from backend.core.service import RAW_LINE_KEY, RecordDecodeError, open_record_reader
+
+_RECORDS = [{'query': f'问题 {n}', 'response': f'answer {n}\nsecond line'} for n in range(1, 8)]
+
+
+def _write_jsonl(path, compress=None):
+    data = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in _RECORDS).encode()
+    # 空行和非法行计入行号但不产出记录
+    data = data.replace(b'\n', b'\n\nnot json\n', 1)
+    path.write_bytes(compress(data) if compress else data)
+
+
+def _write_csv(path, compress=None):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['query', 'response'])
+        writer.writeheader()
+        writer.writerows(_RECORDS)
+
+
+def _zstd_compress(data: bytes) -> bytes:
+    zstandard = pytest.importorskip('zstandard')
+    return zstandard.ZstdCompressor().compress(data)
+
+
+_FORMATS = {
+    'jsonl': (_write_jsonl, None),
+    'jsonl.gz': (_write_jsonl, gzip.compress),
+    'jsonl.zst': (_write_jsonl, _zstd_compress),
+    'csv': (_write_csv, None),
+}
+
+
+def _fields(records):
+    return [(record['line_number'], record['query'], record['response']) for record in records]
+
+
+@pytest.fixture(params=list(_FORMATS))
+def sample_file(request, tmp_path):
+    write, compress = _FORMATS[request.param]
+    path = tmp_path / f'sample.{request.param}'
+    write(path, compress)
+    return str(path)
+
+
+def test_reads_all_records(sample_file):
+    reader = open_record_reader(sample_file)
+    records = list(reader)
+    assert [(query, response) for _, query, response in _fields(records)] == \
+           [(record['query'], record['response']) for record in _RECORDS]
+    assert reader.progress == 1.0
+    if sample_file.endswith('.csv'):
+        assert reader.error_count == 0
+    else:
+        assert reader.error_count == 1
+        assert reader.errors[0]['line_number'] == 3
+
+
+def test_resume_from_checkpoint(sample_file):
+    expected = _fields(open_record_reader(sample_file))
+
+    reader = open_record_reader(sample_file)
+    first = []
+    for record in reader:
+        first.append(record)
+        if len(first) == 3:
+            break
+    checkpoint = {'start_offset': reader.offset, 'start_line': reader.line_number}
+
+    resumed = open_record_reader(sample_file, **checkpoint)
+    assert _fields(first) + _fields(resumed) == expected
+
+
+def test_jsonl_records_carry_offsets_and_raw_line(tmp_path):
+    path = tmp_path / 'offsets.jsonl'
+    _write_jsonl(path)
+    data = path.read_bytes()
+    for record in open_record_reader(str(path)):
+        line = data[record['byte_offset']:record['byte_offset'] + record['byte_length']]
+        assert json.loads(line) == json.loads(record[RAW_LINE_KEY])
+
+
+def test_compressed_records_have_no_offsets(tmp_path):
+    path = tmp_path / 'offsets.jsonl.gz'
+    _write_jsonl(path, gzip.compress)
+    assert all('byte_offset' not in record for record in open_record_reader(str(path)))
+
+
+def test_truncated_gzip_raises_decode_error(tmp_path):
+    path = tmp_path / 'truncated.jsonl.gz'
+    _write_jsonl(path, gzip.compress)
+    data = path.read_bytes()
+    path.write_bytes(data[:len(data) - 10])
+    with pytest.raises(RecordDecodeError):
+        list(open_record_reader(str(path)))
+
+
+def test_malformed_csv_stops_with_error(tmp_path):
+    path = tmp_path / 'broken.csv'
+    rows = ''.join(f'q{n},a{n}\n' for n in range(1, 10001))
+    path.write_bytes(f'query,response\n{rows}'.encode() + b'q,\xff\xfe\nlast,row\n')
+    reader = open_record_reader(str(path))
+    # 按块解码，错误所在块之前的数据行照常产出，之后停止解析
+    queries = [record['query'] for record in reader]
+    assert queries and queries == [f'q{n}' for n in range(1, len(queries) + 1)]
+    assert reader.error_count == 1
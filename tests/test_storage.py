@@ -0,0 +1,44 @@
+import random
+
+import pytest
+
+from backend.core import db
+from backend.core.storage import STORAGE_COMPACT, compression_available
+
+pytestmark = pytest.mark.skipif(not compression_available(), reason='未安装 zstandard')
+
+
+def _records(seed: int, count: int = 500):
+    rng = random.Random(seed)
+    words = [f'{seed}-{rng.getrandbits(32):08x}' for _ in range(200)]
+    return [{'line_number': n, 'system': 'system prompt',
+             'query': f'question {n}', 'response': ' '.join(rng.choices(words, k=80))}
+            for n in range(1, count + 1)]
+
+
+def _load_compact(repository, filename: str, records):
+    repository.save_file_info(filename, filename, 0, 0)
+    file_id = repository.get_file_info(filename)['id']
+    with repository.bulk_loader(file_id, storage_mode=STORAGE_COMPACT) as loader:
+        loader.add_batch(records)
+    assert loader.stats['compressed_text_count'] == len(records)
+    return file_id
+
+
+def _responses(repository, file_id: int):
+    page = repository.get_data_records_from_db(file_id, per_page=100)
+    return [item['response'] for item in page['data']]
+
+
+def test_dictionaries_are_not_shared_between_databases(repository, tmp_path):
+    first = _records(1)
+    first_id = _load_compact(repository, 'first.jsonl', first)
+    assert _responses(repository, first_id) == [record['response'] for record in first[:100]]
+
+    # 切换到另一个数据库，其中的字典ID与前一个数据库相同
+    db.switch_database(str(tmp_path / 'other.db'))
+    repository.file_cache.invalidate()
+    repository.initialize()
+    second = _records(2)
+    second_id = _load_compact(repository, 'second.jsonl', second)
+    assert _responses(repository, second_id) == [record['response'] for record in second[:100]]
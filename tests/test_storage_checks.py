@@ -0,0 +1,29 @@
+import os
+
+import pytest
+
+from backend.devtools.conformance import check_storage, _StorageChecks
+from backend.devtools.plans import check_query_plans
+
+# 设置后同时对 PostgreSQL 执行一致性检查（请使用专门用于检查的数据库）
+POSTGRES_DSN = os.environ.get('WEBZ_TEST_POSTGRES_DSN')
+
+
+def test_query_plans_use_indexes():
+    results = check_query_plans()
+    assert results
+    problems = {result['sql']: result['problems'] for result in results if result['problems']}
+    assert not problems
+
+
+@pytest.mark.parametrize('backend, dsn', [
+    ('sqlite', None),
+    pytest.param('postgres', POSTGRES_DSN,
+                 marks=pytest.mark.skipif(not POSTGRES_DSN, reason='未设置 WEBZ_TEST_POSTGRES_DSN')),
+])
+def test_storage_conformance(backend, dsn):
+    results = check_storage(backend, dsn)
+    failed = {result['name']: result['detail'] for result in results if not result['ok']}
+    assert not failed
+    # 样例数据写入失败时后续检查不会执行
+    assert [result['name'] for result in results] == list(_StorageChecks.CHECKS)
@@ -0,0 +1,27 @@
+import gzip
+import json
+import os
+
+from backend import main
+
+
+def _gzip_lines(count: int) -> bytes:
+    lines = ''.join(json.dumps({'query': f'question {n}', 'response': f'answer {n} ' * 50}) + '\n'
+                    for n in range(1, count + 1))
+    return gzip.compress(lines.encode())
+
+
+def test_upload_gzip(client):
+    response = client.post('/api/upload', files={'file': ('sample.jsonl.gz', _gzip_lines(10))})
+    assert response.status_code == 200
+    assert response.json()['total_count'] == 10
+
+
+def test_truncated_gzip_is_rejected_without_leftovers(client, repository):
+    data = _gzip_lines(2000)
+    response = client.post('/api/upload', files={'file': ('truncated.jsonl.gz', data[:len(data) // 2])})
+    assert response.status_code == 400
+    assert '解压文件失败' in response.json()['detail']
+
+    assert os.listdir(main.UPLOAD_FOLDER) == []
+    assert repository.get_all_files() == []